@@ -1,13 +1,31 @@
+import os
+import sys
 import json
+import time
 import asyncio
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Query, Request
 from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional
 import uvicorn
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import ToolCallRequestEvent
 from autogen_agentchat.teams import BaseGroupChat
 
+# 讓團隊 JSON 可以引用專案根目錄下的共用元件（common.*）
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.model_context import pop_context_usage
+from common.tool_executor import tool_run_scope
+from common.semantic_cache import SemanticCache, summarize_task_result
+from common.tracing import begin_span, parse_traceparent, set_service_name, start_span
+from common.metrics import TEAM_RUN_DURATION, TEAM_RUN_TURNS, install_metrics
+from common.profiling import install_profiling
+from common.replay import RUN_RECORD_PATH, RunRecorder, is_turn, record_scope
+
+set_service_name("autogen_api")
+
 # 創建FastAPI應用
 app = FastAPI(
     title="AutoGen多功能查詢API",
@@ -24,6 +42,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Prometheus 指標：/metrics 端點與各路由的請求延遲
+install_metrics(app, "autogen_api")
+
+# 事件迴圈延遲監控；設定 PROFILING_ADMIN_TOKEN 時另提供 /admin/profile 按需剖析
+install_profiling(app, "autogen_api")
+
+# 追蹤每個請求，接續呼叫端傳來的 traceparent 並在回應中帶回
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    parent = parse_traceparent(request.headers.get("traceparent"))
+    attributes = {"http.method": request.method, "http.route": request.url.path}
+    with start_span(f"HTTP {request.method} {request.url.path}", attributes, parent=parent) as span:
+        response = await call_next(request)
+        span.set_attribute("http.status_code", response.status_code)
+        response.headers["traceparent"] = span.traceparent
+        return response
+
 # 定義各種請求模型
 class WeatherRequest(BaseModel):
     location: str = "台北"
@@ -40,6 +75,79 @@ class KnowledgeRequest(BaseModel):
 class ImageGenRequest(BaseModel):
     prompt: str
 
+# 語意快取：改寫過的相同問題直接回傳先前的結果（新聞的有效時間較短）；句向量模型無法載入時停用
+knowledge_cache = SemanticCache("knowledge", ttl=float(os.getenv("SEMANTIC_CACHE_TTL_KNOWLEDGE", "86400")))
+news_cache = SemanticCache("news", ttl=float(os.getenv("SEMANTIC_CACHE_TTL_NEWS", "1800")))
+
+def cache_info(hit) -> dict:
+    if hit is None:
+        return {"hit": False}
+    return {"hit": True, "score": round(hit.score, 4), "matched_query": hit.matched_query, "age": round(hit.age)}
+
+# 各團隊預先綁定標籤的執行時間與回合數指標
+TEAM_METRICS = {
+    name: (TEAM_RUN_DURATION.labels(name), TEAM_RUN_TURNS.labels(name))
+    for name in ("weather", "news", "knowledge", "image")
+}
+
+async def run_team(team, name: str, task: str) -> TaskResult:
+    """
+    執行團隊並記錄追蹤：整次執行一個 span，每個代理回合一個 span
+    （從上一則訊息到該代理回覆為止，含其間的工具呼叫次數與 token 用量）
+    """
+    start = time.perf_counter()
+    # 設定 RUN_RECORD_PATH 時錄製本次執行，供 python -m common.replay 重播
+    recorder = RunRecorder(name, task) if RUN_RECORD_PATH else None
+    with start_span("team.run", {"team": name}) as run_span, tool_run_scope(), record_scope(recorder):
+        result = None
+        turns = 0
+        turn = begin_span("agent.turn")
+        tool_calls = prompt_tokens = completion_tokens = 0
+        try:
+            async for item in team.run_stream(task=task):
+                if isinstance(item, TaskResult):
+                    # 不提前 break，讓 run_stream 跑完自己的清理
+                    result = item
+                    continue
+                usage = getattr(item, "models_usage", None)
+                if usage is not None:
+                    prompt_tokens += usage.prompt_tokens
+                    completion_tokens += usage.completion_tokens
+                if isinstance(item, ToolCallRequestEvent):
+                    tool_calls += len(item.content)
+                if not is_turn(item):
+                    continue
+                turns += 1
+                if recorder is not None:
+                    recorder.record_turn(item)
+                turn.name = f"agent.turn {item.source}"
+                turn.attributes.update({
+                    "agent": item.source,
+                    "tool_calls": tool_calls,
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                })
+                turn.end()
+                turn = begin_span("agent.turn")
+                tool_calls = prompt_tokens = completion_tokens = 0
+        except BaseException as e:
+            # 中途失敗時，尚未完成的回合即為出錯的回合
+            turn.record_exception(e)
+            turn.end()
+            raise
+        # 正常結束時最後一個回合沒有任何代理回覆，不輸出
+        run_span.set_attribute("turns", turns)
+        if result is not None:
+            run_span.set_attribute("stop_reason", result.stop_reason)
+    elapsed = time.perf_counter() - start
+    duration_metric, turns_metric = TEAM_METRICS[name]
+    duration_metric.observe(elapsed)
+    turns_metric.observe(turns)
+    if recorder is not None:
+        stop_reason = result.stop_reason if result is not None else None
+        await asyncio.to_thread(recorder.save, RUN_RECORD_PATH, elapsed, stop_reason)
+    return result
+
 # 載入不同功能的團隊配置
 @app.on_event("startup")
 async def startup_event():
@@ -77,8 +185,9 @@ async def get_weather(
         query = f"{location}天氣"
         if detail:
             query += "詳細資訊"
-        result = await weather_team.run(task=query)
-        return {"status": "success", "location": location, "result": result}
+        result = await run_team(weather_team, "weather", query)
+        return {"status": "success", "location": location, "result": result,
+                "context_usage": pop_context_usage(weather_team)}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
@@ -100,14 +209,33 @@ async def get_news(
     - search_type: 搜索類型，預設為"keyword"
     """
     try:
+        partition = f"{category}|{num_results}|{search_type}"
+        hit = await asyncio.to_thread(news_cache.lookup, query, partition)
+        if hit is not None:
+            # 命中與未命中回傳相同的格式；命中時沒有使用模型上下文
+            return {
+                "status": "success",
+                "query": query,
+                "category": category,
+                "search_type": search_type,
+                "result": hit.value,
+                "context_usage": {},
+                "cache": cache_info(hit)
+            }
+
         search_query = f"搜索{category}類別的{query}相關新聞，返回{num_results}條"
-        result = await news_team.run(task=search_query)
+        result = await run_team(news_team, "news", search_query)
+        payload = jsonable_encoder(result)
+        if summarize_task_result(result)["answer"]:
+            await asyncio.to_thread(news_cache.store, query, payload, partition)
         return {
             "status": "success", 
             "query": query,
             "category": category,
             "search_type": search_type,
-            "result": result
+            "result": payload,
+            "context_usage": pop_context_usage(news_team),
+            "cache": cache_info(None)
         }
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -126,8 +254,18 @@ async def get_knowledge(
     - detail: 是否返回詳細解答
     """
     try:
-        result = await knowledge_team.run(task=question)
-        return {"status": "success", "question": question, "result": result}
+        partition = f"detail={detail}"
+        hit = await asyncio.to_thread(knowledge_cache.lookup, question, partition)
+        if hit is not None:
+            return {"status": "success", "question": question, "result": hit.value,
+                    "context_usage": {}, "cache": cache_info(hit)}
+
+        result = await run_team(knowledge_team, "knowledge", question)
+        payload = jsonable_encoder(result)
+        if summarize_task_result(result)["answer"]:
+            await asyncio.to_thread(knowledge_cache.store, question, payload, partition)
+        return {"status": "success", "question": question, "result": payload,
+                "context_usage": pop_context_usage(knowledge_team), "cache": cache_info(None)}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
@@ -144,8 +282,9 @@ async def generate_image(
     """
     try:
         query = f"生成圖片：{prompt}"
-        result = await image_team.run(task=query)
-        return {"status": "success", "prompt": prompt, "result": result}
+        result = await run_team(image_team, "image", query)
+        return {"status": "success", "prompt": prompt, "result": result,
+                "context_usage": pop_context_usage(image_team)}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
@@ -1,5 +1,9 @@
 import io
+import os
+import sys
 import base64
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
@@ -16,6 +20,10 @@ from transformers import (
 )
 import uvicorn
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import INFERENCE_BATCH_SIZE, INFERENCE_QUEUE_DEPTH, install_metrics
+from common.profiling import install_profiling
+
 app = FastAPI(
     title="PaliGemma API",
     description="API 介面用於使用 PaliGemma 2 模型處理圖像",
@@ -31,6 +39,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Prometheus 指標：/metrics 端點與各路由的請求延遲
+install_metrics(app, "image_describe")
+
+# 事件迴圈延遲監控；設定 PROFILING_ADMIN_TOKEN 時另提供 /admin/profile 按需剖析
+install_profiling(app, "image_describe")
+
 # 檢查是否有可用的 GPU
 device = "cuda" if torch.cuda.is_available() else "cpu"
 print(f"使用裝置: {device}")
@@ -53,6 +67,24 @@ except Exception as e:
     print(f"加載模型時出錯: {e}")
     raise
 
+# 推論放在單一工作執行緒上依序執行，避免阻塞事件迴圈；佇列深度 = 等待中 + 執行中的請求
+inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="paligemma")
+inference_queue_depth = INFERENCE_QUEUE_DEPTH.labels("paligemma")
+inference_batch_size = INFERENCE_BATCH_SIZE.labels("paligemma")
+pending_inferences = 0
+
+async def run_inference(image, task_type: str, question: Optional[str], objects: Optional[str]) -> str:
+    """在推論執行緒上執行 process_image 並更新佇列深度"""
+    global pending_inferences
+    pending_inferences += 1
+    inference_queue_depth.inc()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(inference_executor, process_image, image, task_type, question, objects)
+    finally:
+        pending_inferences -= 1
+        inference_queue_depth.dec()
+
 class ImageResponse(BaseModel):
     result: str
 
@@ -66,7 +98,7 @@ async def process_image_file(
     try:
         contents = await file.read()
         image = Image.open(io.BytesIO(contents))
-        result = process_image(image, task_type, question, objects)
+        result = await run_inference(image, task_type, question, objects)
         return {"result": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"處理圖像時出錯: {str(e)}")
@@ -111,7 +143,8 @@ def process_image(
         
         input_len = model_inputs["input_ids"].shape[-1]
         
-        # 生成結果
+        # 生成結果（目前每次只處理一張圖）
+        inference_batch_size.observe(1)
         with torch.inference_mode():
             generation = model.generate(
                 **model_inputs,
@@ -154,7 +187,7 @@ async def api_process_base64(
     try:
         image_data = base64.b64decode(base64_image)
         image = Image.open(io.BytesIO(image_data))
-        result = process_image(image, task_type, question, objects)
+        result = await run_inference(image, task_type, question, objects)
         return {"result": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"處理圖像時出錯: {str(e)}")
@@ -164,7 +197,7 @@ async def health_check():
     """
     API 健康狀態檢查
     """
-    return {"status": "healthy", "device": device}
+    return {"status": "healthy", "device": device, "inference_queue_depth": pending_inferences}
 
 if __name__ == "__main__":
     uvicorn.run("api:app", host="0.0.0.0", port=8100, reload=True) 
\ No newline at end of file
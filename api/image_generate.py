@@ -2,25 +2,38 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import requests
-from PIL import Image
-from io import BytesIO
 from dotenv import load_dotenv
 
+# 讓腳本可以匯入專案根目錄下的共用模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.image_store import ImageStore, DEFAULT_IMAGE_STORE_DIR, generation_cache_key
+
 # 讀取 .env 檔案
 load_dotenv()
 
-def generate_image(prompt: str, timeout: int = 60) -> str:
+# 本地圖片庫與生成結果快取
+image_store = ImageStore(os.getenv("IMAGE_STORE_DIR", DEFAULT_IMAGE_STORE_DIR))
+
+def generate_image(prompt: str, timeout: int = 60, seed: int = -1) -> str:
     """生成圖片的函數
     
     Args:
         prompt (str): 圖片生成提示詞
         timeout (int): 請求超時時間（秒），默認60秒
+        seed (int): 隨機種子，默認 -1（隨機）；固定 seed 時相同提示詞直接使用快取的圖片
         
     Returns:
         str: 生成結果訊息
     """
     try:
+        # 固定 seed 的結果可重複使用
+        cache_key = generation_cache_key(prompt, 512, 512, 30, seed) if seed != -1 else None
+        cached = image_store.lookup(cache_key) if cache_key else None
+        if cached:
+            return f"使用快取的圖像: {cached['local_path']}"
+
         # 檢查 API URL
         api_url = os.getenv("STABLE_DIFFUSION_URL", "https://mystaable.zeabur.app")
         if not api_url:
@@ -46,7 +59,7 @@ def generate_image(prompt: str, timeout: int = 60) -> str:
             "person_detector": "person_yolov8n-seg.pt",
             "prompt": prompt,
             "sampler_name": "DPM++ 2M",
-            "seed": -1,
+            "seed": seed,
             "steps": 30,
             "width": 512
         }
@@ -64,15 +77,11 @@ def generate_image(prompt: str, timeout: int = 60) -> str:
             
         print(f"獲取到圖片 URL：{image_url}")
         
-        # 下載圖片
+        # 串流下載原始檔到本地圖片庫（不解碼、不重新編碼）
         print("正在下載圖片...")
-        img_response = requests.get(image_url, timeout=timeout)
-        img_response.raise_for_status()
-        
-        # 保存圖片
-        image = Image.open(BytesIO(img_response.content))
-        output_path = "generated_image.png"
-        image.save(output_path)
+        output_path = image_store.download_sync(image_url, timeout=timeout)
+        if cache_key:
+            image_store.remember(cache_key, {"image_url": image_url, "local_path": output_path})
         return f"圖像已成功生成並儲存為: {output_path}"
         
     except requests.exceptions.Timeout:
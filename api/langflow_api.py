@@ -1,8 +1,18 @@
 import os
+import sys
+import time
+import uuid
 import requests
 import json
 from dotenv import load_dotenv
 import logging
+from typing import Dict, Any, Iterator, Optional, Tuple
+from requests.adapters import HTTPAdapter
+
+# 讓腳本可以匯入專案根目錄下的共用模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.circuit_breaker import CircuitBreaker, CircuitOpenError
+from common.langflow import ChatHistoryStore, extract_bot_response, parse_stream_event
 
 # 設置日誌
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -11,17 +21,79 @@ logger = logging.getLogger(__name__)
 # 載入環境變數
 load_dotenv()
 
-def get_langflow_response(message: str) -> str:
+# 連線與斷路器設定
+LANGFLOW_CONNECT_TIMEOUT = float(os.getenv("LANGFLOW_CONNECT_TIMEOUT", "5"))
+LANGFLOW_READ_TIMEOUT = float(os.getenv("LANGFLOW_READ_TIMEOUT", "60"))
+LANGFLOW_MAX_CONNECTIONS = int(os.getenv("LANGFLOW_MAX_CONNECTIONS", "20"))
+
+# 每個 session 只送出最近的對話視窗與較早對話的摘要
+history_store = ChatHistoryStore(
+    max_sessions=int(os.getenv("LANGFLOW_HISTORY_SESSIONS", "1000")),
+    max_turns=int(os.getenv("LANGFLOW_HISTORY_TURNS", "6")),
+    max_message_chars=int(os.getenv("LANGFLOW_HISTORY_MESSAGE_CHARS", "500"))
+)
+
+# 每個流程網址各自持有連線池與斷路器
+_sessions: Dict[str, requests.Session] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+
+def _get_session(api_url: str) -> requests.Session:
+    """取得該流程網址的共用連線池"""
+    session = _sessions.get(api_url)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=LANGFLOW_MAX_CONNECTIONS)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _sessions[api_url] = session
+    return session
+
+def _get_breaker(api_url: str) -> CircuitBreaker:
+    """取得該流程網址的斷路器"""
+    breaker = _breakers.get(api_url)
+    if breaker is None:
+        breaker = CircuitBreaker(
+            api_url,
+            failure_threshold=int(os.getenv("LANGFLOW_FAILURE_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("LANGFLOW_RESET_TIMEOUT", "30")),
+            slow_call_threshold=float(os.getenv("LANGFLOW_SLOW_CALL_THRESHOLD", "30"))
+        )
+        _breakers[api_url] = breaker
+    return breaker
+
+def _post_flow(api_url: str, headers: Dict[str, str], request_body: Dict[str, Any]) -> Dict[str, Any]:
     """
-    向 Langflow API 發送請求並獲取回應
-    
-    Args:
-        message (str): 用戶輸入的消息
-        
-    Returns:
-        str: AI 的回應
+    向單一 Langflow 流程發送請求
+
+    Raises:
+        CircuitOpenError: 該流程的斷路器開啟中
+        requests.exceptions.RequestException: 連線失敗、超時或非 2xx 狀態碼
     """
-    api_url = os.getenv("LANGFLOW_API_URL")
+    breaker = _get_breaker(api_url)
+    breaker.check()
+
+    start = time.monotonic()
+    try:
+        response = _get_session(api_url).post(
+            api_url,
+            headers=headers,
+            json=request_body,
+            timeout=(LANGFLOW_CONNECT_TIMEOUT, LANGFLOW_READ_TIMEOUT)
+        )
+    except requests.exceptions.RequestException:
+        breaker.record_failure()
+        raise
+
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success(time.monotonic() - start)
+
+    response.raise_for_status()
+    return response.json()
+
+def _build_request(message: str, session_id: Optional[str]) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """組出 Langflow 請求的標頭與內容（有 session_id 時帶上該 session 的對話歷史）"""
     auth_token = os.getenv("LANGFLOW_AUTH_TOKEN")
     api_key = os.getenv("LANGFLOW_API_KEY")
 
@@ -33,49 +105,135 @@ def get_langflow_response(message: str) -> str:
     
     request_body = {
         "question": message,
-        "chat_history": [],
+        "chat_history": history_store.window(session_id) if session_id else [],
         "input_value": message,
         "output_type": "chat",
         "input_type": "chat"
     }
+    return headers, request_body
+
+def get_langflow_response(message: str, session_id: Optional[str] = None) -> str:
+    """
+    向 Langflow API 發送請求並獲取回應
+    
+    Args:
+        message (str): 用戶輸入的消息
+        session_id (str): 對話 ID，同一個 ID 的請求會帶上先前的對話歷史；未提供時不帶也不保存歷史
+        
+    Returns:
+        str: AI 的回應
+    """
+    api_url = os.getenv("LANGFLOW_API_URL")
+    headers, request_body = _build_request(message, session_id)
 
     try:
-        response = requests.post(
-            api_url,
-            headers=headers,
-            json=request_body
-        )
-        response.raise_for_status()
-        data = response.json()
+        try:
+            data = _post_flow(api_url, headers, request_body)
+        except (CircuitOpenError, requests.exceptions.RequestException) as error:
+            # 主要流程失敗時改送備援流程（查詢可重複執行）
+            secondary_url = os.getenv("LANGFLOW_API_URL_SECONDARY")
+            if not secondary_url:
+                raise
+            logger.warning(f'主要流程請求失敗（{error}），改送備援流程')
+            data = _post_flow(secondary_url, headers, request_body)
         
         # 提取回應內容
-        bot_response = (
-            data.get('result', {}).get('output') or
-            data.get('result', {}).get('response') or
-            data.get('outputs', [{}])[0].get('output') or
-            (data.get('outputs', [{}])[0].get('outputs', [{}])[0].get('artifacts', {}).get('message')) or
-            data.get('outputs', [{}])[0].get('messages', [{}])[0].get('message', '') or
-            '抱歉，我無法理解您的問題。'
-        )
-
-        if isinstance(bot_response, dict):
-            bot_response = (
-                bot_response.get('text') or
-                bot_response.get('content') or
-                bot_response.get('message') or
-                str(bot_response)
-            )
+        bot_response = extract_bot_response(data)
+        if not bot_response:
+            return '抱歉，我無法理解您的問題。'
 
+        if session_id:
+            history_store.append(session_id, "user", message)
+            history_store.append(session_id, "assistant", bot_response)
         return bot_response
 
     except Exception as error:
         logger.error(f'API 請求失敗: {error}')
         return '抱歉，我現在無法回應。請稍後再試。'
 
+def stream_langflow_response(message: str, session_id: Optional[str] = None) -> Iterator[str]:
+    """
+    使用 Langflow 串流端點發送請求，逐段產生回應
+
+    Args:
+        message (str): 用戶輸入的消息
+        session_id (str): 對話 ID，同一個 ID 的請求會帶上先前的對話歷史；未提供時不帶也不保存歷史
+
+    Yields:
+        str: 回應的文字片段
+    """
+    api_url = os.getenv("LANGFLOW_API_URL")
+    headers, request_body = _build_request(message, session_id)
+    breaker = _get_breaker(api_url)
+    chunks = []
+
+    try:
+        breaker.check()
+        start = time.monotonic()
+        succeeded: Optional[bool] = None
+        try:
+            response = _get_session(api_url).post(
+                api_url,
+                params={"stream": "true"},
+                headers=headers,
+                json=request_body,
+                stream=True,
+                timeout=(LANGFLOW_CONNECT_TIMEOUT, LANGFLOW_READ_TIMEOUT)
+            )
+            with response:
+                if response.status_code >= 400:
+                    # 4xx 表示流程仍正常回應，只有 5xx 算失敗
+                    succeeded = response.status_code < 500
+                response.raise_for_status()
+
+                final_result: Dict[str, Any] = {}
+                for line in response.iter_lines(decode_unicode=True):
+                    event = parse_stream_event(line or "")
+                    if event is None:
+                        continue
+                    name, data = event
+                    if name == "token" and data.get("chunk"):
+                        chunks.append(data["chunk"])
+                        yield data["chunk"]
+                    elif name == "end":
+                        final_result = data.get("result") or {}
+            succeeded = True
+        except requests.exceptions.RequestException:
+            if succeeded is None:
+                succeeded = False
+            raise
+        finally:
+            # 每個出口都記錄結果；呼叫端提前關閉產生器時只釋放半開狀態的試探名額
+            if succeeded is None:
+                breaker.release()
+            elif succeeded:
+                breaker.record_success(time.monotonic() - start)
+            else:
+                breaker.record_failure()
+
+        # 流程沒有逐字輸出時，從結束事件的完整結果中取出回應
+        if not chunks:
+            bot_response = extract_bot_response(final_result)
+            if not bot_response:
+                yield '抱歉，我無法理解您的問題。'
+                return
+            chunks.append(bot_response)
+            yield bot_response
+
+        if session_id:
+            history_store.append(session_id, "user", message)
+            history_store.append(session_id, "assistant", "".join(chunks))
+
+    except Exception as error:
+        logger.error(f'API 串流請求失敗: {error}')
+        yield '抱歉，我現在無法回應。請稍後再試。'
+
 def main():
     """
     主函數，用於測試 Langflow API
     """
+    # 同一次互動對話共用一個 session，延續對話歷史
+    session_id = uuid.uuid4().hex
     print("開始對話（輸入 'exit' 結束）")
     while True:
         user_input = input("\n你: ").strip()
@@ -83,8 +241,15 @@ def main():
             print("結束對話")
             break
         
-        response = get_langflow_response(user_input)
-        print(f"AI: {response}")
+        if os.getenv("LANGFLOW_STREAM", "true").lower() == "true":
+            # 串流模式：收到內容就立即輸出
+            print("AI: ", end="", flush=True)
+            for chunk in stream_langflow_response(user_input, session_id):
+                print(chunk, end="", flush=True)
+            print()
+        else:
+            response = get_langflow_response(user_input, session_id)
+            print(f"AI: {response}")
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,15 @@
 import asyncio
 import os
+import sys
 import requests
 from autogen_agentchat.agents import AssistantAgent
 from autogen_ext.models.openai import OpenAIChatCompletionClient
 from dotenv import load_dotenv
 
+# 讓腳本可以匯入專案根目錄下的共用模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.gazetteer import resolve_city
+
 # Load environment variables
 load_dotenv()
 
@@ -18,10 +23,12 @@ def get_weather(city: str) -> str:
     if not WEATHER_API_KEY:
         return "Error: WEATHER_API_KEY not found in environment variables"
 
-    api_url = f"https://api.weatherapi.com/v1/current.json?key={WEATHER_API_KEY}&q={city}"
+    # Resolve aliases and typos to a canonical lat/lon key before calling the API
+    query, city = resolve_city(city)
+    api_url = "https://api.weatherapi.com/v1/current.json"
     
     try:
-        response = requests.get(api_url)
+        response = requests.get(api_url, params={"key": WEATHER_API_KEY, "q": query})
         response.raise_for_status()
         data = response.json()
         
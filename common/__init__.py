@@ -0,0 +1 @@
+"""專案共用模組（供 api/、mcp_tool/、mcp_example/ 下的腳本匯入）"""
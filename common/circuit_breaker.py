@@ -0,0 +1,94 @@
+import time
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """斷路器開啟時拒絕請求"""
+
+
+class CircuitBreaker:
+    """
+    簡單的斷路器
+
+    連續失敗（或回應過慢）達到門檻後開啟，在 reset_timeout 秒內直接拒絕請求；
+    之後進入半開狀態，只放行一個試探請求，成功則關閉、失敗則再次開啟。
+    不負責發送請求，同步與非同步的呼叫端都可以使用。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        slow_call_threshold: Optional[float] = None
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call_threshold = slow_call_threshold
+
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        """目前狀態：closed、open 或 half_open"""
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow_request(self) -> bool:
+        """判斷是否可以送出請求（半開狀態下只放行一個試探請求）"""
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def check(self) -> None:
+        """不可送出請求時拋出 CircuitOpenError"""
+        if not self.allow_request():
+            raise CircuitOpenError(f"{self.name} 斷路器開啟中")
+
+    def record_success(self, elapsed: Optional[float] = None) -> None:
+        """記錄成功的請求；超過 slow_call_threshold 的請求視為失敗"""
+        if self.slow_call_threshold is not None and elapsed is not None and elapsed > self.slow_call_threshold:
+            logger.warning(f"{self.name} 回應過慢（{elapsed:.2f} 秒）")
+            self.record_failure()
+            return
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"{self.name} 斷路器關閉")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def release(self) -> None:
+        """請求被取消或中途放棄、沒有結果可記錄時，釋放半開狀態的試探名額"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        """記錄失敗的請求，達到門檻時開啟斷路器"""
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"{self.name} 連續失敗 {self._failures} 次，斷路器開啟")
+                self._opened_at = time.monotonic()
@@ -0,0 +1,192 @@
+import os
+import logging
+import unicodedata
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 內建的精簡城市資料：名稱、緯度、經度、別名
+DEFAULT_GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cities.tsv")
+
+# 模糊比對的最低相似度（1 - 編輯距離 / 字串長度），只用來修正長度相近的拼字錯誤
+FUZZY_THRESHOLD = float(os.getenv("GAZETTEER_FUZZY_THRESHOLD", "0.8"))
+# 短於此長度的地名不做模糊比對（兩個字的中文地名差一字就是另一個地方）
+FUZZY_MIN_LENGTH = 4
+
+# 正規化時移除的地名後綴
+_SUFFIXES = (" city", "市", "縣", "县")
+# 常見異體字
+_CHAR_MAP = str.maketrans({"臺": "台"})
+
+
+class Place(NamedTuple):
+    """地名索引中的一筆城市資料"""
+    name: str
+    lat: float
+    lon: float
+
+    @property
+    def key(self) -> str:
+        """以經緯度組成的標準鍵，可直接作為 WeatherAPI 的 q 參數與快取鍵"""
+        return f"{self.lat:.2f},{self.lon:.2f}"
+
+
+def normalize_name(name: str) -> str:
+    """
+    將地名正規化（全半形、大小寫、空白、異體字與常見後綴）
+
+    Args:
+        name (str): 原始地名
+
+    Returns:
+        str: 正規化後的地名
+    """
+    text = unicodedata.normalize("NFKC", name).translate(_CHAR_MAP).lower()
+    text = " ".join(text.replace(",", " ").split())
+    for suffix in _SUFFIXES:
+        if text.endswith(suffix) and len(text) - len(suffix) >= 2:
+            text = text[: -len(suffix)].strip()
+            break
+    return text
+
+
+def _edit_distance(a: str, b: str) -> int:
+    """
+    編輯距離：相鄰字元對調、多一字或少一字各算 1，替換算 2
+
+    替換一個字母常會變成另一個真實地名（taiwan -> tainan），因此比照刪除加插入計算。
+    """
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 2
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[len(b)]
+
+
+def _trigrams(text: str) -> Set[str]:
+    """產生字元三元組（前後補空白，讓短字串也有足夠的三元組）"""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Gazetteer:
+    """
+    離線地名索引：別名精確比對，找不到時只修正長度相近的拼字錯誤
+
+    帶有限定詞的地名（例如「Paris, Texas」）與其他查不到的輸入原樣交給 WeatherAPI，
+    不會被改寫成索引中名稱相似的其他城市。
+    """
+
+    def __init__(self, places: List[Tuple[Place, List[str]]]):
+        self._aliases: Dict[str, Place] = {}
+        self._alias_list: List[Tuple[Place, str]] = []
+        self._index: Dict[str, List[int]] = {}
+
+        for place, aliases in places:
+            for alias in [place.name, *aliases]:
+                normalized = normalize_name(alias)
+                if not normalized or normalized in self._aliases:
+                    continue
+                self._aliases[normalized] = place
+
+                alias_id = len(self._alias_list)
+                self._alias_list.append((place, normalized))
+                for gram in _trigrams(normalized):
+                    self._index.setdefault(gram, []).append(alias_id)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_GAZETTEER_PATH) -> "Gazetteer":
+        """
+        從 TSV 檔載入地名索引
+
+        Args:
+            path (str): 檔案路徑，每行為「名稱<TAB>緯度<TAB>經度<TAB>別名1|別名2」
+
+        Returns:
+            Gazetteer: 地名索引
+        """
+        places: List[Tuple[Place, List[str]]] = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip() or line.startswith("#"):
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                aliases = fields[3].split("|") if len(fields) > 3 and fields[3] else []
+                places.append((Place(fields[0], float(fields[1]), float(fields[2])), aliases))
+
+        logger.info(f"已載入 {len(places)} 筆城市資料")
+        return cls(places)
+
+    def resolve(self, name: str) -> Optional[Place]:
+        """
+        將地名解析為標準城市資料
+
+        Args:
+            name (str): 使用者輸入的地名
+
+        Returns:
+            Optional[Place]: 找到時返回城市資料，否則返回 None
+        """
+        # 「城市, 州/國家」這類限定過的地名交給 WeatherAPI 判斷
+        if "," in unicodedata.normalize("NFKC", name):
+            return None
+        normalized = normalize_name(name)
+        if not normalized:
+            return None
+
+        place = self._aliases.get(normalized)
+        if place is not None or len(normalized) < FUZZY_MIN_LENGTH:
+            return place
+
+        # 模糊比對：以三元組索引找出候選，只接受長度差不超過 1 的別名（不接受子字串或前綴），
+        # 並要求相似度最高的城市唯一
+        candidates: Set[int] = set()
+        for gram in _trigrams(normalized):
+            candidates.update(self._index.get(gram, ()))
+
+        best_places: Set[Place] = set()
+        best_score = 0.0
+        for alias_id in candidates:
+            candidate, alias = self._alias_list[alias_id]
+            if abs(len(alias) - len(normalized)) > 1:
+                continue
+            score = 1 - _edit_distance(normalized, alias) / max(len(alias), len(normalized))
+            if score > best_score:
+                best_places, best_score = {candidate}, score
+            elif score == best_score:
+                best_places.add(candidate)
+
+        if best_score >= FUZZY_THRESHOLD and len(best_places) == 1:
+            best_place = best_places.pop()
+            logger.info(f"模糊比對：{name} -> {best_place.name}（相似度 {best_score:.2f}）")
+            return best_place
+        return None
+
+
+@lru_cache(maxsize=1)
+def get_gazetteer() -> Gazetteer:
+    """取得共用的地名索引（第一次呼叫時載入）"""
+    return Gazetteer.load(os.getenv("GAZETTEER_PATH", DEFAULT_GAZETTEER_PATH))
+
+
+def resolve_city(city: str) -> Tuple[str, str]:
+    """
+    將城市名稱解析為 WeatherAPI 查詢字串與顯示名稱
+
+    Args:
+        city (str): 使用者輸入的城市名稱
+
+    Returns:
+        Tuple[str, str]: (查詢字串, 顯示名稱)；索引中找不到時原樣返回
+    """
+    place = get_gazetteer().resolve(city)
+    if place is None:
+        return city.strip(), city.strip()
+    return place.key, place.name
@@ -0,0 +1,173 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+import requests
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 預設存放在專案根目錄下的 generated_images/
+DEFAULT_IMAGE_STORE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "generated_images"
+)
+
+_CONTENT_TYPE_EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+}
+
+CHUNK_SIZE = 64 * 1024
+
+
+def generation_cache_key(prompt: str, width: int, height: int, steps: int, seed: int) -> str:
+    """以生成參數組成快取鍵（只有固定 seed 的生成結果可以重複使用）"""
+    payload = json.dumps([prompt, width, height, steps, seed], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ImageStore:
+    """
+    以內容雜湊命名的本地圖片庫
+
+    下載時直接以串流寫入暫存檔並同時計算 SHA-256，完成後改名為 <雜湊><副檔名>，
+    不做解碼或重新編碼；相同內容只會存一份。另外維護一份
+    {生成參數快取鍵: 圖片資訊} 的索引，保存在 index.json。
+    """
+
+    def __init__(self, root: str = DEFAULT_IMAGE_STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._index_path = os.path.join(root, "index.json")
+        self._lock = threading.Lock()
+        self._index: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(self._index_path):
+            try:
+                with open(self._index_path, "r", encoding="utf-8") as f:
+                    self._index = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"無法讀取圖片索引，將重新建立: {e}")
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """查詢快取的生成結果（本地檔案已被刪除時視為未命中）"""
+        entry = self._index.get(key)
+        if entry and entry.get("local_path") and not os.path.exists(entry["local_path"]):
+            return None
+        return entry
+
+    def remember(self, key: str, entry: Dict[str, Any]) -> None:
+        """記錄生成結果並寫回索引檔"""
+        with self._lock:
+            self._index[key] = entry
+            tmp_path = self._index_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._index, f, ensure_ascii=False)
+            os.replace(tmp_path, self._index_path)
+
+    def _extension(self, url: str, content_type: Optional[str]) -> str:
+        if content_type:
+            extension = _CONTENT_TYPE_EXTENSIONS.get(content_type.split(";")[0].strip().lower())
+            if extension:
+                return extension
+        extension = os.path.splitext(url.split("?")[0])[1].lower()
+        return extension if extension in _CONTENT_TYPE_EXTENSIONS.values() else ".png"
+
+    def _open_temp(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".part")
+        return os.fdopen(fd, "wb"), tmp_path
+
+    def _commit(self, tmp_path: str, digest: str, extension: str) -> str:
+        path = os.path.join(self.root, digest + extension)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+        return path
+
+    async def download(self, client: Any, url: str) -> str:
+        """
+        以 httpx.AsyncClient 串流下載圖片到圖片庫
+
+        Returns:
+            str: 本地檔案路徑
+        """
+        hasher = hashlib.sha256()
+        f, tmp_path = self._open_temp()
+        try:
+            with f:
+                async with client.stream("GET", url) as response:
+                    response.raise_for_status()
+                    content_type = response.headers.get("content-type")
+                    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                        hasher.update(chunk)
+                        f.write(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return self._commit(tmp_path, hasher.hexdigest(), self._extension(url, content_type))
+
+    def download_sync(self, url: str, timeout: float = 60) -> str:
+        """
+        以 requests 串流下載圖片到圖片庫
+
+        Returns:
+            str: 本地檔案路徑
+        """
+        hasher = hashlib.sha256()
+        f, tmp_path = self._open_temp()
+        try:
+            with f, requests.get(url, stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                content_type = response.headers.get("content-type")
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    hasher.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return self._commit(tmp_path, hasher.hexdigest(), self._extension(url, content_type))
+
+    def make_thumbnails(self, path: str, sizes: Iterable[int], quality: int = 80) -> Dict[int, str]:
+        """
+        為圖片庫中的原圖產生 WebP 縮圖，存為 <雜湊>_<尺寸>.webp
+
+        縮圖檔名由原圖雜湊決定，已存在時直接沿用。會做影像解碼，
+        請在執行緒池中呼叫以免阻塞事件迴圈。
+
+        Args:
+            path (str): 原圖路徑
+            sizes (Iterable[int]): 縮圖的最長邊像素
+            quality (int): WebP 品質
+
+        Returns:
+            Dict[int, str]: {尺寸: 縮圖路徑}
+        """
+        digest = os.path.splitext(os.path.basename(path))[0]
+        thumbnails: Dict[int, str] = {}
+        missing = []
+        for size in sizes:
+            thumbnail_path = os.path.join(self.root, f"{digest}_{size}.webp")
+            thumbnails[size] = thumbnail_path
+            if not os.path.exists(thumbnail_path):
+                missing.append(size)
+
+        if missing:
+            with Image.open(path) as image:
+                image.load()
+                if image.mode not in ("RGB", "RGBA"):
+                    image = image.convert("RGBA")
+                # 由大到小縮放，每次從上一個較大的縮圖繼續縮，減少重複運算
+                current = image
+                for size in sorted(missing, reverse=True):
+                    current = current.copy()
+                    current.thumbnail((size, size))
+                    tmp_path = thumbnails[size] + ".part"
+                    current.save(tmp_path, format="WEBP", quality=quality)
+                    os.replace(tmp_path, thumbnails[size])
+        return thumbnails
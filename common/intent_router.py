@@ -0,0 +1,191 @@
+import os
+import json
+import logging
+from collections import Counter, deque
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class AhoCorasick:
+    """
+    Aho–Corasick 多模式字串比對自動機
+
+    建立後以單次線性掃描找出訊息中出現的所有關鍵字，時間與訊息長度成正比，
+    不隨關鍵字數量增加。
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[str]] = [[]]
+
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._build_failure_links()
+
+    def _add(self, pattern: str) -> None:
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append(pattern)
+
+    def _build_failure_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str]]:
+        """
+        掃描文字並逐一產生比對結果
+
+        Yields:
+            Tuple[int, str]: (關鍵字結束位置, 關鍵字)
+        """
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for pattern in self._output[state]:
+                yield index, pattern
+
+
+class Route(NamedTuple):
+    """路由表中的一個 Langflow 流程"""
+    name: str
+    url: Optional[str]
+    priority: int
+    keywords: Dict[str, float]
+    examples: List[str]
+    # 主要流程失敗或過慢時可改送的備援流程（僅限 idempotent 的查詢）
+    secondary_url: Optional[str] = None
+    idempotent: bool = True
+
+
+def _bigrams(text: str) -> Set[str]:
+    text = "".join(text.lower().split())
+    return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+
+class IntentRouter:
+    """
+    以關鍵字權重將訊息分派到對應的路由
+
+    關鍵字比對不分大小寫；沒有任何關鍵字命中時，可用各路由的範例句做
+    字元 bigram 相似度比對作為備援，仍無結果則使用預設路由。
+    """
+
+    def __init__(self, routes: List[Route], default_route: str, fallback_threshold: float = 0.0):
+        self.routes = {route.name: route for route in routes}
+        if default_route not in self.routes:
+            raise ValueError(f"預設路由不存在: {default_route}")
+        self.default_route = self.routes[default_route]
+        self.fallback_threshold = fallback_threshold
+        self.counters: Counter = Counter()
+
+        # 關鍵字 -> [(路由名稱, 權重)]
+        self._keyword_routes: Dict[str, List[Tuple[str, float]]] = {}
+        for route in routes:
+            for keyword, weight in route.keywords.items():
+                self._keyword_routes.setdefault(keyword.lower(), []).append((route.name, weight))
+        self._automaton = AhoCorasick(self._keyword_routes)
+
+        self._example_grams = [
+            (route.name, _bigrams(example)) for route in routes for example in route.examples
+        ]
+
+    @classmethod
+    def from_config(cls, path: str) -> "IntentRouter":
+        """
+        從 JSON 設定檔建立路由器
+
+        每個路由的網址從 url_env（備援流程為 secondary_url_env）指定的環境變數讀取，
+        只在載入時讀取一次。
+        keywords 可以是字串，或 {"keyword": ..., "weight": ...} 物件。
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+
+        routes = []
+        for item in config["routes"]:
+            keywords: Dict[str, float] = {}
+            for keyword in item.get("keywords", []):
+                if isinstance(keyword, dict):
+                    keywords[keyword["keyword"]] = float(keyword.get("weight", 1.0))
+                else:
+                    keywords[keyword] = 1.0
+            routes.append(Route(
+                name=item["name"],
+                url=os.getenv(item["url_env"]) if item.get("url_env") else item.get("url"),
+                priority=int(item.get("priority", 0)),
+                keywords=keywords,
+                examples=item.get("examples", []),
+                secondary_url=(
+                    os.getenv(item["secondary_url_env"]) if item.get("secondary_url_env")
+                    else item.get("secondary_url")
+                ),
+                idempotent=bool(item.get("idempotent", True)),
+            ))
+
+        logger.info(f"已載入 {len(routes)} 個路由、{sum(len(r.keywords) for r in routes)} 個關鍵字")
+        return cls(routes, config["default_route"], float(config.get("fallback_threshold", 0.0)))
+
+    def _classify(self, message: str) -> Optional[Route]:
+        """以範例句的 bigram 相似度做備援分類"""
+        if not self._example_grams or self.fallback_threshold <= 0:
+            return None
+        grams = _bigrams(message)
+        best_name, best_score = None, 0.0
+        for name, example_grams in self._example_grams:
+            score = len(grams & example_grams) / len(grams | example_grams)
+            if score > best_score:
+                best_name, best_score = name, score
+        if best_name is not None and best_score >= self.fallback_threshold:
+            return self.routes[best_name]
+        return None
+
+    def route(self, message: str) -> Route:
+        """
+        為訊息選擇路由
+
+        Args:
+            message (str): 使用者訊息
+
+        Returns:
+            Route: 關鍵字權重總和最高的路由（同分時取 priority 較高者）
+        """
+        scores: Counter = Counter()
+        for _, keyword in self._automaton.iter_matches(message.lower()):
+            for name, weight in self._keyword_routes[keyword]:
+                scores[name] += weight
+
+        if scores:
+            route = max(
+                (self.routes[name] for name in scores),
+                key=lambda r: (scores[r.name], r.priority)
+            )
+        else:
+            route = self._classify(message) or self.default_route
+
+        self.counters[route.name] += 1
+        return route
+
+    def stats(self) -> Dict[str, Any]:
+        """返回各路由被選中的次數"""
+        return {name: self.counters.get(name, 0) for name in self.routes}
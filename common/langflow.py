@@ -0,0 +1,128 @@
+import json
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+
+def extract_bot_response(data: Dict[str, Any]) -> Optional[str]:
+    """
+    從 Langflow 的完整 JSON 回應中取出機器人回覆
+
+    Args:
+        data (Dict[str, Any]): Langflow API 回應
+
+    Returns:
+        Optional[str]: 回覆文字，找不到時返回 None
+    """
+    bot_response = (
+        data.get('result', {}).get('output') or
+        data.get('result', {}).get('response') or
+        data.get('outputs', [{}])[0].get('output') or
+        (data.get('outputs', [{}])[0].get('outputs', [{}])[0].get('artifacts', {}).get('message')) or
+        data.get('outputs', [{}])[0].get('messages', [{}])[0].get('message', '') or
+        None
+    )
+
+    if isinstance(bot_response, dict):
+        bot_response = (
+            bot_response.get('text') or
+            bot_response.get('content') or
+            bot_response.get('message') or
+            str(bot_response)
+        )
+    return bot_response
+
+
+def parse_stream_event(line: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    解析 Langflow 串流端點（?stream=true）的一行事件
+
+    事件為每行一個 JSON 物件，例如 {"event": "token", "data": {"chunk": "..."}}；
+    也接受 SSE 格式的 "data: {...}" 行。
+
+    Returns:
+        Optional[Tuple[str, Dict[str, Any]]]: (事件名稱, 事件資料)，空行或無法解析時返回 None
+    """
+    line = line.strip()
+    if line.startswith("data:"):
+        line = line[5:].strip()
+    if not line:
+        return None
+    try:
+        event = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(event, dict):
+        return None
+    return event.get("event", ""), event.get("data") or {}
+
+
+class ChatHistoryStore:
+    """
+    有上限的對話歷史
+
+    每個 session 只保留最近 max_turns 則訊息（每則截斷至 max_message_chars 字），
+    更早的訊息壓縮成長度有限的摘要；session 數量超過 max_sessions 時淘汰最久未使用者。
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        max_turns: int = 6,
+        max_message_chars: int = 500,
+        max_summary_chars: int = 800
+    ):
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.max_message_chars = max_message_chars
+        self.max_summary_chars = max_summary_chars
+
+        self._lock = threading.Lock()
+        # {session_id: (最近的訊息, 較早訊息的摘要)}
+        self._sessions: "OrderedDict[str, Tuple[Deque[Dict[str, str]], List[str]]]" = OrderedDict()
+
+    def _truncate(self, text: str, limit: int) -> str:
+        return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
+    def append(self, session_id: str, role: str, content: str) -> None:
+        """加入一則訊息"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = (deque(), [])
+                self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+
+            messages, summary = session
+            messages.append({"role": role, "content": self._truncate(content, self.max_message_chars)})
+            while len(messages) > self.max_turns:
+                # 移出視窗的訊息只保留開頭作為摘要
+                old = messages.popleft()
+                summary.append(f"{old['role']}: {self._truncate(old['content'], 80)}")
+                while summary and sum(len(line) for line in summary) > self.max_summary_chars:
+                    summary.pop(0)
+
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def window(self, session_id: str) -> List[Dict[str, str]]:
+        """
+        取得要送給 Langflow 的歷史訊息
+
+        Returns:
+            List[Dict[str, str]]: 摘要（如果有）加上最近的訊息
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return []
+            messages, summary = session
+            history = list(messages)
+        if summary:
+            history.insert(0, {"role": "system", "content": "先前對話摘要：\n" + "\n".join(summary)})
+        return history
+
+    def clear(self, session_id: str) -> None:
+        """清除指定 session 的歷史"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
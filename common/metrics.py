@@ -0,0 +1,105 @@
+"""
+Prometheus 指標與 FastAPI 的 /metrics 端點
+
+熱路徑上只呼叫預先綁定標籤的子指標（labels() 的結果），不在每個請求建立標籤字典。
+process_resident_memory_bytes 等行程指標由 prometheus_client 預設的 ProcessCollector 提供。
+"""
+import time
+from typing import Any, Dict, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP 請求延遲", ["service", "route", "method", "status"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160),
+)
+TEAM_RUN_DURATION = Histogram(
+    "team_run_duration_seconds", "團隊執行時間", ["team"],
+    buckets=(1, 2, 5, 10, 20, 40, 60, 120, 300),
+)
+TEAM_RUN_TURNS = Histogram(
+    "team_run_turns", "每次團隊執行的代理回合數", ["team"],
+    buckets=(1, 2, 3, 4, 5, 6, 8, 10, 15),
+)
+LLM_TOKENS = Counter("llm_tokens_total", "模型 token 用量", ["backend", "kind"])
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds", "模型請求延遲", ["backend", "outcome"],
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 16, 32, 64),
+)
+TOOL_DURATION = Histogram(
+    "tool_duration_seconds", "工具呼叫延遲", ["tool"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+CACHE_REQUESTS = Counter("cache_requests_total", "快取查詢次數（依結果）", ["cache", "result"])
+INFERENCE_QUEUE_DEPTH = Gauge("inference_queue_depth", "等待或執行中的推論請求數", ["model"])
+INFERENCE_BATCH_SIZE = Histogram(
+    "inference_batch_size", "每次推論處理的輸入數", ["model"],
+    buckets=(1, 2, 4, 8, 16, 32),
+)
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "事件迴圈排程延遲", ["service"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+
+class LabelCache:
+    """
+    以標籤值組成的 tuple 快取子指標，相同標籤只呼叫一次 labels()
+
+    用法:
+        http_duration = LabelCache(HTTP_REQUEST_DURATION)
+        http_duration("autogen_api", "/news", "GET", "200").observe(elapsed)
+    """
+
+    def __init__(self, metric: Any):
+        self._metric = metric
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def __call__(self, *labels: str) -> Any:
+        child = self._children.get(labels)
+        if child is None:
+            child = self._children[labels] = self._metric.labels(*labels)
+        return child
+
+
+class CacheCounters:
+    """單一快取的命中與未命中計數器（預先綁定）"""
+
+    def __init__(self, cache: str):
+        self.hit = CACHE_REQUESTS.labels(cache, "hit")
+        self.miss = CACHE_REQUESTS.labels(cache, "miss")
+
+    def record(self, hit: bool) -> None:
+        (self.hit if hit else self.miss).inc()
+
+
+_http_durations = LabelCache(HTTP_REQUEST_DURATION)
+# 常見狀態碼轉字串的結果，避免每個請求格式化
+_STATUS_TEXT = {code: str(code) for code in range(100, 600)}
+
+
+def install_metrics(app: Any, service: str) -> None:
+    """
+    為 FastAPI 應用加上 /metrics 端點與請求延遲中介層
+
+    route 標籤使用路由樣板（例如 /jobs/{job_id}），未匹配的路徑歸為 unmatched，避免標籤數量失控。
+    """
+    from fastapi import Request, Response
+
+    @app.middleware("http")
+    async def record_request_latency(request: Request, call_next):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            _http_durations(
+                service, getattr(route, "path", "unmatched"), request.method, _STATUS_TEXT.get(status, str(status))
+            ).observe(time.perf_counter() - start)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics() -> Response:
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,363 @@
+"""
+快取模型回應的 ChatCompletionClient 包裝，可在團隊 JSON 中以
+"provider": "common.model_cache.CachingChatCompletionClient" 包住原本的 model_client
+"""
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Dict, Mapping, Optional, Sequence, Union
+
+from pydantic import BaseModel
+from typing_extensions import Self
+from autogen_core import CancellationToken, Component, ComponentModel
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage, ModelInfo, RequestUsage
+from autogen_core.tools import Tool, ToolSchema
+
+from common.metrics import CacheCounters
+from common.replay import current_recorder
+from common.tracing import begin_span, start_span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.getenv(
+    "MODEL_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".model_cache.sqlite3")
+)
+
+
+def _json_default(value: Any) -> Any:
+    # Image 等非 pydantic 物件
+    if hasattr(value, "to_base64"):
+        return value.to_base64()
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    return str(value)
+
+
+def _tool_schema(tool: Union[Tool, ToolSchema]) -> Any:
+    return tool.schema if isinstance(tool, Tool) else tool
+
+
+def completion_cache_key(
+    create_args: Mapping[str, Any],
+    messages: Sequence[LLMMessage],
+    tools: Sequence[Union[Tool, ToolSchema]],
+    json_output: Optional[Union[bool, type]],
+    extra_create_args: Mapping[str, Any],
+) -> str:
+    """
+    以訊息、工具與取樣參數的正規化 JSON 計算快取鍵
+
+    鍵值不受字典順序與空白影響，相同請求不論來自哪個代理都會得到同一個鍵。
+    """
+    if isinstance(json_output, type) and issubclass(json_output, BaseModel):
+        json_output = json_output.model_json_schema()
+    payload = {
+        "create_args": dict(create_args),
+        "messages": [message.model_dump(mode="json") for message in messages],
+        "tools": [_tool_schema(tool) for tool in tools],
+        "json_output": json_output,
+        "extra_create_args": dict(extra_create_args),
+    }
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class CompletionCacheStore:
+    """
+    兩層快取：行程內 LRU 加上 SQLite 檔案
+
+    Args:
+        path (Optional[str]): SQLite 檔案路徑，None 表示只使用記憶體
+        memory_size (int): 記憶體中保留的項目數
+    """
+
+    def __init__(self, path: Optional[str] = DEFAULT_CACHE_PATH, memory_size: int = 256):
+        self.path = path
+        self.memory_size = memory_size
+        # 鍵 -> (到期時間, 序列化的 CreateResult)
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.execute("DELETE FROM completions WHERE expires_at <= ?", (time.time(),))
+            self._conn.commit()
+
+    def _remember(self, key: str, expires_at: float, value: str) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    return entry[1]
+                del self._memory[key]
+            if self._conn is None:
+                return None
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM completions WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._remember(key, row[1], row[0])
+            return row[0]
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._remember(key, expires_at, value)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO completions (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at)
+                )
+                self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class CachingChatCompletionClientConfig(BaseModel):
+    model_client: ComponentModel
+    cache_path: Optional[str] = DEFAULT_CACHE_PATH
+    memory_size: int = 256
+    ttl: float = 3600
+    # temperature 高於此值時不使用快取
+    max_temperature: float = 0.0
+    # 未設定 temperature（使用供應商預設值，通常不是 0）時是否仍使用快取
+    cache_unknown_temperature: bool = False
+
+
+class CachingChatCompletionClient(ChatCompletionClient, Component[CachingChatCompletionClientConfig]):
+    """
+    快取模型回應的 ChatCompletionClient
+
+    以訊息、工具、json_output 與取樣參數的正規化雜湊為鍵，先查記憶體 LRU，
+    再查 SQLite；命中時直接回傳先前的 CreateResult（cached=True）。
+    temperature 高於 max_temperature、未設定 temperature（除非 cache_unknown_temperature）
+    或要求多個候選（n > 1）的請求不經過快取。
+
+    Args:
+        model_client (ChatCompletionClient): 被包裝的模型客戶端
+        cache_path (Optional[str]): SQLite 檔案路徑，None 表示只使用記憶體
+        memory_size (int): 記憶體中保留的項目數
+        ttl (float): 快取有效秒數
+        max_temperature (float): 可快取的最高 temperature
+        cache_unknown_temperature (bool): 未設定 temperature 的請求是否可快取
+    """
+
+    component_type = "model"
+    component_config_schema = CachingChatCompletionClientConfig
+    component_provider_override = "common.model_cache.CachingChatCompletionClient"
+
+    def __init__(
+        self,
+        model_client: ChatCompletionClient,
+        cache_path: Optional[str] = DEFAULT_CACHE_PATH,
+        memory_size: int = 256,
+        ttl: float = 3600,
+        max_temperature: float = 0.0,
+        cache_unknown_temperature: bool = False,
+    ):
+        self._client = model_client
+        self._cache_path = cache_path
+        self._memory_size = memory_size
+        self._ttl = ttl
+        self._max_temperature = max_temperature
+        self._cache_unknown_temperature = cache_unknown_temperature
+        self._store = CompletionCacheStore(cache_path, memory_size)
+        self._counters = CacheCounters("llm_completion")
+        self.hits = 0
+        self.misses = 0
+
+    def _client_create_args(self) -> Dict[str, Any]:
+        # OpenAIChatCompletionClient 將 model、temperature 等參數存在 _create_args，
+        # RouterChatCompletionClient 則彙整各後端的參數
+        return dict(getattr(self._client, "_create_args", {}) or {})
+
+    def _cache_key(
+        self,
+        messages: Sequence[LLMMessage],
+        tools: Sequence[Union[Tool, ToolSchema]],
+        json_output: Optional[Union[bool, type]],
+        extra_create_args: Mapping[str, Any],
+    ) -> Optional[str]:
+        """回傳快取鍵；請求不可快取時回傳 None"""
+        create_args = self._client_create_args()
+        temperature = extra_create_args.get("temperature", create_args.get("temperature"))
+        if temperature is None:
+            if not self._cache_unknown_temperature:
+                return None
+        elif temperature > self._max_temperature:
+            return None
+        if extra_create_args.get("n", create_args.get("n", 1)) > 1:
+            return None
+        return completion_cache_key(create_args, messages, tools, json_output, extra_create_args)
+
+    async def _lookup(self, key: Optional[str]) -> Optional[CreateResult]:
+        if key is None:
+            return None
+        value = await asyncio.to_thread(self._store.get, key)
+        self._counters.record(value is not None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        result = CreateResult.model_validate_json(value)
+        result.cached = True
+        return result
+
+    async def _save(self, key: Optional[str], result: CreateResult) -> None:
+        if key is None:
+            return
+        try:
+            await asyncio.to_thread(self._store.set, key, result.model_dump_json(), self._ttl)
+        except sqlite3.Error as e:
+            logger.warning(f"寫入模型快取失敗: {e}")
+
+    @staticmethod
+    def _record(messages: Sequence[LLMMessage], result: CreateResult, start: float) -> None:
+        # 錄製團隊執行時（RUN_RECORD_PATH）記下代理實際收到的回應，供重播基準測試使用
+        recorder = current_recorder()
+        if recorder is not None:
+            recorder.record_model(messages, result, time.perf_counter() - start)
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        json_output: Optional[Union[bool, type]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        start = time.perf_counter()
+        with start_span("llm.create", {"llm.messages": len(messages), "llm.tools": len(tools)}) as span:
+            key = self._cache_key(messages, tools, json_output, extra_create_args)
+            cached = await self._lookup(key)
+            span.set_attribute("llm.cache", "bypass" if key is None else "hit" if cached is not None else "miss")
+            if cached is not None:
+                self._record(messages, cached, start)
+                return cached
+            result = await self._client.create(
+                messages,
+                tools=tools,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            )
+            span.set_attribute("llm.prompt_tokens", result.usage.prompt_tokens)
+            span.set_attribute("llm.completion_tokens", result.usage.completion_tokens)
+            await self._save(key, result)
+            self._record(messages, result, start)
+            return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        json_output: Optional[Union[bool, type]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        # 產生器會在呼叫端的 context 中暫停，因此不把 span 設為目前的 span
+        span = begin_span("llm.create_stream", {"llm.messages": len(messages), "llm.tools": len(tools)})
+        start = time.perf_counter()
+        try:
+            key = self._cache_key(messages, tools, json_output, extra_create_args)
+            cached = await self._lookup(key)
+            span.set_attribute("llm.cache", "bypass" if key is None else "hit" if cached is not None else "miss")
+            if cached is not None:
+                self._record(messages, cached, start)
+                if isinstance(cached.content, str):
+                    yield cached.content
+                yield cached
+                return
+            first_chunk = True
+            async for chunk in self._client.create_stream(
+                messages,
+                tools=tools,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            ):
+                if first_chunk:
+                    span.set_attribute("llm.time_to_first_token_ms", round((time.time_ns() - span.start_ns) / 1e6, 1))
+                    first_chunk = False
+                if isinstance(chunk, CreateResult):
+                    span.set_attribute("llm.prompt_tokens", chunk.usage.prompt_tokens)
+                    span.set_attribute("llm.completion_tokens", chunk.usage.completion_tokens)
+                    await self._save(key, chunk)
+                    self._record(messages, chunk, start)
+                yield chunk
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            span.end()
+
+    async def close(self) -> None:
+        self._store.close()
+        await self._client.close()
+
+    def actual_usage(self) -> RequestUsage:
+        return self._client.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        return self._client.total_usage()
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Union[Tool, ToolSchema]] = []) -> int:
+        return self._client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Union[Tool, ToolSchema]] = []) -> int:
+        return self._client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> Any:
+        return self._client.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._client.model_info
+
+    def _to_config(self) -> CachingChatCompletionClientConfig:
+        return CachingChatCompletionClientConfig(
+            model_client=self._client.dump_component(),
+            cache_path=self._cache_path,
+            memory_size=self._memory_size,
+            ttl=self._ttl,
+            max_temperature=self._max_temperature,
+            cache_unknown_temperature=self._cache_unknown_temperature,
+        )
+
+    @classmethod
+    def _from_config(cls, config: CachingChatCompletionClientConfig) -> Self:
+        return cls(
+            model_client=ChatCompletionClient.load_component(config.model_client),
+            cache_path=config.cache_path,
+            memory_size=config.memory_size,
+            ttl=config.ttl,
+            max_temperature=config.max_temperature,
+            cache_unknown_temperature=config.cache_unknown_temperature,
+        )
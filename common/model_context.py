@@ -0,0 +1,203 @@
+"""
+依 token 預算裁剪的 ChatCompletionContext，可在團隊 JSON 中以
+"provider": "common.model_context.TokenBudgetChatCompletionContext" 引用
+"""
+import re
+import logging
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+from typing_extensions import Self
+from autogen_core import Component
+from autogen_core.model_context import ChatCompletionContext
+from autogen_core.models import (
+    FunctionExecutionResultMessage,
+    LLMMessage,
+    SystemMessage,
+    UserMessage,
+)
+
+logger = logging.getLogger(__name__)
+
+# 每則訊息的角色、分隔符等固定開銷
+MESSAGE_OVERHEAD_TOKENS = 4
+# 圖片以固定 token 數估算
+IMAGE_TOKENS = 85
+
+_CJK_RE = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文字的 token 數（各家模型分詞器不同，這裡只需相對準確）
+
+    中日韓字元大約一字一個 token，其餘字元大約四個一個 token。
+    """
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message: LLMMessage) -> int:
+    """估算單則訊息的 token 數"""
+    content = message.content
+    if isinstance(content, str):
+        return estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    total = MESSAGE_OVERHEAD_TOKENS
+    for item in content:
+        if isinstance(item, str):
+            total += estimate_tokens(item)
+        elif hasattr(item, "arguments"):  # FunctionCall
+            total += estimate_tokens(item.name) + estimate_tokens(item.arguments)
+        elif isinstance(getattr(item, "content", None), str):  # FunctionExecutionResult
+            total += estimate_tokens(item.content)
+        else:  # Image
+            total += IMAGE_TOKENS
+    return total
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}\n…（已省略 {len(text) - max_chars} 字）"
+
+
+def _shrink_tool_results(message: LLMMessage, max_chars: int) -> LLMMessage:
+    if not isinstance(message, FunctionExecutionResultMessage):
+        return message
+    if all(len(result.content) <= max_chars for result in message.content):
+        return message
+    return message.model_copy(update={
+        "content": [
+            result.model_copy(update={"content": _truncate(result.content, max_chars)})
+            for result in message.content
+        ]
+    })
+
+
+class TokenBudgetChatCompletionContextConfig(BaseModel):
+    token_budget: int = 6000
+    keep_last_turns: int = 3
+    max_tool_result_chars: int = 800
+    initial_messages: Optional[List[LLMMessage]] = None
+
+
+class TokenBudgetChatCompletionContext(ChatCompletionContext, Component[TokenBudgetChatCompletionContextConfig]):
+    """
+    在 token 預算內送出對話歷史的模型上下文
+
+    每次取用時保留系統訊息與最近 keep_last_turns 個回合（以 UserMessage 分隔）；
+    較早回合的工具輸出截斷為 max_tool_result_chars 字，仍超過預算時由最舊的
+    回合開始整段捨棄，最後一個回合一律保留。完整歷史仍保存在上下文中，
+    只有送給模型的內容被裁剪。
+
+    Args:
+        token_budget (int): 送給模型的歷史訊息 token 上限（估算值）
+        keep_last_turns (int): 完整保留的最近回合數
+        max_tool_result_chars (int): 較早回合中每個工具輸出保留的字數
+        initial_messages (Optional[List[LLMMessage]]): 初始訊息
+    """
+
+    component_config_schema = TokenBudgetChatCompletionContextConfig
+    component_provider_override = "common.model_context.TokenBudgetChatCompletionContext"
+
+    def __init__(
+        self,
+        token_budget: int = 6000,
+        keep_last_turns: int = 3,
+        max_tool_result_chars: int = 800,
+        initial_messages: Optional[List[LLMMessage]] = None,
+    ) -> None:
+        super().__init__(initial_messages)
+        if token_budget <= 0:
+            raise ValueError("token_budget 必須大於 0")
+        if keep_last_turns <= 0:
+            raise ValueError("keep_last_turns 必須大於 0")
+        self._token_budget = token_budget
+        self._keep_last_turns = keep_last_turns
+        self._max_tool_result_chars = max_tool_result_chars
+        self.reset_usage()
+
+    @staticmethod
+    def _split_turns(messages: List[LLMMessage]) -> List[List[LLMMessage]]:
+        turns: List[List[LLMMessage]] = []
+        for message in messages:
+            if isinstance(message, UserMessage) or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return turns
+
+    async def get_messages(self) -> List[LLMMessage]:
+        system = [m for m in self._messages if isinstance(m, SystemMessage)]
+        turns = self._split_turns([m for m in self._messages if not isinstance(m, SystemMessage)])
+        full_tokens = sum(message_tokens(m) for m in self._messages)
+
+        recent_start = max(0, len(turns) - self._keep_last_turns)
+        turns = [
+            turn if index >= recent_start else [_shrink_tool_results(m, self._max_tool_result_chars) for m in turn]
+            for index, turn in enumerate(turns)
+        ]
+        turn_tokens = [sum(message_tokens(m) for m in turn) for turn in turns]
+        total = sum(message_tokens(m) for m in system) + sum(turn_tokens)
+
+        # 仍超過預算時，先壓縮最近回合（最後一個除外）的工具輸出，再由舊到新捨棄回合
+        if total > self._token_budget:
+            for index in range(recent_start, len(turns) - 1):
+                turns[index] = [_shrink_tool_results(m, self._max_tool_result_chars) for m in turns[index]]
+                total -= turn_tokens[index]
+                turn_tokens[index] = sum(message_tokens(m) for m in turns[index])
+                total += turn_tokens[index]
+        dropped = 0
+        while total > self._token_budget and dropped < len(turns) - 1:
+            total -= turn_tokens[dropped]
+            dropped += 1
+
+        messages = system + [m for turn in turns[dropped:] for m in turn]
+        self._usage["calls"] += 1
+        self._usage["full_tokens"] += full_tokens
+        self._usage["sent_tokens"] += total
+        if full_tokens > total:
+            logger.debug(f"模型上下文由約 {full_tokens} tokens 裁剪為 {total} tokens（捨棄 {dropped} 個回合）")
+        return messages
+
+    def usage_report(self) -> Dict[str, int]:
+        """回傳自上次重設以來的 token 用量統計（估算值）"""
+        return {**self._usage, "saved_tokens": self._usage["full_tokens"] - self._usage["sent_tokens"]}
+
+    def reset_usage(self) -> None:
+        self._usage = {"calls": 0, "full_tokens": 0, "sent_tokens": 0}
+
+    def _to_config(self) -> TokenBudgetChatCompletionContextConfig:
+        return TokenBudgetChatCompletionContextConfig(
+            token_budget=self._token_budget,
+            keep_last_turns=self._keep_last_turns,
+            max_tool_result_chars=self._max_tool_result_chars,
+            initial_messages=self._initial_messages,
+        )
+
+    @classmethod
+    def _from_config(cls, config: TokenBudgetChatCompletionContextConfig) -> Self:
+        return cls(
+            token_budget=config.token_budget,
+            keep_last_turns=config.keep_last_turns,
+            max_tool_result_chars=config.max_tool_result_chars,
+            initial_messages=config.initial_messages,
+        )
+
+
+def pop_context_usage(team: Any) -> Dict[str, Dict[str, int]]:
+    """
+    取出團隊中各代理本次執行的上下文 token 統計並重設
+
+    Args:
+        team (Any): 已載入的團隊（BaseGroupChat）
+
+    Returns:
+        Dict[str, Dict[str, int]]: 以代理名稱為鍵的統計；未使用 TokenBudgetChatCompletionContext 的代理不列出
+    """
+    report = {}
+    for agent in getattr(team, "_participants", []):
+        context = getattr(agent, "_model_context", None)
+        if isinstance(context, TokenBudgetChatCompletionContext):
+            report[agent.name] = context.usage_report()
+            context.reset_usage()
+    return report
@@ -0,0 +1,475 @@
+"""
+在多個模型供應商之間依延遲與錯誤率分流的 ChatCompletionClient，可在團隊 JSON 中以
+"provider": "common.model_router.RouterChatCompletionClient" 宣告
+"""
+import os
+import re
+import time
+import asyncio
+import logging
+from typing import Any, AsyncGenerator, Dict, Iterator, List, Mapping, Optional, Sequence, Set, Union
+
+from pydantic import BaseModel
+from typing_extensions import Self
+from autogen_core import CancellationToken, Component, ComponentModel
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage, ModelInfo, RequestUsage
+from autogen_core.tools import Tool, ToolSchema
+
+from common.circuit_breaker import CircuitBreaker
+from common.metrics import LLM_REQUEST_DURATION, LLM_TOKENS
+from common.tracing import begin_span, start_span
+
+try:
+    import openai
+    _CONNECTION_ERRORS: tuple = (openai.APIConnectionError, openai.APITimeoutError)
+except ImportError:  # 只使用非 OpenAI 相容客戶端時
+    _CONNECTION_ERRORS = ()
+
+logger = logging.getLogger(__name__)
+
+# 可改送其他後端的 HTTP 狀態碼
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+# 429 未附帶重置時間時的暫停秒數
+DEFAULT_RATE_LIMIT_PAUSE = 10.0
+
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After（秒數）或 x-ratelimit-reset-*（例如 "1m30s"、"20ms"）"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    return getattr(error, "status_code", None)
+
+
+def _is_retryable(error: BaseException) -> bool:
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRY_STATUS
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError, *_CONNECTION_ERRORS))
+
+
+def _common_model_info(infos: List[ModelInfo]) -> ModelInfo:
+    """所有後端都支援的能力才對外宣告，family 不一致時視為 unknown"""
+    info: Dict[str, Any] = dict(infos[0])
+    for other in infos[1:]:
+        for key, value in info.items():
+            if isinstance(value, bool):
+                info[key] = value and bool(other.get(key, False))
+            elif other.get(key) != value:
+                info[key] = "unknown"
+    return info  # type: ignore[return-value]
+
+
+def _rate_limit_pause(error: BaseException) -> float:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for header in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        pause = _parse_duration(headers.get(header))
+        if pause is not None:
+            return pause
+    return DEFAULT_RATE_LIMIT_PAUSE
+
+
+class ModelBackend:
+    """單一後端與其統計：EWMA 延遲、EWMA 錯誤率、限流解除時間與斷路器"""
+
+    def __init__(self, name: str, client: ChatCompletionClient, alpha: float, breaker: CircuitBreaker):
+        self.name = name
+        self.client = client
+        self.alpha = alpha
+        self.breaker = breaker
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.rate_limited_until = 0.0
+        self.requests = 0
+        # 預先綁定標籤，熱路徑上不必再查找子指標
+        self._prompt_tokens = LLM_TOKENS.labels(name, "prompt")
+        self._completion_tokens = LLM_TOKENS.labels(name, "completion")
+        self._success_duration = LLM_REQUEST_DURATION.labels(name, "success")
+        self._error_duration = LLM_REQUEST_DURATION.labels(name, "error")
+
+    def available(self, now: float) -> bool:
+        return self.rate_limited_until <= now and self.breaker.state != CircuitBreaker.OPEN
+
+    def score(self, error_penalty: float) -> float:
+        # 尚無延遲資料的後端排在最前面，讓它取得樣本
+        return (self.latency or 0.0) * (1 + error_penalty * self.error_rate)
+
+    def record_latency(self, elapsed: float) -> None:
+        self.latency = elapsed if self.latency is None else self.alpha * elapsed + (1 - self.alpha) * self.latency
+
+    def record_success(self, elapsed: float, usage: Optional[RequestUsage] = None) -> None:
+        self.record_latency(elapsed)
+        self._success_duration.observe(elapsed)
+        if usage is not None:
+            self._prompt_tokens.inc(usage.prompt_tokens)
+            self._completion_tokens.inc(usage.completion_tokens)
+        self.error_rate *= 1 - self.alpha
+        self.breaker.record_success()
+
+    def record_failure(self, error: BaseException, elapsed: Optional[float] = None) -> None:
+        if elapsed is not None:
+            self._error_duration.observe(elapsed)
+        self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+        if _status_code(error) == 429:
+            pause = _rate_limit_pause(error)
+            self.rate_limited_until = time.monotonic() + pause
+            logger.warning(f"模型後端 {self.name} 被限流，暫停 {pause:.1f} 秒")
+        self.breaker.record_failure()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "latency": None if self.latency is None else round(self.latency, 3),
+            "error_rate": round(self.error_rate, 3),
+            "rate_limited": self.rate_limited_until > time.monotonic(),
+            "circuit": self.breaker.state,
+            "requests": self.requests,
+        }
+
+
+class ModelBackendConfig(BaseModel):
+    name: str
+    model_client: ComponentModel
+    # 從此環境變數讀取 API 金鑰並填入 model_client 設定，避免金鑰寫在團隊 JSON 中
+    api_key_env: Optional[str] = None
+
+
+class RouterChatCompletionClientConfig(BaseModel):
+    backends: List[ModelBackendConfig]
+    ewma_alpha: float = 0.3
+    error_penalty: float = 4.0
+    hedge: bool = True
+    hedge_multiplier: float = 2.0
+    min_hedge_delay: float = 2.0
+    failure_threshold: int = 3
+    reset_timeout: float = 30.0
+
+
+class RouterChatCompletionClient(ChatCompletionClient, Component[RouterChatCompletionClientConfig]):
+    """
+    在多個後端之間分流的 ChatCompletionClient
+
+    每個請求送往分數最低的可用後端（EWMA 延遲乘上錯誤率懲罰），略過被限流或斷路器
+    開啟的後端。回應超過 hedge_multiplier 倍的 EWMA 延遲（至少 min_hedge_delay 秒）
+    時，同時送往下一個後端並採用先完成的回應；429、5xx 與連線錯誤則直接改送下一個
+    後端，429 依 Retry-After / x-ratelimit-reset-* 標頭暫停該後端。
+    串流請求不做對沖，只在收到第一個片段前失敗時改送其他後端。
+
+    Args:
+        backends (Dict[str, ChatCompletionClient]): 後端名稱與客戶端（依偏好排序）
+        ewma_alpha (float): EWMA 平滑係數
+        error_penalty (float): 錯誤率對分數的懲罰倍數
+        hedge (bool): 是否對過慢的請求做對沖
+        hedge_multiplier (float): 觸發對沖的延遲倍數
+        min_hedge_delay (float): 觸發對沖的最短秒數
+        failure_threshold (int): 斷路器開啟前允許的連續失敗次數
+        reset_timeout (float): 斷路器開啟的秒數
+        api_key_envs (Dict[str, str]): 後端名稱與其 API 金鑰環境變數，序列化時以此取代金鑰
+    """
+
+    component_type = "model"
+    component_config_schema = RouterChatCompletionClientConfig
+    component_provider_override = "common.model_router.RouterChatCompletionClient"
+
+    def __init__(
+        self,
+        backends: Dict[str, ChatCompletionClient],
+        ewma_alpha: float = 0.3,
+        error_penalty: float = 4.0,
+        hedge: bool = True,
+        hedge_multiplier: float = 2.0,
+        min_hedge_delay: float = 2.0,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+        api_key_envs: Optional[Dict[str, str]] = None,
+    ):
+        if not backends:
+            raise ValueError("至少需要一個模型後端")
+        self._backends = [
+            ModelBackend(
+                name, client, ewma_alpha,
+                CircuitBreaker(f"模型後端 {name}", failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+            )
+            for name, client in backends.items()
+        ]
+        self._ewma_alpha = ewma_alpha
+        self._error_penalty = error_penalty
+        self._hedge = hedge
+        self._hedge_multiplier = hedge_multiplier
+        self._min_hedge_delay = min_hedge_delay
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._api_key_envs = dict(api_key_envs or {})
+        self._model_info = _common_model_info([backend.client.model_info for backend in self._backends])
+
+    def _ranked(self) -> List[ModelBackend]:
+        """依分數排序可用的後端；全部不可用時仍依分數嘗試所有後端"""
+        now = time.monotonic()
+        candidates = [b for b in self._backends if b.available(now)] or list(self._backends)
+        # sorted 為穩定排序，分數相同時保留設定中的順序
+        return sorted(candidates, key=lambda b: b.score(self._error_penalty))
+
+    @staticmethod
+    def _next_allowed(candidates: Iterator[ModelBackend]) -> Optional[ModelBackend]:
+        """取出下一個斷路器放行的後端；半開狀態的試探名額已被占用時略過"""
+        for backend in candidates:
+            if backend.breaker.allow_request():
+                return backend
+            logger.info(f"模型後端 {backend.name} 斷路器未放行，略過")
+        return None
+
+    def _hedge_delay(self, backend: ModelBackend) -> Optional[float]:
+        if not self._hedge or backend.latency is None:
+            return None
+        return max(self._min_hedge_delay, self._hedge_multiplier * backend.latency)
+
+    async def _call(self, backend: ModelBackend, messages: Sequence[LLMMessage], **kwargs: Any) -> CreateResult:
+        backend.requests += 1
+        start = time.monotonic()
+        with start_span("llm.backend", {"llm.backend": backend.name}) as span:
+            try:
+                result = await backend.client.create(messages, **kwargs)
+            except asyncio.CancelledError:
+                # 對沖中落後而被取消：以已耗時間更新延遲並釋放半開狀態的試探名額，不算失敗
+                span.set_attribute("llm.hedge_cancelled", True)
+                backend.record_latency(time.monotonic() - start)
+                backend.breaker.release()
+                raise
+            except Exception as e:
+                span.set_attribute("http.status_code", _status_code(e))
+                backend.record_failure(e, time.monotonic() - start)
+                raise
+            backend.record_success(time.monotonic() - start, result.usage)
+            span.set_attribute("llm.prompt_tokens", result.usage.prompt_tokens)
+            span.set_attribute("llm.completion_tokens", result.usage.completion_tokens)
+            return result
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        json_output: Optional[Union[bool, type]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        kwargs = dict(
+            tools=tools,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        )
+        candidates = iter(self._ranked())
+        pending: Set[asyncio.Task] = set()
+        last_error: BaseException = RuntimeError("沒有可用的模型後端")
+        hedge_delay: Optional[float] = None
+
+        def launch() -> bool:
+            nonlocal hedge_delay
+            backend = self._next_allowed(candidates)
+            if backend is None:
+                return False
+            hedge_delay = self._hedge_delay(backend)
+            pending.add(asyncio.create_task(self._call(backend, messages, **kwargs), name=backend.name))
+            return True
+
+        try:
+            launch()
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.info(f"模型後端 {', '.join(t.get_name() for t in pending)} 回應過慢，同時送往下一個後端")
+                    if not launch():
+                        hedge_delay = None
+                    continue
+                # 先取出所有已完成任務的例外，避免同時完成的失敗任務留下未取用的例外
+                outcomes = [(task, task.exception()) for task in done]
+                for task, error in outcomes:
+                    if error is None:
+                        return task.result()
+                for task, error in outcomes:
+                    last_error = error
+                    if not _is_retryable(error):
+                        raise error
+                    logger.warning(f"模型後端 {task.get_name()} 失敗（{error}），改送下一個後端")
+                if not pending and not launch():
+                    break
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        json_output: Optional[Union[bool, type]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        last_error: BaseException = RuntimeError("沒有可用的模型後端")
+        candidates = iter(self._ranked())
+        while (backend := self._next_allowed(candidates)) is not None:
+            backend.requests += 1
+            start = time.monotonic()
+            started = False
+            settled = False
+            usage: Optional[RequestUsage] = None
+            span = begin_span("llm.backend_stream", {"llm.backend": backend.name})
+            try:
+                async for chunk in backend.client.create_stream(
+                    messages,
+                    tools=tools,
+                    json_output=json_output,
+                    extra_create_args=extra_create_args,
+                    cancellation_token=cancellation_token,
+                ):
+                    if not started:
+                        span.set_attribute("llm.time_to_first_token_ms", round((time.monotonic() - start) * 1000, 1))
+                    started = True
+                    if isinstance(chunk, CreateResult):
+                        usage = chunk.usage
+                    yield chunk
+                backend.record_success(time.monotonic() - start, usage)
+                settled = True
+            except Exception as e:
+                span.record_exception(e)
+                backend.record_failure(e, time.monotonic() - start)
+                settled = True
+                if started or not _is_retryable(e):
+                    raise
+                last_error = e
+                logger.warning(f"模型後端 {backend.name} 失敗（{e}），改送下一個後端")
+                continue
+            finally:
+                if not settled:
+                    # 呼叫端中途關閉或取消串流，沒有結果可記錄，只釋放試探名額
+                    backend.breaker.release()
+                span.end()
+            return
+        raise last_error
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """各後端的延遲、錯誤率與狀態"""
+        return {backend.name: backend.stats() for backend in self._backends}
+
+    async def close(self) -> None:
+        await asyncio.gather(*(backend.client.close() for backend in self._backends))
+
+    def actual_usage(self) -> RequestUsage:
+        usages = [backend.client.actual_usage() for backend in self._backends]
+        return RequestUsage(
+            prompt_tokens=sum(u.prompt_tokens for u in usages),
+            completion_tokens=sum(u.completion_tokens for u in usages),
+        )
+
+    def total_usage(self) -> RequestUsage:
+        usages = [backend.client.total_usage() for backend in self._backends]
+        return RequestUsage(
+            prompt_tokens=sum(u.prompt_tokens for u in usages),
+            completion_tokens=sum(u.completion_tokens for u in usages),
+        )
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Union[Tool, ToolSchema]] = []) -> int:
+        return self._backends[0].client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Union[Tool, ToolSchema]] = []) -> int:
+        return min(backend.client.remaining_tokens(messages, tools=tools) for backend in self._backends)
+
+    @property
+    def capabilities(self) -> Any:
+        return {key: self._model_info[key] for key in ("vision", "function_calling", "json_output")}
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._model_info
+
+    @property
+    def _create_args(self) -> Dict[str, Any]:
+        """
+        彙整各後端的取樣參數，供 CachingChatCompletionClient 計算快取鍵
+
+        回應可能來自任何一個後端，因此 model 列出所有後端；temperature 取最大值，
+        任一後端未設定時視為未知（不列出）；n 取最大值
+        """
+        backend_args = [dict(getattr(backend.client, "_create_args", {}) or {}) for backend in self._backends]
+        create_args: Dict[str, Any] = {
+            "model": [args.get("model", backend.name) for args, backend in zip(backend_args, self._backends)],
+            "n": max(args.get("n", 1) for args in backend_args),
+        }
+        temperatures = [args.get("temperature") for args in backend_args]
+        if all(temperature is not None for temperature in temperatures):
+            create_args["temperature"] = max(temperatures)
+        return create_args
+
+    def _dump_backend(self, backend: ModelBackend) -> ModelBackendConfig:
+        model_client = backend.client.dump_component()
+        api_key_env = self._api_key_envs.get(backend.name)
+        if api_key_env:
+            model_client.config.pop("api_key", None)
+        return ModelBackendConfig(name=backend.name, model_client=model_client, api_key_env=api_key_env)
+
+    def _to_config(self) -> RouterChatCompletionClientConfig:
+        return RouterChatCompletionClientConfig(
+            backends=[self._dump_backend(backend) for backend in self._backends],
+            ewma_alpha=self._ewma_alpha,
+            error_penalty=self._error_penalty,
+            hedge=self._hedge,
+            hedge_multiplier=self._hedge_multiplier,
+            min_hedge_delay=self._min_hedge_delay,
+            failure_threshold=self._failure_threshold,
+            reset_timeout=self._reset_timeout,
+        )
+
+    @classmethod
+    def _load_backend(cls, backend: ModelBackendConfig) -> Optional[ChatCompletionClient]:
+        """載入後端客戶端；缺少 API 金鑰時回傳 None，讓其他後端照常運作"""
+        model_client = backend.model_client
+        if backend.api_key_env:
+            api_key = os.getenv(backend.api_key_env)
+            if not api_key:
+                logger.warning(f"模型後端 {backend.name} 缺少環境變數 {backend.api_key_env}，略過此後端")
+                return None
+            model_client = model_client.model_copy(
+                update={"config": {**model_client.config, "api_key": api_key}}
+            )
+        return ChatCompletionClient.load_component(model_client)
+
+    @classmethod
+    def _from_config(cls, config: RouterChatCompletionClientConfig) -> Self:
+        backends: Dict[str, ChatCompletionClient] = {}
+        for backend in config.backends:
+            client = cls._load_backend(backend)
+            if client is not None:
+                backends[backend.name] = client
+        if not backends:
+            missing = ", ".join(backend.api_key_env or backend.name for backend in config.backends)
+            raise ValueError(f"沒有可用的模型後端，請設定 {missing}")
+        return cls(
+            backends=backends,
+            ewma_alpha=config.ewma_alpha,
+            error_penalty=config.error_penalty,
+            hedge=config.hedge,
+            hedge_multiplier=config.hedge_multiplier,
+            min_hedge_delay=config.min_hedge_delay,
+            failure_threshold=config.failure_threshold,
+            reset_timeout=config.reset_timeout,
+            api_key_envs={
+                backend.name: backend.api_key_env
+                for backend in config.backends
+                if backend.api_key_env and backend.name in backends
+            },
+        )
@@ -0,0 +1,276 @@
+"""
+事件迴圈延遲監控與按需剖析
+
+- LoopLagMonitor（常駐）：心跳任務量測排程延遲並寫入 event_loop_lag_seconds；
+  看門狗執行緒在心跳停頓超過門檻時，記錄事件迴圈執行緒當下的堆疊，直接指出阻塞的呼叫
+- /admin/profile（需設定 PROFILING_ADMIN_TOKEN 才會啟用）：擷取 N 秒的剖析結果，
+  輸出 folded stacks 格式，可直接交給 flamegraph.pl、speedscope 或 inferno
+    mode=cpu             以背景執行緒定期取樣堆疊（牆鐘時間取樣，預設略過閒置的 select/wait）
+    mode=slow_callbacks  暫時開啟 asyncio 除錯模式，彙整執行超過 threshold_ms 的回呼
+
+設定：
+    PROFILING_ADMIN_TOKEN   管理端點的存取權杖（請求標頭 X-Admin-Token），未設定時不註冊端點
+    LOOP_LAG_THRESHOLD_MS   視為阻塞的門檻（預設 250）
+    LOOP_LAG_INTERVAL_MS    心跳間隔（預設 100）
+
+範例：
+    curl -H "X-Admin-Token: $PROFILING_ADMIN_TOKEN" \\
+        "http://localhost:8000/admin/profile?seconds=30" -o profile.folded
+    flamegraph.pl profile.folded > profile.svg
+"""
+import os
+import re
+import sys
+import time
+import asyncio
+import logging
+import secrets
+import threading
+import traceback
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from common.metrics import EVENT_LOOP_LAG
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "250")) / 1000
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL_MS", "100")) / 1000
+MAX_PROFILE_SECONDS = 120
+
+# 執行緒閒置等待時的最內層框架（檔名, 函式名）
+_IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+def _frame_label(frame: Any) -> str:
+    code = frame.f_code
+    # 以函式定義行而非目前執行行分組，火焰圖才不會被切得太碎；分號是 folded 格式的分隔符
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+def _is_idle(frame: Any) -> bool:
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in _IDLE_FRAMES
+
+
+def _folded(counts: Counter) -> str:
+    return "\n".join(f"{stack} {count}" for stack, count in counts.most_common()) + "\n"
+
+
+class StackSampler:
+    """
+    定期取樣指定執行緒的 Python 堆疊，累計為 folded stacks
+
+    Args:
+        interval: 取樣間隔（秒）
+        thread_ids: 只取樣這些執行緒；None 表示全部（取樣執行緒本身除外）
+        include_idle: 是否保留閒置等待中的樣本
+    """
+
+    def __init__(self, interval: float = 0.005, thread_ids: Optional[Set[int]] = None, include_idle: bool = False):
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.include_idle = include_idle
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join()
+        return _folded(self.counts)
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                self.samples += 1
+                if not self.include_idle and _is_idle(frame):
+                    self.idle_samples += 1
+                    continue
+                stack: List[str] = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)).replace(";", ","))
+                self.counts[";".join(reversed(stack))] += 1
+
+
+class _SlowCallbackHandler(logging.Handler):
+    """收集 asyncio 除錯模式的「Executing <handle> took N seconds」警告"""
+
+    # 去掉記憶體位址、任務編號與建立位置，讓同一個回呼可以合併
+    _NOISE = re.compile(r" at 0x[0-9a-f]+|name='Task-\d+' | created at \S+|\[\d+\]")
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.durations: Counter = Counter()
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if not str(record.msg).startswith("Executing") or len(record.args or ()) != 2:
+            return
+        handle, seconds = record.args
+        label = self._NOISE.sub("", str(handle)).replace(";", ",")
+        # folded 格式的權重用毫秒
+        self.durations[f"slow_callback;{label}"] += max(1, round(seconds * 1000))
+        self.count += 1
+
+
+async def capture_slow_callbacks(seconds: float, threshold: float) -> _SlowCallbackHandler:
+    """暫時開啟事件迴圈除錯模式，收集 seconds 秒內執行超過 threshold 秒的回呼"""
+    loop = asyncio.get_running_loop()
+    asyncio_logger = logging.getLogger("asyncio")
+    handler = _SlowCallbackHandler()
+    previous = (loop.get_debug(), loop.slow_callback_duration, asyncio_logger.level)
+    asyncio_logger.addHandler(handler)
+    if asyncio_logger.getEffectiveLevel() > logging.WARNING:
+        asyncio_logger.setLevel(logging.WARNING)
+    loop.slow_callback_duration = threshold
+    loop.set_debug(True)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        loop.set_debug(previous[0])
+        loop.slow_callback_duration = previous[1]
+        asyncio_logger.setLevel(previous[2])
+        asyncio_logger.removeHandler(handler)
+    return handler
+
+
+class LoopLagMonitor:
+    """
+    常駐的事件迴圈延遲監控
+
+    心跳任務每 interval 秒醒來一次，晚醒的時間即為排程延遲；看門狗執行緒發現心跳
+    停頓超過 threshold 時，於阻塞期間擷取事件迴圈執行緒的堆疊並記錄下來
+    """
+
+    def __init__(self, service: str, threshold: float = LOOP_LAG_THRESHOLD, interval: float = LOOP_LAG_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=20)
+        self._lag = EVENT_LOOP_LAG.labels(service)
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """在事件迴圈內呼叫（例如 FastAPI 的 startup 事件）"""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+            lag = max(0.0, now - expected)
+            self._lag.observe(lag)
+            if lag >= self.threshold:
+                logger.warning(f"事件迴圈延遲 {lag * 1000:.0f} ms")
+
+    def _watch(self) -> None:
+        reported_beat = None
+        while not self._stop.wait(self.interval / 2):
+            beat = self._beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.threshold or beat == reported_beat:
+                continue
+            # 同一次阻塞只記錄一次堆疊
+            reported_beat = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            self.stalls.append({"time": time.time(), "stalled_ms": round(stalled * 1000), "stack": stack})
+            logger.warning(f"事件迴圈已阻塞 {stalled * 1000:.0f} ms，目前堆疊：\n{stack}")
+
+
+def install_profiling(app: Any, service: str) -> LoopLagMonitor:
+    """
+    啟動事件迴圈延遲監控；設定了 PROFILING_ADMIN_TOKEN 時另外註冊管理端點：
+        GET /admin/profile       擷取剖析結果（folded stacks）
+        GET /admin/loop-stalls   最近記錄到的阻塞堆疊
+    """
+    from fastapi import HTTPException, Request
+    from fastapi.responses import PlainTextResponse
+
+    monitor = LoopLagMonitor(service)
+    app.add_event_handler("startup", monitor.start)
+    app.add_event_handler("shutdown", monitor.stop)
+    if not PROFILING_ADMIN_TOKEN:
+        return monitor
+
+    capture_lock = asyncio.Lock()
+
+    def check_token(request: Request) -> None:
+        if not secrets.compare_digest(request.headers.get("x-admin-token", ""), PROFILING_ADMIN_TOKEN):
+            raise HTTPException(status_code=403, detail="管理權杖錯誤")
+
+    @app.get("/admin/profile", include_in_schema=False)
+    async def capture_profile(
+        request: Request,
+        seconds: float = 10,
+        mode: str = "cpu",
+        interval_ms: float = 5,
+        threads: str = "loop",
+        include_idle: bool = False,
+        threshold_ms: float = 50,
+    ):
+        check_token(request)
+        if mode not in ("cpu", "slow_callbacks"):
+            raise HTTPException(status_code=400, detail="mode 必須是 cpu 或 slow_callbacks")
+        if capture_lock.locked():
+            raise HTTPException(status_code=409, detail="已有剖析正在進行")
+        seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+        async with capture_lock:
+            if mode == "cpu":
+                thread_ids = None if threads == "all" else {threading.get_ident()}
+                sampler = StackSampler(max(interval_ms, 1) / 1000, thread_ids, include_idle)
+                sampler.start()
+                try:
+                    await asyncio.sleep(seconds)
+                finally:
+                    body = sampler.stop()
+                headers = {"X-Profile-Samples": str(sampler.samples), "X-Profile-Idle-Samples": str(sampler.idle_samples)}
+            else:
+                report = await capture_slow_callbacks(seconds, threshold_ms / 1000)
+                body = _folded(report.durations)
+                headers = {"X-Slow-Callbacks": str(report.count)}
+        filename = f"{service}-{mode}-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return PlainTextResponse(body, headers=headers)
+
+    @app.get("/admin/loop-stalls", include_in_schema=False)
+    async def loop_stalls(request: Request):
+        check_token(request)
+        return {"threshold_ms": round(monitor.threshold * 1000), "stalls": list(monitor.stalls)}
+
+    return monitor
@@ -0,0 +1,480 @@
+"""
+團隊執行的錄製與重播基準測試
+
+錄製：設定 RUN_RECORD_PATH 後，autogen_api 每次團隊執行都會附加一筆紀錄（JSONL，
+副檔名為 .gz 時以 gzip 壓縮），包含任務、各回合的發言者、每次模型回應（CreateResult）
+與工具結果。模型回應在 CachingChatCompletionClient、工具結果在 ParallelTool 記錄，
+也就是代理實際看到的內容（含快取命中）。
+
+重播：以目前的團隊 JSON 建立團隊，把最外層的模型用戶端與工具換成依錄製內容回應的替身，
+離線且確定性地重跑整個協作流程。替身不花時間，因此重播的牆鐘時間就是框架開銷；
+prompt token 依實際送出的訊息估算（與錄製時同一估算方式），可看出提示詞修改造成的增減。
+
+    python -m common.replay runs.jsonl [--teams-dir json] [--repeat 5] [--scenario weather]
+                            [--save report.json] [--baseline report.json]
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import statistics
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, Deque, Dict, Iterator, List, Mapping, Optional, Sequence, Union
+
+from pydantic import BaseModel
+from typing_extensions import Self
+from autogen_core import CancellationToken, Component, ComponentModel
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage, ModelInfo, RequestUsage
+from autogen_core.tools import BaseTool, Tool, ToolSchema
+
+from common.model_context import estimate_tokens, message_tokens
+
+RUN_RECORD_PATH = os.getenv("RUN_RECORD_PATH", "")
+DEFAULT_TEAMS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "json")
+
+_recorder: ContextVar[Optional["RunRecorder"]] = ContextVar("run_recorder", default=None)
+_session: ContextVar[Optional["ReplaySession"]] = ContextVar("replay_session", default=None)
+
+
+class ReplayDivergence(RuntimeError):
+    """重播時團隊要求的模型或工具呼叫超出錄製內容"""
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _args_key(args: Mapping[str, Any]) -> str:
+    return json.dumps(args, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _prompt_tokens(messages: Sequence[LLMMessage]) -> int:
+    return sum(message_tokens(message) for message in messages)
+
+
+def is_turn(item: Any) -> bool:
+    """事件（…Event）屬於回合內的步驟，使用者訊息不算回合，其餘訊息代表一個代理回合結束"""
+    return not type(item).__name__.endswith("Event") and item.source != "user"
+
+
+# ---------------------------------------------------------------- 錄製
+
+class RunRecorder:
+    """收集一次團隊執行中的模型回應、工具結果與回合"""
+
+    def __init__(self, team: str, task: str):
+        self.team = team
+        self.task = task
+        self.calls: List[Dict[str, Any]] = []
+        self.turns: List[Dict[str, Any]] = []
+
+    def record_model(self, messages: Sequence[LLMMessage], result: CreateResult, elapsed: float) -> None:
+        self.calls.append({
+            "kind": "model",
+            "prompt_tokens_est": _prompt_tokens(messages),
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "result": result.model_dump(mode="json"),
+        })
+
+    def record_tool(self, name: str, args: Mapping[str, Any], result: str, error: bool, elapsed: float) -> None:
+        self.calls.append({
+            "kind": "tool",
+            "name": name,
+            "args": dict(args),
+            "result": result,
+            "error": error,
+            "elapsed_ms": round(elapsed * 1000, 1),
+        })
+
+    def record_turn(self, item: Any) -> None:
+        text = item.to_text() if hasattr(item, "to_text") else str(getattr(item, "content", ""))
+        self.turns.append({"source": item.source, "type": type(item).__name__, "tokens_est": estimate_tokens(text)})
+
+    def to_record(self, wall_time: float, stop_reason: Optional[str]) -> Dict[str, Any]:
+        models = [c for c in self.calls if c["kind"] == "model"]
+        return {
+            "id": hashlib.sha1(f"{self.team}\n{self.task}".encode("utf-8")).hexdigest()[:10],
+            "team": self.team,
+            "task": self.task,
+            "recorded_at": time.time(),
+            "wall_time": round(wall_time, 3),
+            "stop_reason": stop_reason,
+            "prompt_tokens": sum(c["result"]["usage"]["prompt_tokens"] for c in models),
+            "completion_tokens": sum(c["result"]["usage"]["completion_tokens"] for c in models),
+            "prompt_tokens_est": sum(c["prompt_tokens_est"] for c in models),
+            "turns": self.turns,
+            "calls": self.calls,
+        }
+
+    def save(self, path: str, wall_time: float, stop_reason: Optional[str]) -> None:
+        line = json.dumps(self.to_record(wall_time, stop_reason), ensure_ascii=False, separators=(",", ":"))
+        with _open(path, "a") as f:
+            f.write(line + "\n")
+
+
+@contextmanager
+def record_scope(recorder: Optional[RunRecorder]) -> Iterator[Optional[RunRecorder]]:
+    """在範圍內（含團隊執行建立的任務）把模型與工具呼叫記錄到 recorder；None 表示不錄製"""
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+
+
+def current_recorder() -> Optional[RunRecorder]:
+    return _recorder.get()
+
+
+def load_runs(path: str) -> List[Dict[str, Any]]:
+    """讀取錄製檔；同一團隊與任務只保留最新的一筆"""
+    runs: Dict[str, Dict[str, Any]] = {}
+    with _open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                run = json.loads(line)
+                runs[run["id"]] = run
+    return list(runs.values())
+
+
+# ---------------------------------------------------------------- 重播
+
+class ReplaySession:
+    """依錄製順序提供模型回應，依（工具, 參數）提供工具結果"""
+
+    def __init__(self, run: Dict[str, Any]):
+        self._models: Deque[Dict[str, Any]] = deque(c for c in run["calls"] if c["kind"] == "model")
+        self._tools: Dict[str, List[Dict[str, Any]]] = {}
+        for call in run["calls"]:
+            if call["kind"] == "tool":
+                self._tools.setdefault(call["name"], []).append(call)
+        self.model_calls = 0
+        self.tool_calls = 0
+        self.tool_mismatches = 0
+        self.prompt_tokens_est = 0
+        self.completion_tokens = 0
+        # 替身本身花費的時間，從牆鐘時間扣除後即為框架開銷
+        self.stub_time = 0.0
+
+    @property
+    def unused_model_responses(self) -> int:
+        return len(self._models)
+
+    def next_model(self, messages: Sequence[LLMMessage]) -> CreateResult:
+        start = time.perf_counter()
+        try:
+            if not self._models:
+                raise ReplayDivergence(f"第 {self.model_calls + 1} 次模型呼叫沒有對應的錄製回應")
+            call = self._models.popleft()
+            prompt_tokens = _prompt_tokens(messages)
+            result = CreateResult.model_validate(call["result"])
+            result.usage = RequestUsage(prompt_tokens=prompt_tokens, completion_tokens=result.usage.completion_tokens)
+            result.cached = False
+            self.model_calls += 1
+            self.prompt_tokens_est += prompt_tokens
+            self.completion_tokens += result.usage.completion_tokens
+            return result
+        finally:
+            self.stub_time += time.perf_counter() - start
+
+    def tool_result(self, name: str, args: Mapping[str, Any]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            calls = self._tools.get(name)
+            if not calls:
+                raise ReplayDivergence(f"工具 {name} 沒有對應的錄製結果")
+            key = _args_key(args)
+            for i, call in enumerate(calls):
+                if _args_key(call["args"]) == key:
+                    break
+            else:
+                # 參數與錄製時不同：依順序使用同一工具的下一筆結果
+                i = 0
+                self.tool_mismatches += 1
+            self.tool_calls += 1
+            return calls.pop(i)
+        finally:
+            self.stub_time += time.perf_counter() - start
+
+
+def _active_session() -> ReplaySession:
+    session = _session.get()
+    if session is None:
+        raise RuntimeError("重播替身只能在 replay_run() 中使用")
+    return session
+
+
+class ReplayChatCompletionClientConfig(BaseModel):
+    model_client: ComponentModel
+
+
+class ReplayChatCompletionClient(ChatCompletionClient, Component[ReplayChatCompletionClientConfig]):
+    """
+    依目前的重播紀錄回應的模型用戶端替身
+
+    原本的模型用戶端只用來提供 model_info（是否支援工具呼叫、視覺等），不會被呼叫。
+
+    Args:
+        model_client (ChatCompletionClient): 被取代的模型用戶端
+    """
+
+    component_type = "model"
+    component_config_schema = ReplayChatCompletionClientConfig
+    component_provider_override = "common.replay.ReplayChatCompletionClient"
+
+    def __init__(self, model_client: ChatCompletionClient):
+        self._client = model_client
+        self._total_usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+
+    def _next(self, messages: Sequence[LLMMessage]) -> CreateResult:
+        result = _active_session().next_model(messages)
+        self._total_usage = RequestUsage(
+            prompt_tokens=self._total_usage.prompt_tokens + result.usage.prompt_tokens,
+            completion_tokens=self._total_usage.completion_tokens + result.usage.completion_tokens,
+        )
+        return result
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        json_output: Optional[Union[bool, type]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        return self._next(messages)
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Union[Tool, ToolSchema]] = [],
+        json_output: Optional[Union[bool, type]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        result = self._next(messages)
+        if isinstance(result.content, str):
+            yield result.content
+        yield result
+
+    async def close(self) -> None:
+        pass
+
+    def actual_usage(self) -> RequestUsage:
+        return self._total_usage
+
+    def total_usage(self) -> RequestUsage:
+        return self._total_usage
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Union[Tool, ToolSchema]] = []) -> int:
+        return _prompt_tokens(messages)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Union[Tool, ToolSchema]] = []) -> int:
+        return self._client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> Any:
+        return self._client.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._client.model_info
+
+    def _to_config(self) -> ReplayChatCompletionClientConfig:
+        return ReplayChatCompletionClientConfig(model_client=self._client.dump_component())
+
+    @classmethod
+    def _from_config(cls, config: ReplayChatCompletionClientConfig) -> Self:
+        return cls(model_client=ChatCompletionClient.load_component(config.model_client))
+
+
+class ReplayToolConfig(BaseModel):
+    tool: ComponentModel
+
+
+class ReplayTool(BaseTool[BaseModel, BaseModel], Component[ReplayToolConfig]):
+    """
+    依目前的重播紀錄回傳結果的工具替身，保留原工具的名稱與參數結構
+
+    Args:
+        tool (BaseTool): 被取代的工具
+    """
+
+    component_type = "tool"
+    component_config_schema = ReplayToolConfig
+    component_provider_override = "common.replay.ReplayTool"
+
+    def __init__(self, tool: BaseTool[Any, Any]):
+        super().__init__(tool.args_type(), tool.return_type(), tool.name, tool.description)
+        self._tool = tool
+
+    @property
+    def schema(self) -> Any:
+        return self._tool.schema
+
+    def return_value_as_string(self, value: Any) -> str:
+        # 錄製的是字串化後的結果
+        return value if isinstance(value, str) else self._tool.return_value_as_string(value)
+
+    async def run(self, args: BaseModel, cancellation_token: CancellationToken) -> Any:
+        return await self.run_json(args.model_dump(), cancellation_token)
+
+    async def run_json(self, args: Mapping[str, Any], cancellation_token: CancellationToken, **kwargs: Any) -> Any:
+        call = _active_session().tool_result(self.name, args)
+        if call["error"]:
+            raise RuntimeError(call["result"])
+        return call["result"]
+
+    def _to_config(self) -> ReplayToolConfig:
+        return ReplayToolConfig(tool=self._tool.dump_component())
+
+    @classmethod
+    def _from_config(cls, config: ReplayToolConfig) -> Self:
+        return cls(tool=BaseTool.load_component(config.tool))
+
+
+def replay_config(config: Any) -> Any:
+    """把團隊設定中最外層的模型用戶端與工具換成重播替身（內層的快取、路由與工具包裝不會被呼叫）"""
+    if isinstance(config, list):
+        return [replay_config(item) for item in config]
+    if not isinstance(config, dict):
+        return config
+    kind = config.get("component_type")
+    if kind == "model":
+        return {"provider": ReplayChatCompletionClient.component_provider_override, "component_type": "model",
+                "config": {"model_client": config}}
+    if kind == "tool":
+        return {"provider": ReplayTool.component_provider_override, "component_type": "tool",
+                "config": {"tool": config}}
+    return {key: replay_config(value) for key, value in config.items()}
+
+
+async def replay_run(team_config: Dict[str, Any], run: Dict[str, Any]) -> Dict[str, Any]:
+    """以錄製內容重跑一次團隊，回傳回合數、token 估算與時間"""
+    from autogen_agentchat.base import TaskResult
+    from autogen_agentchat.teams import BaseGroupChat
+
+    team = BaseGroupChat.load_component(replay_config(team_config))
+    session = ReplaySession(run)
+    turns = 0
+    stop_reason = error = None
+    token = _session.set(session)
+    start = time.perf_counter()
+    try:
+        async for item in team.run_stream(task=run["task"]):
+            if isinstance(item, TaskResult):
+                stop_reason = item.stop_reason
+            elif is_turn(item):
+                turns += 1
+    except Exception as e:
+        # 代理執行時的例外會被團隊包成 RuntimeError，訊息中保留原本的 ReplayDivergence
+        error = f"{type(e).__name__}: {e}".splitlines()[0]
+    finally:
+        wall_time = time.perf_counter() - start
+        _session.reset(token)
+    return {
+        "turns": turns,
+        "model_calls": session.model_calls,
+        "tool_calls": session.tool_calls,
+        "prompt_tokens_est": session.prompt_tokens_est,
+        "completion_tokens": session.completion_tokens,
+        "wall_ms": wall_time * 1000,
+        "overhead_ms": (wall_time - session.stub_time) * 1000,
+        "stop_reason": stop_reason,
+        "diverged": error is not None or session.unused_model_responses > 0 or session.tool_mismatches > 0,
+        "error": error,
+        "unused_model_responses": session.unused_model_responses,
+        "tool_mismatches": session.tool_mismatches,
+    }
+
+
+async def benchmark(runs: List[Dict[str, Any]], teams_dir: str, repeat: int) -> List[Dict[str, Any]]:
+    configs: Dict[str, Dict[str, Any]] = {}
+    report = []
+    for run in runs:
+        if run["team"] not in configs:
+            with open(os.path.join(teams_dir, f"{run['team']}_team.json"), "r", encoding="utf-8") as f:
+                configs[run["team"]] = json.load(f)
+        results = [await replay_run(configs[run["team"]], run) for _ in range(repeat)]
+        last = results[-1]
+        report.append({
+            "scenario": f"{run['team']}/{run['id']}",
+            "task": run["task"],
+            "recorded": {
+                "turns": len(run["turns"]),
+                "prompt_tokens": run["prompt_tokens"],
+                "prompt_tokens_est": run["prompt_tokens_est"],
+                "completion_tokens": run["completion_tokens"],
+                "wall_ms": run["wall_time"] * 1000,
+            },
+            "replay": {
+                **{k: v for k, v in last.items() if k not in ("wall_ms", "overhead_ms")},
+                "wall_ms": statistics.median(r["wall_ms"] for r in results),
+                "overhead_ms": statistics.median(r["overhead_ms"] for r in results),
+            },
+        })
+    return report
+
+
+def _delta(current: float, previous: Optional[float]) -> str:
+    if previous is None:
+        return ""
+    diff = current - previous
+    return f" ({diff:+.0f})" if diff else ""
+
+
+def print_report(report: List[Dict[str, Any]], baseline: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+    print(f"{'情境':<22} {'回合 錄製→重播':>14} {'prompt(估) 錄製→重播':>24} {'錄製耗時':>10} {'框架開銷':>16}  狀態")
+    for entry in report:
+        recorded, replay = entry["recorded"], entry["replay"]
+        base = (baseline or {}).get(entry["scenario"], {}).get("replay", {})
+        status = "一致"
+        if replay["diverged"]:
+            status = replay["error"] or (
+                f"分歧：未用模型回應 {replay['unused_model_responses']}、工具參數不符 {replay['tool_mismatches']}"
+            )
+        turns = f"{recorded['turns']}→{replay['turns']}{_delta(replay['turns'], base.get('turns'))}"
+        tokens = f"{recorded['prompt_tokens_est']}→{replay['prompt_tokens_est']}" \
+                 f"{_delta(replay['prompt_tokens_est'], base.get('prompt_tokens_est'))}"
+        overhead = f"{replay['overhead_ms']:.1f}ms{_delta(replay['overhead_ms'], base.get('overhead_ms'))}"
+        print(f"{entry['scenario']:<22} {turns:>14} {tokens:>24} {recorded['wall_ms'] / 1000:>9.1f}s {overhead:>16}  {status}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="以錄製的團隊執行離線重播，比較回合數、token 與框架開銷")
+    parser.add_argument("path", nargs="?", default=RUN_RECORD_PATH or "team_runs.jsonl", help="錄製檔（.jsonl 或 .jsonl.gz）")
+    parser.add_argument("--teams-dir", default=DEFAULT_TEAMS_DIR, help="團隊 JSON 所在目錄")
+    parser.add_argument("--repeat", type=int, default=5, help="每個情境重播次數，時間取中位數")
+    parser.add_argument("--scenario", action="append", help="只重播指定的團隊名稱或紀錄 id，可重複指定")
+    parser.add_argument("--save", help="將報告另存為 JSON，供之後以 --baseline 比較")
+    parser.add_argument("--baseline", help="先前以 --save 存下的報告，括號內顯示差異")
+    args = parser.parse_args()
+
+    runs = load_runs(args.path)
+    if args.scenario:
+        runs = [run for run in runs if run["team"] in args.scenario or run["id"] in args.scenario]
+    if not runs:
+        sys.exit("沒有可重播的紀錄")
+    report = asyncio.run(benchmark(runs, args.teams_dir, max(1, args.repeat)))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = {entry["scenario"]: entry for entry in json.load(f)}
+    print_report(report, baseline)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
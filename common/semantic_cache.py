@@ -0,0 +1,218 @@
+"""
+以本地 embedding 比對改寫過的相同問題，重用先前團隊執行結果的語意快取
+
+句向量模型無法載入（例如離線環境）時快取停用：字元層級的相似度分不出「GPT-4」與「GPT-5」，
+寧可不快取也不回傳錯誤的答案。
+"""
+import os
+import re
+import json
+import time
+import logging
+import threading
+import unicodedata
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from common.metrics import CacheCounters
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+DEFAULT_AUDIT_PATH = os.getenv(
+    "SEMANTIC_CACHE_AUDIT_LOG",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "semantic_cache_audit.jsonl")
+)
+# 分數低於門檻但差距在此範圍內的查詢也寫入稽核紀錄，方便調整門檻
+AUDIT_MARGIN = 0.1
+
+_PUNCT_RE = re.compile(r'[\s\W_]+', re.UNICODE)
+
+
+def normalize_query(text: str) -> str:
+    """正規化查詢：NFKC、轉小寫並以單一空白取代標點與空白"""
+    return _PUNCT_RE.sub(" ", unicodedata.normalize("NFKC", text).lower()).strip()
+
+
+class TransformerEmbedder:
+    """以 transformers 在 CPU 上執行小型句向量模型（mean pooling）"""
+
+    def __init__(self, model_name: str = SEMANTIC_CACHE_MODEL):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self._torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).eval()
+
+    def embed(self, text: str) -> np.ndarray:
+        inputs = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=128)
+        with self._torch.no_grad():
+            hidden = self.model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        vector = ((hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9))[0].numpy().astype(np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+@lru_cache(maxsize=1)
+def get_embedder() -> Optional[TransformerEmbedder]:
+    """載入句向量模型，失敗時回傳 None（語意快取停用）"""
+    try:
+        return TransformerEmbedder()
+    except Exception as e:
+        logger.warning(f"無法載入 {SEMANTIC_CACHE_MODEL}，語意快取停用: {e}")
+        return None
+
+
+class CacheHit(NamedTuple):
+    value: Dict[str, Any]
+    score: float
+    matched_query: str
+    age: float
+
+
+class SemanticCache:
+    """
+    以 NumPy 矩陣保存查詢向量的語意快取
+
+    查詢經正規化與 embedding 後，與同一分區（例如相同的搜索類別與筆數）中
+    未過期的項目計算餘弦相似度，最高分達 threshold 即命中。命中與接近門檻
+    的查詢寫入 JSONL 稽核紀錄，以便檢查命中品質。沒有可用的 embedder 時
+    lookup 一律未命中、store 不保存。
+
+    Args:
+        name (str): 快取名稱（寫入稽核紀錄）
+        ttl (float): 項目有效秒數
+        threshold (float): 命中所需的最低相似度
+        max_entries (int): 最多保存的項目數
+        embedder (Any): 具有 embed(text) -> np.ndarray 的物件，預設為 get_embedder()（載入失敗時停用）
+        audit_path (Optional[str]): 稽核紀錄路徑，None 表示不記錄
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        embedder: Any = None,
+        audit_path: Optional[str] = DEFAULT_AUDIT_PATH,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._embedder = embedder
+        self.audit_path = audit_path
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None
+        self._expires = np.zeros(0, dtype=np.float64)
+        self._entries: List[Dict[str, Any]] = []
+        self._counters = CacheCounters(f"semantic_{name}")
+        # 未命中後緊接著 store 同一查詢時不必重算 embedding
+        self._embed = lru_cache(maxsize=256)(self._embed_uncached)
+
+    @property
+    def embedder(self) -> Any:
+        if self._embedder is None:
+            self._embedder = get_embedder()
+        return self._embedder
+
+    @property
+    def enabled(self) -> bool:
+        return self.embedder is not None
+
+    def _embed_uncached(self, normalized: str) -> np.ndarray:
+        return self.embedder.embed(normalized)
+
+    def _audit(self, record: Dict[str, Any]) -> None:
+        if not self.audit_path:
+            return
+        try:
+            with open(self.audit_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"time": time.time(), "cache": self.name, **record}, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning(f"無法寫入語意快取稽核紀錄: {e}")
+
+    def lookup(self, query: str, partition: str = "") -> Optional[CacheHit]:
+        """
+        尋找語意相同的先前查詢（embedding 在 CPU 上計算，請以 asyncio.to_thread 呼叫）
+
+        Args:
+            query (str): 查詢文字
+            partition (str): 分區，只在相同分區中比對
+
+        Returns:
+            Optional[CacheHit]: 命中時回傳快取值與相似度
+        """
+        if not self.enabled:
+            return None
+        hit = self._lookup(query, partition)
+        self._counters.record(hit is not None)
+        return hit
+
+    def _lookup(self, query: str, partition: str) -> Optional[CacheHit]:
+        normalized = normalize_query(query)
+        vector = self._embed(normalized)
+        now = time.time()
+        with self._lock:
+            if self._vectors is None or not self._entries:
+                return None
+            scores = self._vectors @ vector
+            valid = (self._expires > now) & np.array([e["partition"] == partition for e in self._entries])
+            if not valid.any():
+                return None
+            scores = np.where(valid, scores, -1.0)
+            index = int(np.argmax(scores))
+            score = float(scores[index])
+            entry = self._entries[index]
+
+        hit = score >= self.threshold
+        if score >= self.threshold - AUDIT_MARGIN:
+            self._audit({
+                "hit": hit,
+                "score": round(score, 4),
+                "query": normalized,
+                "matched_query": entry["query"],
+                "partition": partition,
+            })
+        if not hit:
+            return None
+        return CacheHit(entry["value"], score, entry["query"], now - entry["created_at"])
+
+    def store(self, query: str, value: Dict[str, Any], partition: str = "") -> None:
+        """保存查詢結果（同樣會計算 embedding）"""
+        if not self.enabled:
+            return
+        normalized = normalize_query(query)
+        vector = self._embed(normalized)[np.newaxis, :]
+        now = time.time()
+        with self._lock:
+            # 移除過期項目，仍超過上限時移除最舊的項目
+            keep = self._expires > now
+            if keep.sum() >= self.max_entries:
+                keep[np.flatnonzero(keep)[:keep.sum() - self.max_entries + 1]] = False
+            if self._vectors is not None and not keep.all():
+                self._vectors = self._vectors[keep]
+                self._expires = self._expires[keep]
+                self._entries = [e for e, k in zip(self._entries, keep) if k]
+
+            self._vectors = vector if self._vectors is None or not self._entries else np.vstack([self._vectors, vector])
+            self._expires = np.append(self._expires, now + self.ttl)
+            self._entries.append({"query": normalized, "value": value, "partition": partition, "created_at": now})
+
+
+def summarize_task_result(result: Any) -> Dict[str, Any]:
+    """摘要團隊執行的 TaskResult（最後一則文字訊息與停止原因），用來判斷結果是否值得快取"""
+    for message in reversed(getattr(result, "messages", [])):
+        content = getattr(message, "content", None)
+        if isinstance(content, str):
+            answer = content.replace("TERMINATE", "").strip()
+            if answer:
+                return {"answer": answer, "source": message.source, "stop_reason": result.stop_reason}
+    return {"answer": None, "source": None, "stop_reason": getattr(result, "stop_reason", None)}
@@ -0,0 +1,208 @@
+"""
+縮短團隊對話的終止條件，可在團隊 JSON 的 termination_condition 中以
+"provider": "common.termination.<類別名稱>" 引用
+"""
+import time
+from typing import List, Optional, Sequence
+
+from pydantic import BaseModel
+from typing_extensions import Self
+from autogen_core import Component
+from autogen_agentchat.base import TerminatedException, TerminationCondition
+from autogen_agentchat.messages import StopMessage, ToolCallExecutionEvent
+
+# 專案中工具以字串回報錯誤，以這些前綴判斷工具結果是否失敗
+DEFAULT_ERROR_PREFIXES = ["錯誤", "API 請求錯誤", "請求錯誤", "數據解析錯誤", "發生錯誤", "搜索時發生錯誤", "Error"]
+DEFAULT_ANSWER_MARKERS = ["FINAL ANSWER:", "最終答案："]
+
+
+def is_error_result(content: str, error_prefixes: Sequence[str] = DEFAULT_ERROR_PREFIXES) -> bool:
+    """判斷工具輸出是否為錯誤訊息"""
+    text = content.lstrip()
+    return not text or any(text.startswith(prefix) for prefix in error_prefixes)
+
+
+def has_answer_marker(content: str, markers: Sequence[str] = DEFAULT_ANSWER_MARKERS) -> bool:
+    """判斷訊息中是否有最終答案標記（標記需位於行首）"""
+    return any(line.lstrip().startswith(marker) for line in content.splitlines() for marker in markers)
+
+
+class ToolResultTerminationConfig(BaseModel):
+    sources: Optional[List[str]] = None
+    error_prefixes: List[str] = DEFAULT_ERROR_PREFIXES
+
+
+class ToolResultTermination(TerminationCondition, Component[ToolResultTerminationConfig]):
+    """
+    工具成功回傳結果後立即結束，省去模型再回覆一次 TERMINATE 的來回
+
+    適用於工具輸出本身就是答案的代理（reflect_on_tool_use 為 false 時，代理會直接
+    以工具輸出回覆）。同一批工具呼叫必須全部成功才會結束。
+
+    Args:
+        sources (Optional[List[str]]): 只計入這些代理的工具呼叫，None 表示所有代理
+        error_prefixes (List[str]): 視為失敗的工具輸出前綴
+    """
+
+    component_config_schema = ToolResultTerminationConfig
+    component_provider_override = "common.termination.ToolResultTermination"
+
+    def __init__(
+        self,
+        sources: Optional[List[str]] = None,
+        error_prefixes: Optional[List[str]] = None,
+    ):
+        self._sources = sources
+        self._error_prefixes = error_prefixes if error_prefixes is not None else DEFAULT_ERROR_PREFIXES
+        self._terminated = False
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated
+
+    async def __call__(self, messages: Sequence) -> Optional[StopMessage]:
+        if self._terminated:
+            raise TerminatedException("Termination condition has already been reached")
+        for message in messages:
+            if not isinstance(message, ToolCallExecutionEvent):
+                continue
+            if self._sources is not None and message.source not in self._sources:
+                continue
+            results = message.content
+            if not results or any(getattr(r, "is_error", False) or is_error_result(r.content, self._error_prefixes) for r in results):
+                continue
+            self._terminated = True
+            return StopMessage(content=f"工具 {message.source} 已成功取得結果", source="ToolResultTermination")
+        return None
+
+    async def reset(self) -> None:
+        self._terminated = False
+
+    def _to_config(self) -> ToolResultTerminationConfig:
+        return ToolResultTerminationConfig(
+            sources=self._sources,
+            error_prefixes=self._error_prefixes,
+        )
+
+    @classmethod
+    def _from_config(cls, config: ToolResultTerminationConfig) -> Self:
+        return cls(
+            sources=config.sources,
+            error_prefixes=config.error_prefixes,
+        )
+
+
+class FinalAnswerTerminationConfig(BaseModel):
+    markers: List[str] = DEFAULT_ANSWER_MARKERS
+    sources: Optional[List[str]] = None
+
+
+class FinalAnswerTermination(TerminationCondition, Component[FinalAnswerTerminationConfig]):
+    """
+    代理的訊息中有最終答案標記（位於行首，例如 "FINAL ANSWER:"）時結束
+
+    與 TextMentionTermination 不同，不會因為訊息中引用或提及關鍵字而誤判，
+    也不需要模型另外回覆一次 TERMINATE。
+
+    Args:
+        markers (List[str]): 最終答案標記
+        sources (Optional[List[str]]): 只檢查這些代理的訊息，None 表示所有代理
+    """
+
+    component_config_schema = FinalAnswerTerminationConfig
+    component_provider_override = "common.termination.FinalAnswerTermination"
+
+    def __init__(self, markers: Optional[List[str]] = None, sources: Optional[List[str]] = None):
+        self._markers = markers or DEFAULT_ANSWER_MARKERS
+        self._sources = sources
+        self._terminated = False
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated
+
+    async def __call__(self, messages: Sequence) -> Optional[StopMessage]:
+        if self._terminated:
+            raise TerminatedException("Termination condition has already been reached")
+        for message in messages:
+            if message.source == "user" or (self._sources is not None and message.source not in self._sources):
+                continue
+            content = getattr(message, "content", None)
+            if isinstance(content, str) and has_answer_marker(content, self._markers):
+                self._terminated = True
+                return StopMessage(content=f"{message.source} 已給出最終答案", source="FinalAnswerTermination")
+        return None
+
+    async def reset(self) -> None:
+        self._terminated = False
+
+    def _to_config(self) -> FinalAnswerTerminationConfig:
+        return FinalAnswerTerminationConfig(markers=self._markers, sources=self._sources)
+
+    @classmethod
+    def _from_config(cls, config: FinalAnswerTerminationConfig) -> Self:
+        return cls(markers=config.markers, sources=config.sources)
+
+
+class BudgetTerminationConfig(BaseModel):
+    max_total_tokens: Optional[int] = None
+    max_seconds: Optional[float] = None
+
+
+class BudgetTermination(TerminationCondition, Component[BudgetTerminationConfig]):
+    """
+    模型用量（prompt + completion tokens）或經過時間超過預算時結束
+
+    計時從本次執行第一次檢查（收到任務）開始。
+
+    Args:
+        max_total_tokens (Optional[int]): token 預算，None 表示不限制
+        max_seconds (Optional[float]): 時間預算（秒），None 表示不限制
+    """
+
+    component_config_schema = BudgetTerminationConfig
+    component_provider_override = "common.termination.BudgetTermination"
+
+    def __init__(self, max_total_tokens: Optional[int] = None, max_seconds: Optional[float] = None):
+        if max_total_tokens is None and max_seconds is None:
+            raise ValueError("max_total_tokens 與 max_seconds 至少需設定一個")
+        self._max_total_tokens = max_total_tokens
+        self._max_seconds = max_seconds
+        self._terminated = False
+        self._tokens = 0
+        self._started: Optional[float] = None
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated
+
+    async def __call__(self, messages: Sequence) -> Optional[StopMessage]:
+        if self._terminated:
+            raise TerminatedException("Termination condition has already been reached")
+        if self._started is None:
+            self._started = time.monotonic()
+        for message in messages:
+            usage = getattr(message, "models_usage", None)
+            if usage is not None:
+                self._tokens += usage.prompt_tokens + usage.completion_tokens
+
+        if self._max_total_tokens is not None and self._tokens >= self._max_total_tokens:
+            self._terminated = True
+            return StopMessage(content=f"已使用 {self._tokens} tokens，超過預算 {self._max_total_tokens}", source="BudgetTermination")
+        elapsed = time.monotonic() - self._started
+        if self._max_seconds is not None and elapsed >= self._max_seconds:
+            self._terminated = True
+            return StopMessage(content=f"已執行 {elapsed:.1f} 秒，超過預算 {self._max_seconds} 秒", source="BudgetTermination")
+        return None
+
+    async def reset(self) -> None:
+        self._terminated = False
+        self._tokens = 0
+        self._started = None
+
+    def _to_config(self) -> BudgetTerminationConfig:
+        return BudgetTerminationConfig(max_total_tokens=self._max_total_tokens, max_seconds=self._max_seconds)
+
+    @classmethod
+    def _from_config(cls, config: BudgetTerminationConfig) -> Self:
+        return cls(max_total_tokens=config.max_total_tokens, max_seconds=config.max_seconds)
@@ -0,0 +1,218 @@
+"""
+包裝團隊 JSON 中 FunctionTool 的執行層：每個工具的並行上限、同一次執行內的結果記憶，
+以及可選的跨執行 TTL 快取。在團隊 JSON 中以
+"provider": "common.tool_executor.ParallelTool" 包住原本的工具
+"""
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Mapping, Optional, Tuple
+
+from pydantic import BaseModel
+from typing_extensions import Self
+from autogen_core import CancellationToken, Component, ComponentModel
+from autogen_core.tools import BaseTool
+
+from common.metrics import TOOL_DURATION, CacheCounters
+from common.replay import current_recorder
+from common.tracing import start_span
+
+logger = logging.getLogger(__name__)
+
+# 目前的團隊執行 ID；工具呼叫在團隊執行所建立的任務中執行，會繼承此值
+_current_run: ContextVar[Optional[str]] = ContextVar("tool_run_id", default=None)
+# 各執行的記憶結果：run_id -> {(工具名稱, 參數): Future}
+_run_memos: Dict[str, Dict[Tuple[str, str], asyncio.Future]] = {}
+# 跨執行快取：(工具名稱, 參數) -> (到期時間, 結果)
+_shared_cache: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+SHARED_CACHE_MAX_ENTRIES = 1024
+
+
+@contextmanager
+def tool_run_scope() -> Iterator[str]:
+    """
+    標記一次團隊執行，範圍內相同工具與參數的呼叫只執行一次
+
+    用法:
+        with tool_run_scope():
+            result = await team.run(task=query)
+    """
+    run_id = uuid.uuid4().hex
+    _run_memos[run_id] = {}
+    token = _current_run.set(run_id)
+    try:
+        yield run_id
+    finally:
+        _current_run.reset(token)
+        _run_memos.pop(run_id, None)
+
+
+def _args_key(args: Mapping[str, Any]) -> str:
+    return json.dumps(args, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+class ParallelToolConfig(BaseModel):
+    tool: ComponentModel
+    max_concurrency: int = 4
+    memoize: bool = True
+    cross_run_ttl: float = 0
+    run_in_thread: bool = False
+
+
+class ParallelTool(BaseTool[BaseModel, BaseModel], Component[ParallelToolConfig]):
+    """
+    為工具加上並行上限與結果記憶的包裝
+
+    AssistantAgent 會同時執行同一次模型回應中的多個工具呼叫；此包裝以 semaphore
+    限制每個工具同時執行的數量，並在 tool_run_scope() 範圍內記住相同參數的結果
+    （進行中的呼叫也會共用）。cross_run_ttl 大於 0 時，結果在該秒數內跨執行共用。
+    run_in_thread 讓在 async 函數中呼叫同步 API 的工具改在獨立執行緒的事件迴圈中
+    執行，避免阻塞其他工具呼叫。
+
+    Args:
+        tool (BaseTool): 被包裝的工具
+        max_concurrency (int): 同時執行的上限
+        memoize (bool): 是否在同一次執行內記住結果
+        cross_run_ttl (float): 跨執行快取秒數，0 表示不使用
+        run_in_thread (bool): 是否在獨立執行緒中執行
+    """
+
+    component_type = "tool"
+    component_config_schema = ParallelToolConfig
+    component_provider_override = "common.tool_executor.ParallelTool"
+
+    def __init__(
+        self,
+        tool: BaseTool[Any, Any],
+        max_concurrency: int = 4,
+        memoize: bool = True,
+        cross_run_ttl: float = 0,
+        run_in_thread: bool = False,
+    ):
+        super().__init__(tool.args_type(), tool.return_type(), tool.name, tool.description)
+        self._tool = tool
+        self._max_concurrency = max_concurrency
+        self._memoize = memoize
+        self._cross_run_ttl = cross_run_ttl
+        self._run_in_thread = run_in_thread
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._duration = TOOL_DURATION.labels(tool.name)
+        self._memo_counters = CacheCounters("tool_memo")
+
+    @property
+    def schema(self) -> Any:
+        return self._tool.schema
+
+    def return_value_as_string(self, value: Any) -> str:
+        return self._tool.return_value_as_string(value)
+
+    async def run(self, args: BaseModel, cancellation_token: CancellationToken) -> Any:
+        return await self._tool.run(args, cancellation_token)
+
+    async def _execute(self, args: Mapping[str, Any], cancellation_token: CancellationToken, **kwargs: Any) -> Any:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        async with self._semaphore:
+            if self._run_in_thread:
+                # 另一個事件迴圈無法共用呼叫端的 CancellationToken
+                return await asyncio.to_thread(asyncio.run, self._tool.run_json(args, CancellationToken(), **kwargs))
+            return await self._tool.run_json(args, cancellation_token, **kwargs)
+
+    async def run_json(self, args: Mapping[str, Any], cancellation_token: CancellationToken, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        recorder = current_recorder()
+        with start_span(f"tool.call {self.name}", {"tool.name": self.name}) as span:
+            try:
+                result, source = await self._run_memoized(args, cancellation_token, **kwargs)
+            except Exception as e:
+                if recorder is not None:
+                    recorder.record_tool(self.name, args, str(e), True, time.perf_counter() - start)
+                raise
+            span.set_attribute("tool.result_source", source)
+        if recorder is not None:
+            recorder.record_tool(self.name, args, self.return_value_as_string(result), False, time.perf_counter() - start)
+        # 延遲只統計實際執行的呼叫，快取命中另外計數
+        if source == "executed":
+            self._duration.observe(time.perf_counter() - start)
+        if self._memoize:
+            self._memo_counters.record(source != "executed")
+        return result
+
+    async def _run_memoized(self, args: Mapping[str, Any], cancellation_token: CancellationToken, **kwargs: Any) -> Tuple[Any, str]:
+        """執行或重用工具結果，回傳結果與來源（shared、run 或 executed）"""
+        key = (self.name, _args_key(args))
+
+        if self._cross_run_ttl > 0:
+            entry = _shared_cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                _shared_cache.move_to_end(key)
+                logger.debug(f"工具 {self.name} 使用跨執行快取")
+                return entry[1], "shared"
+
+        run_id = _current_run.get()
+        memo = _run_memos.get(run_id) if self._memoize and run_id else None
+        if memo is None:
+            result = await self._execute(args, cancellation_token, **kwargs)
+            self._remember(key, result)
+            return result, "executed"
+
+        future = memo.get(key)
+        if future is not None:
+            logger.debug(f"工具 {self.name} 重用本次執行中相同參數的結果")
+            return await asyncio.shield(future), "run"
+
+        future = asyncio.get_running_loop().create_future()
+        memo[key] = future
+        try:
+            result = await self._execute(args, cancellation_token, **kwargs)
+        except BaseException as e:
+            # 失敗的呼叫不記憶，讓之後的呼叫重新執行
+            memo.pop(key, None)
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # 沒有其他等待者時不產生未取用例外的警告
+                future.exception()
+            raise
+        future.set_result(result)
+        self._remember(key, result)
+        return result, "executed"
+
+    def _remember(self, key: Tuple[str, str], result: Any) -> None:
+        if self._cross_run_ttl <= 0:
+            return
+        _shared_cache[key] = (time.monotonic() + self._cross_run_ttl, result)
+        _shared_cache.move_to_end(key)
+        while len(_shared_cache) > SHARED_CACHE_MAX_ENTRIES:
+            _shared_cache.popitem(last=False)
+
+    async def save_state_json(self) -> Mapping[str, Any]:
+        return await self._tool.save_state_json()
+
+    async def load_state_json(self, state: Mapping[str, Any]) -> None:
+        await self._tool.load_state_json(state)
+
+    def _to_config(self) -> ParallelToolConfig:
+        return ParallelToolConfig(
+            tool=self._tool.dump_component(),
+            max_concurrency=self._max_concurrency,
+            memoize=self._memoize,
+            cross_run_ttl=self._cross_run_ttl,
+            run_in_thread=self._run_in_thread,
+        )
+
+    @classmethod
+    def _from_config(cls, config: ParallelToolConfig) -> Self:
+        return cls(
+            tool=BaseTool.load_component(config.tool),
+            max_concurrency=config.max_concurrency,
+            memoize=config.memoize,
+            cross_run_ttl=config.cross_run_ttl,
+            run_in_thread=config.run_in_thread,
+        )
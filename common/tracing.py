@@ -0,0 +1,325 @@
+"""
+輕量的 OpenTelemetry 風格追蹤：span 以 contextvars 串成樹狀，透過 W3C traceparent
+在 HTTP 與 MCP 請求之間傳遞，並由背景執行緒輸出為 JSONL 檔案或 stderr
+
+MCP 的 traceparent 只由 McpSessionManager 的 session 送出（inject_mcp_trace_context）；
+api/ 的團隊以 FunctionTool 在行程內執行工具，tool.call span 直接接在 team.run 之下。
+
+設定：
+    TRACE_EXPORTER      none（預設）、file 或 console；file 模式的檔案不會輪替，需自行清理
+    TRACE_EXPORT_PATH   file 模式的輸出檔（預設為專案根目錄的 traces.jsonl）
+
+檢視某次請求的耗時分布：
+    python -m common.tracing traces.jsonl [trace_id]
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import inspect
+import logging
+import secrets
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_EXPORT_PATH = os.getenv(
+    "TRACE_EXPORT_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "traces.jsonl")
+)
+
+
+class SpanContext(NamedTuple):
+    trace_id: str
+    span_id: str
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[SpanContext]:
+    """解析 W3C traceparent（00-<trace_id>-<span_id>-<flags>）"""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return SpanContext(parts[1], parts[2])
+
+
+class Span:
+    """一段計時的工作，結束時交給輸出器"""
+
+    def __init__(self, name: str, parent: Optional[SpanContext], attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent else None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.events: List[Dict[str, Any]] = []
+        self.status = "ok"
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+
+    @property
+    def context(self) -> SpanContext:
+        return SpanContext(self.trace_id, self.span_id)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def add_event(self, name: str, attributes: Optional[Dict[str, Any]] = None) -> None:
+        self.events.append({"name": name, "time_ns": time.time_ns(), "attributes": attributes or {}})
+
+    def record_exception(self, error: BaseException) -> None:
+        self.status = "error"
+        self.add_event("exception", {"type": type(error).__name__, "message": str(error)})
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            _exporter.export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "start_time_ns": self.start_ns,
+            "end_time_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+            "events": self.events,
+            "service": SERVICE_NAME,
+        }
+
+
+class _Exporter:
+    """以佇列交給背景執行緒寫出，記錄 span 時不做 I/O"""
+
+    def __init__(self, mode: str, path: str):
+        self.mode = mode
+        self.path = path
+        self._queue: "queue.SimpleQueue[Optional[Span]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        if self.mode == "none":
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._worker, name="trace-exporter", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.shutdown)
+        self._queue.put(span)
+
+    def _write(self, lines: List[str]) -> None:
+        if self.mode == "console":
+            # stdio 型 MCP 服務器以 stdout 傳輸協定，只能寫到 stderr
+            sys.stderr.write("".join(lines))
+            sys.stderr.flush()
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(lines))
+
+    def _worker(self) -> None:
+        while True:
+            span = self._queue.get()
+            batch = [span]
+            # 一次寫出佇列中已累積的 span
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            lines = [json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n" for s in batch if s is not None]
+            try:
+                if lines:
+                    self._write(lines)
+            except OSError as e:
+                logger.warning(f"無法輸出追蹤資料: {e}")
+            if stop:
+                return
+
+    def shutdown(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+
+SERVICE_NAME = os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else "python"
+_exporter = _Exporter(TRACE_EXPORTER, TRACE_EXPORT_PATH)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def set_service_name(name: str) -> None:
+    """設定輸出 span 時標示的服務名稱"""
+    global SERVICE_NAME
+    SERVICE_NAME = name
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_traceparent() -> Optional[str]:
+    """目前 span 的 traceparent，用於傳給下游服務"""
+    span = _current_span.get()
+    return span.traceparent if span else None
+
+
+def begin_span(name: str, attributes: Optional[Dict[str, Any]] = None, parent: Optional[SpanContext] = None) -> Span:
+    """
+    開始一個 span 但不設為目前的 span，需自行呼叫 end()
+
+    用於起訖點不在同一段程式碼中的工作（例如由事件串流推斷的代理回合）。
+    """
+    if parent is None:
+        span = _current_span.get()
+        parent = span.context if span else None
+    return Span(name, parent, attributes)
+
+
+@contextmanager
+def start_span(name: str, attributes: Optional[Dict[str, Any]] = None, parent: Optional[SpanContext] = None) -> Iterator[Span]:
+    """
+    開始一個 span 並設為目前的 span，範圍內建立的 span（含新建的 asyncio task）都以它為父節點
+
+    Args:
+        name (str): span 名稱
+        attributes (Optional[Dict[str, Any]]): 屬性
+        parent (Optional[SpanContext]): 父節點，預設為目前的 span；跨服務時傳入 parse_traceparent 的結果
+    """
+    span = begin_span(name, attributes, parent)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.record_exception(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+
+def _incoming_mcp_context(mcp: Any) -> Optional[SpanContext]:
+    """
+    從 MCP 請求的 _meta.traceparent 取出呼叫端的 span；沒有時回傳 None，工具呼叫自成一個追蹤
+
+    常駐的服務器會處理許多不同請求，因此不以啟動時的環境變數作為父節點。
+    """
+    try:
+        meta = mcp.get_context().request_context.meta
+    except (LookupError, ValueError, AttributeError):
+        meta = None
+    return parse_traceparent(getattr(meta, "traceparent", None))
+
+
+def trace_mcp_tool(mcp: Any) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    為 FastMCP 工具加上 span，並接續呼叫端傳來的追蹤
+
+    用法（放在 @mcp.tool() 之下）:
+        @mcp.tool()
+        @trace_mcp_tool(mcp)
+        async def get_weather(city: str) -> str:
+            ...
+    """
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        name = f"mcp.tool {func.__name__}"
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with start_span(name, {"mcp.server": mcp.name}, parent=_incoming_mcp_context(mcp)):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with start_span(name, {"mcp.server": mcp.name}, parent=_incoming_mcp_context(mcp)):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def inject_mcp_trace_context(session: Any) -> None:
+    """
+    讓 MCP ClientSession 的 call_tool 在請求的 _meta 中帶上目前的 traceparent
+
+    透過 call_tool 的 meta 參數傳遞，保留 ClientSession 本身的結果驗證；
+    舊版 mcp 套件的 call_tool 沒有 meta 參數時只記錄呼叫端的 span。
+    """
+    if getattr(session, "_trace_injected", False):
+        return
+    call_tool = session.call_tool
+    try:
+        supports_meta = "meta" in inspect.signature(call_tool).parameters
+    except (TypeError, ValueError):
+        supports_meta = False
+    if not supports_meta:
+        logger.info("mcp 套件的 call_tool 不支援 meta 參數，不傳遞 traceparent")
+
+    async def traced_call_tool(name: str, arguments: Optional[Dict[str, Any]] = None, *args: Any, **kwargs: Any) -> Any:
+        with start_span(f"mcp.call_tool {name}", {"mcp.tool": name}) as span:
+            if supports_meta:
+                kwargs["meta"] = {**(kwargs.get("meta") or {}), "traceparent": span.traceparent}
+            result = await call_tool(name, arguments, *args, **kwargs)
+            span.set_attribute("mcp.is_error", bool(getattr(result, "isError", False)))
+            return result
+
+    session.call_tool = traced_call_tool
+    session._trace_injected = True
+
+
+def _print_trace(spans: List[Dict[str, Any]]) -> None:
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    ids = {s["span_id"] for s in spans}
+    for span in sorted(spans, key=lambda s: s["start_time_ns"]):
+        parent = span["parent_span_id"] if span["parent_span_id"] in ids else None
+        children.setdefault(parent, []).append(span)
+    origin = min(s["start_time_ns"] for s in spans)
+
+    def walk(parent: Optional[str], depth: int) -> None:
+        for span in children.get(parent, []):
+            offset = (span["start_time_ns"] - origin) / 1e6
+            attrs = " ".join(f"{k}={v}" for k, v in span["attributes"].items())
+            flag = " !" if span["status"] == "error" else ""
+            print(f"{'  ' * depth}{span['name']}{flag}  +{offset:.0f}ms  {span['duration_ms']:.0f}ms  [{span['service']}] {attrs}")
+            walk(span["span_id"], depth + 1)
+
+    walk(None, 0)
+
+
+def main() -> None:
+    path = sys.argv[1] if len(sys.argv) > 1 else TRACE_EXPORT_PATH
+    traces: Dict[str, List[Dict[str, Any]]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            span = json.loads(line)
+            traces.setdefault(span["trace_id"], []).append(span)
+    if len(sys.argv) > 2:
+        _print_trace(traces[sys.argv[2]])
+        return
+    # 未指定 trace_id 時列出最近的 20 個請求
+    roots = [s for spans in traces.values() for s in spans if s["parent_span_id"] is None]
+    for span in sorted(roots, key=lambda s: s["start_time_ns"])[-20:]:
+        print(f"{span['trace_id']}  {span['duration_ms']:8.0f}ms  {span['name']}")
+
+
+if __name__ == "__main__":
+    main()
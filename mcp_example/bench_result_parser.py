@@ -0,0 +1,89 @@
+"""
+比較 format_search_results 舊版（str() + 字串切割 + unicode_escape）與
+mcp_result_parser 結構化解析的耗時
+
+用法:
+    python bench_result_parser.py [錄製的回應.json ...]
+
+未指定檔案時，以不同筆數合成 EXA_SEARCH 回應進行測試。
+"""
+import re
+import sys
+import json
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, List, Tuple
+
+from mcp_result_parser import extract_search_results, orjson, ijson
+
+RESULT_COUNTS = (5, 50, 500)
+REPEAT = 20
+
+
+def legacy_format(message: Any) -> List[str]:
+    """舊版 format_search_results 的解析方式"""
+    text = str(message[0])
+    start_index = text.find("text='") + 6
+    end_index = text.rfind("'")
+    json_str = bytes(text[start_index:end_index], 'utf-8').decode('unicode_escape')
+    data = json.loads(json_str)
+    formatted = []
+    for result in data["data"]["results"]["results"]:
+        content = f"標題: {result.get('title', '無標題')}\n"
+        content += f"網址: {result.get('url', '無網址')}\n"
+        if "text" in result:
+            content += f"內容:\n{re.sub(r'<[^>]+>', '', result['text'])}\n"
+        formatted.append(content)
+    return formatted
+
+
+class RecordedTextContent(SimpleNamespace):
+    """模擬 MCP TextContent，repr 與舊版解析所依賴的格式相同"""
+
+    def __str__(self) -> str:
+        return f"type='text' text={self.text!r} annotations=None"
+
+
+def synthetic_payload(count: int) -> str:
+    results = [
+        {
+            "title": f"Result {i}",
+            "url": f"https://example.com/{i}",
+            "text": "<p>" + "lorem ipsum dolor sit amet " * 40 + "</p>",
+        }
+        for i in range(count)
+    ]
+    return json.dumps({"data": {"results": {"results": results}}, "successful": True})
+
+
+def timed(func: Callable[[Any], List[str]], message: Any) -> Tuple[float, int]:
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        count = len(func(message))
+    return (time.perf_counter() - start) / REPEAT * 1000, count
+
+
+def run(label: str, payload: str) -> None:
+    message = [RecordedTextContent(type="text", text=payload)]
+    try:
+        legacy_ms, legacy_count = timed(legacy_format, message)
+        legacy = f"{legacy_ms:8.2f} ms ({legacy_count} 筆)"
+    except Exception as e:
+        legacy = f"失敗: {e.__class__.__name__}"
+    parsed_ms, parsed_count = timed(extract_search_results, message)
+    print(f"{label:>24} | {len(payload) / 1024:8.1f} KiB | 舊版 {legacy} | 新版 {parsed_ms:8.2f} ms ({parsed_count} 筆)")
+
+
+def main() -> None:
+    print(f"orjson: {'有' if orjson else '無'}, ijson: {'有' if ijson else '無'}, 重複 {REPEAT} 次取平均")
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            with open(path, "r", encoding="utf-8") as f:
+                run(path, f.read())
+    else:
+        for count in RESULT_COUNTS:
+            run(f"合成 {count} 筆", synthetic_payload(count))
+
+
+if __name__ == "__main__":
+    main()
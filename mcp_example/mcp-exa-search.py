@@ -1,13 +1,14 @@
 import asyncio
 import os
-import json
 from autogen_ext.models.openai import OpenAIChatCompletionClient
-from autogen_ext.tools.mcp import SseMcpToolAdapter, SseServerParams, StdioServerParams, mcp_server_tools
+from autogen_ext.tools.mcp import SseServerParams, StdioServerParams
 from autogen_agentchat.agents import AssistantAgent
 from autogen_agentchat.teams import RoundRobinGroupChat
 from autogen_agentchat.conditions import TextMentionTermination
 from autogen_core import CancellationToken
 from dotenv import load_dotenv
+from mcp_discovery import McpServerSpec, discover_tools
+from mcp_result_parser import extract_search_results
 
 # 載入環境變數
 load_dotenv()
@@ -26,34 +27,9 @@ def get_model_client_groq() -> OpenAIChatCompletionClient:  # type: ignore
     )
 async def format_search_results(message) -> str:
     try:
-        if isinstance(message, list) and len(message) > 0:
-            item = message[0]
-            text = str(item)
-            
-            if "text='" in text:
-                start_index = text.find("text='") + 6
-                end_index = text.rfind("'")
-                if start_index > 5 and end_index > start_index:
-                    json_str = text[start_index:end_index]
-                    json_str = bytes(json_str, 'utf-8').decode('unicode_escape')
-                    data = json.loads(json_str)
-                    
-                    if "data" in data and "results" in data["data"]:
-                        results = data["data"]["results"]
-                        formatted_content = []
-                        
-                        if "results" in results:
-                            for result in results["results"]:
-                                content = f"標題: {result.get('title', '無標題')}\n"
-                                content += f"網址: {result.get('url', '無網址')}\n"
-                                if "text" in result:
-                                    # 移除 HTML 標籤
-                                    import re
-                                    clean_text = re.sub(r'<[^>]+>', '', result["text"])
-                                    content += f"內容:\n{clean_text}\n"
-                                formatted_content.append(content)
-                        
-                        return "\n---\n".join(formatted_content)
+        formatted_content = extract_search_results(message)
+        if formatted_content:
+            return "\n---\n".join(formatted_content)
     except Exception as e:
         return f"處理搜索結果時發生錯誤: {str(e)}"
     
@@ -93,10 +69,15 @@ async def main() -> None:
             timeout=60,
         )
         
-        # 獲取所有工具
-        search_adapter = await SseMcpToolAdapter.from_server_params(search_server_params, "EXA_SEARCH")
-        tools_write = await mcp_server_tools(write_mcp_server)
-        onedrive_adapter = await SseMcpToolAdapter.from_server_params(onedrive_server_params, "ONE_DRIVE_ONEDRIVE_UPLOAD_FILE")
+        # 同時探索所有服務器的工具（有快取時不需連線）
+        discovered = await discover_tools({
+            "search": McpServerSpec(search_server_params, ["EXA_SEARCH"]),
+            "filesystem": McpServerSpec(write_mcp_server),
+            "onedrive": McpServerSpec(onedrive_server_params, ["ONE_DRIVE_ONEDRIVE_UPLOAD_FILE"]),
+        })
+        search_adapter = discovered["search"][0]
+        tools_write = discovered["filesystem"]
+        onedrive_adapter = discovered["onedrive"][0]
         
         # 創建搜索代理
         search_agent = AssistantAgent(
@@ -1,11 +1,15 @@
 import asyncio
 import os
+import json
 from autogen_agentchat.agents import AssistantAgent
 from autogen_ext.models.openai import OpenAIChatCompletionClient
-from autogen_ext.tools.mcp import SseMcpToolAdapter, SseServerParams
+from autogen_ext.tools.mcp import SseServerParams
 from autogen_agentchat.ui import Console
 from autogen_core import CancellationToken
+from autogen_core.tools import FunctionTool
 from dotenv import load_dotenv
+from mcp_discovery import McpServerSpec, discover_tools
+from onedrive_upload import upload_file_to_onedrive
 
 # 載入環境變數
 load_dotenv()
@@ -14,7 +18,7 @@ load_dotenv()
 def get_model_client_groq() -> OpenAIChatCompletionClient:  # type: ignore
     return OpenAIChatCompletionClient(
         model="deepseek-r1-distill-llama-70b",
-        api_key='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',
+        api_key=os.getenv("GROQ_API_KEY"),
         base_url="https://api.groq.com/openai/v1",
         model_capabilities={
             "json_output": True,
@@ -34,36 +38,28 @@ async def main() -> None:
         
         print("正在連接到MCP服務器...")
         
-        # 創建 MCP 工具適配器
-        create_folder_adapter = await SseMcpToolAdapter.from_server_params(
-            server_params, 
-            "ONE_DRIVE_ONEDRIVE_CREATE_FOLDER"
-        )
-        create_text_file_adapter = await SseMcpToolAdapter.from_server_params(
-            server_params, 
-            "ONE_DRIVE_ONEDRIVE_CREATE_TEXT_FILE"
+        # 創建 MCP 工具適配器（有快取時不需連線）
+        discovered = await discover_tools({
+            "onedrive": McpServerSpec(server_params, ["ONE_DRIVE_ONEDRIVE_CREATE_FOLDER"]),
+        })
+        create_folder_adapter, = discovered["onedrive"]
+
+        # 檔案由本機直接分段上傳，模型只需傳入路徑
+        upload_file_tool = FunctionTool(
+            upload_file_to_onedrive,
+            name="ONE_DRIVE_UPLOAD_FILE",
+            description="將本機檔案分段上傳到 OneDrive 資料夾，只需提供檔案路徑與資料夾 ID"
         )
 
         # 獲取模型客戶端
         model_client = get_model_client_groq()
         
-        # 讀取 mbti_personalities.csv 文件內容
+        # 確認 mbti_personalities.csv 存在（內容不讀入記憶體，由上傳工具串流）
         csv_file = os.path.join(os.getcwd(), "mbti_personalities.csv")
-        if os.path.exists(csv_file):
-            # 嘗試不同的編碼方式
-            with open(csv_file, 'r', encoding='utf-8-sig') as f:
-                file_content = f.read()
-
-        else:
+        if not os.path.exists(csv_file):
             print("錯誤: mbti_personalities.csv 文件不存在")
             return
-        
-        # 除錯用：檢查文件內容
-        print("檔案內容預覽：")
-        print(file_content[:200])  # 只顯示前200個字符
-        print("檔案編碼檢查：")
-        print("內容類型：", type(file_content))
-        print("字符數：", len(file_content))
+        print("檔案大小（位元組）：", os.path.getsize(csv_file))
         
         # 創建上傳代理
         uploader = AssistantAgent(
@@ -80,15 +76,12 @@ async def main() -> None:
     }
 }
 
-第二個指令（創建文本文件）：
+第二個指令（上傳文件）：
 {
-    "name": "ONE_DRIVE_ONEDRIVE_CREATE_TEXT_FILE",
+    "name": "ONE_DRIVE_UPLOAD_FILE",
     "parameters": {
-        "params": {
-            "name": "mbti_personalities.csv",
-            "content": "測試內容",
-            "folder": "folder_id"
-        }
+        "path": "檔案路徑",
+        "folder_id": "folder_id"
     }
 }
 
@@ -99,7 +92,7 @@ async def main() -> None:
 4. 不要修改任何參數或格式
 5. 回報每個指令的執行結果""",
             model_client=model_client,
-            tools=[create_folder_adapter, create_text_file_adapter]
+            tools=[create_folder_adapter, upload_file_tool]
         )
 
         print("\n開始上傳文件到 OneDrive...")
@@ -141,17 +134,14 @@ async def main() -> None:
                         print(f"原始內容: {msg.content}")
 
         if folder_id:
-            print("\n2. 創建文本文件...")
+            print("\n2. 上傳文件...")
             upload_result = await uploader.run(
-                task=f"""請執行第二個指令（創建文本文件）：
+                task=f"""請執行第二個指令（上傳文件）：
 {{
-    "name": "ONE_DRIVE_ONEDRIVE_CREATE_TEXT_FILE",
+    "name": "ONE_DRIVE_UPLOAD_FILE",
     "parameters": {{
-        "params": {{
-            "name": "mbti_personalities.csv",
-            "content": "{file_content}",
-            "folder": "{folder_id}"
-        }}
+        "path": {json.dumps(csv_file, ensure_ascii=False)},
+        "folder_id": "{folder_id}"
     }}
 }}""",
                 cancellation_token=CancellationToken()
@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional, Union
+
+from mcp.types import Tool
+from autogen_ext.tools.mcp import (
+    SseMcpToolAdapter,
+    SseServerParams,
+    StdioMcpToolAdapter,
+    StdioServerParams,
+    mcp_server_tools,
+)
+
+logger = logging.getLogger(__name__)
+
+ServerParams = Union[StdioServerParams, SseServerParams]
+
+# 工具 schema 快取檔與有效時間
+DEFAULT_CACHE_PATH = os.getenv(
+    "MCP_TOOL_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".mcp_tool_cache.json")
+)
+MCP_TOOL_CACHE_TTL = int(os.getenv("MCP_TOOL_CACHE_TTL", "86400"))
+
+
+class McpServerSpec(NamedTuple):
+    """要探索的 MCP 服務器"""
+    params: ServerParams
+    # 只取用的工具名稱，None 表示全部
+    tool_names: Optional[List[str]] = None
+    # 服務器版本（例如套件版本），變更時快取失效
+    version: str = ""
+
+
+def server_cache_key(spec: McpServerSpec) -> str:
+    """以服務器網址或啟動命令加上版本組成快取鍵"""
+    if isinstance(spec.params, SseServerParams):
+        target = spec.params.url
+    else:
+        target = " ".join([spec.params.command, *spec.params.args])
+    return f"{target}@{spec.version}"
+
+
+def _load_cache(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"無法讀取工具快取，將重新探索: {e}")
+        return {}
+
+
+def _save_cache(path: str, cache: Dict[str, Any]) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _adapters_from_schemas(params: ServerParams, schemas: List[Dict[str, Any]]) -> List:
+    """由快取的工具 schema 直接建立 adapter，不需要連線到服務器"""
+    adapter_class = SseMcpToolAdapter if isinstance(params, SseServerParams) else StdioMcpToolAdapter
+    return [adapter_class(server_params=params, tool=Tool.model_validate(schema)) for schema in schemas]
+
+
+def _select_schemas(name: str, spec: McpServerSpec, schemas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """依 tool_names 篩選工具 schema，缺少指定的工具時拋出 KeyError"""
+    if spec.tool_names is None:
+        return schemas
+    by_name = {schema["name"]: schema for schema in schemas}
+    missing = [tool_name for tool_name in spec.tool_names if tool_name not in by_name]
+    if missing:
+        raise KeyError(f"MCP 服務器 {name} 沒有工具: {', '.join(missing)}")
+    return [by_name[tool_name] for tool_name in spec.tool_names]
+
+
+async def _discover_server(name: str, spec: McpServerSpec) -> List[Dict[str, Any]]:
+    """連線到服務器，一次列出所有工具並返回其 schema"""
+    start = time.monotonic()
+    adapters = await mcp_server_tools(spec.params)
+    schemas = [adapter._tool.model_dump(mode="json", exclude_none=True) for adapter in adapters]
+    logger.info(f"探索 MCP 服務器 {name} 完成（{len(schemas)} 個工具，{time.monotonic() - start:.2f} 秒）")
+    return schemas
+
+
+async def discover_tools(
+    servers: Dict[str, McpServerSpec],
+    cache_path: str = DEFAULT_CACHE_PATH,
+    refresh: bool = False
+) -> Dict[str, List]:
+    """
+    並行探索多個 MCP 服務器的工具
+
+    有效的快取直接使用，不連線；其餘服務器以 asyncio.gather 同時連線，
+    啟動時間取決於最慢的服務器而非全部加總。探索結果寫回快取檔。
+
+    Args:
+        servers (Dict[str, McpServerSpec]): {名稱: 服務器設定}
+        cache_path (str): 工具 schema 快取檔路徑
+        refresh (bool): 忽略快取，重新探索所有服務器
+
+    Returns:
+        Dict[str, List]: {名稱: 工具 adapter 列表}
+
+    Raises:
+        KeyError: 服務器沒有 tool_names 中指定的工具
+    """
+    cache = _load_cache(cache_path)
+    now = time.time()
+    results: Dict[str, List] = {}
+    pending: Dict[str, McpServerSpec] = {}
+
+    for name, spec in servers.items():
+        entry = cache.get(server_cache_key(spec))
+        if not refresh and entry and now - entry["discovered_at"] < MCP_TOOL_CACHE_TTL:
+            try:
+                schemas = _select_schemas(name, spec, entry["tools"])
+            except KeyError:
+                # 快取中缺少指定的工具（服務器可能已更新），重新探索
+                pending[name] = spec
+                continue
+            results[name] = _adapters_from_schemas(spec.params, schemas)
+            logger.info(f"使用快取的 MCP 服務器 {name} 工具（{len(schemas)} 個）")
+            continue
+        pending[name] = spec
+
+    if pending:
+        discovered = await asyncio.gather(
+            *(_discover_server(name, spec) for name, spec in pending.items())
+        )
+        # 快取保存服務器的完整工具清單，不同的工具子集可以共用
+        for spec, schemas in zip(pending.values(), discovered):
+            cache[server_cache_key(spec)] = {"discovered_at": now, "tools": schemas}
+        _save_cache(cache_path, cache)
+
+        for (name, spec), schemas in zip(pending.items(), discovered):
+            results[name] = _adapters_from_schemas(spec.params, _select_schemas(name, spec, schemas))
+
+    return {name: results[name] for name in servers}
@@ -2,7 +2,8 @@ import asyncio
 
 from autogen_agentchat.agents import AssistantAgent
 from autogen_ext.models.openai import OpenAIChatCompletionClient
-from autogen_ext.tools.mcp import StdioServerParams, mcp_server_tools
+from autogen_ext.tools.mcp import StdioServerParams
+from mcp_session_manager import get_session_manager
 import os
 from dotenv import load_dotenv
 
@@ -25,9 +26,10 @@ def get_model_client_OpenRouter() -> OpenAIChatCompletionClient:  # type: ignore
     )
 
 async def main() -> None:
-    # Get the fetch tool from mcp-server-fetch.
-    fetch_mcp_server = StdioServerParams(command="uvx", args=["mcp-server-fetch"])
-    tools = await mcp_server_tools(fetch_mcp_server)
+    # Get the fetch tool from a long-lived mcp-server-fetch session.
+    manager = get_session_manager()
+    manager.register("fetch", StdioServerParams(command="uvx", args=["mcp-server-fetch"]))
+    tools = await manager.get_tools("fetch")
 
     # Create an agent that can use the fetch tool.
     model_client = get_model_client_OpenRouter()
@@ -37,4 +39,6 @@ async def main() -> None:
     result = await agent.run(task="請直接使用fetch工具，查詢INFJ人格特性、適合職業和代表人物。")
     print(result.messages[-1].content)
 
+    await manager.close()
+
 asyncio.run(main())
\ No newline at end of file
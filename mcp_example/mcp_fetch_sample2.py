@@ -4,14 +4,16 @@ from autogen_agentchat.agents import AssistantAgent
 from autogen_agentchat.teams import RoundRobinGroupChat
 from autogen_agentchat.conditions import TextMentionTermination
 from autogen_core import CancellationToken
-from autogen_ext.tools.mcp import StdioServerParams, mcp_server_tools
+from autogen_ext.tools.mcp import StdioServerParams
+from mcp_session_manager import get_session_manager
 
 async def main():
-    # Setup the MCP fetch server parameters
-    fetch_mcp_server = StdioServerParams(command="uvx", args=["mcp-server-fetch"])
+    # Setup the MCP fetch server once and reuse its session and tool list
+    manager = get_session_manager()
+    manager.register("fetch", StdioServerParams(command="uvx", args=["mcp-server-fetch"]))
     
     # Get the fetch tool from the MCP server
-    tools = await mcp_server_tools(fetch_mcp_server)
+    tools = await manager.get_tools("fetch")
     
     # Create fetch agent with the MCP fetch tool
     fetch_agent = AssistantAgent(
@@ -48,6 +50,8 @@ async def main():
     
     print("\n最终改写结果：\n")
     print(result.messages[-1].content)
+
+    await manager.close()
     return result
 
 # This is the correct way to run async code in a Python script
@@ -4,7 +4,8 @@ from autogen_agentchat.agents import AssistantAgent
 from autogen_agentchat.teams import RoundRobinGroupChat
 from autogen_agentchat.conditions import TextMentionTermination
 from autogen_core import CancellationToken
-from autogen_ext.tools.mcp import StdioServerParams, mcp_server_tools
+from autogen_ext.tools.mcp import StdioServerParams
+from mcp_session_manager import get_session_manager
 from datetime import datetime
 from pathlib import Path
 from dotenv import load_dotenv
@@ -69,11 +70,16 @@ async def main():
     write_mcp_server = StdioServerParams(
         command="npx.cmd", args=["-y", "@modelcontextprotocol/server-filesystem", "."]
     )
+    # 两个服务器只启动一次，在后台同时连线，之后的团队可直接共用工具
+    manager = get_session_manager()
+    manager.register("fetch", fetch_mcp_server)
+    manager.register("filesystem", write_mcp_server)
+
     # 从MCP服务器获取fetch工具
-    tools_fetch = await mcp_server_tools(fetch_mcp_server)
+    tools_fetch = await manager.get_tools("fetch")
 
     # 从MCP服务器获取filesystem工具
-    tools_write = await mcp_server_tools(write_mcp_server)
+    tools_write = await manager.get_tools("filesystem")
     
     # 创建内容获取代理
     # 这个代理负责获取网页内容
@@ -150,7 +156,8 @@ async def main():
     final_message = result.messages[-1]
     if hasattr(final_message, 'content'):
         print(final_message.content)
-    
+
+    await manager.close()
     return result
 
 # 在Python脚本中运行异步代码的正确方式
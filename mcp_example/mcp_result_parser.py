@@ -0,0 +1,123 @@
+import re
+import json
+import logging
+from typing import Any, Dict, Iterable, Iterator, List
+
+try:
+    import orjson
+except ImportError:  # orjson 為選用套件，沒有安裝時使用標準函式庫
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # ijson 為選用套件，沒有安裝時不做串流解析
+    ijson = None
+
+logger = logging.getLogger(__name__)
+
+# 超過此大小（位元組）且有安裝 ijson 時，以串流方式逐筆解析結果陣列
+STREAM_THRESHOLD = 1024 * 1024
+
+# composio EXA_SEARCH 回應中搜索結果陣列的位置
+SEARCH_RESULTS_PATH = ("data", "results", "results")
+
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+
+
+def iter_text_payloads(result: Any) -> Iterator[str]:
+    """
+    從工具回傳值中逐一取出文字內容，不經過 str() 轉換
+
+    支援 MCP 的 TextContent / CallToolResult、autogen 的 FunctionExecutionResult /
+    ToolResult、dict 與字串，以及上述型別組成的列表。
+    """
+    if result is None:
+        return
+    if isinstance(result, (str, bytes)):
+        yield result if isinstance(result, str) else result.decode("utf-8")
+        return
+    if isinstance(result, dict):
+        if isinstance(result.get("text"), str):
+            yield result["text"]
+        elif "content" in result:
+            yield from iter_text_payloads(result["content"])
+        return
+    if isinstance(result, (list, tuple)):
+        for item in result:
+            yield from iter_text_payloads(item)
+        return
+
+    # TextContent（type == "text"）
+    text = getattr(result, "text", None)
+    if isinstance(text, str):
+        yield text
+        return
+    # CallToolResult / FunctionExecutionResult 的 content、ToolResult 的 result
+    for attribute in ("content", "result"):
+        value = getattr(result, attribute, None)
+        if value is not None:
+            yield from iter_text_payloads(value)
+            return
+
+
+def parse_json(text: str) -> Any:
+    """解析 JSON（有安裝 orjson 時使用 orjson）"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def _dig(data: Any, path: Iterable[str]) -> Any:
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def iter_search_results(text: str, path: Iterable[str] = SEARCH_RESULTS_PATH) -> Iterator[Dict[str, Any]]:
+    """
+    逐筆產生 JSON 文字中指定路徑下的結果陣列元素
+
+    大型回應在有安裝 ijson 時以串流方式解析，不需一次建立整份物件；
+    否則整份解析一次後取出陣列。
+    """
+    path = tuple(path)
+    if ijson is not None and len(text) > STREAM_THRESHOLD:
+        yield from ijson.items(text.encode("utf-8"), ".".join(path) + ".item")
+        return
+
+    results = _dig(parse_json(text), path)
+    if isinstance(results, list):
+        yield from results
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    """將單筆搜索結果格式化為文字"""
+    content = f"標題: {result.get('title') or '無標題'}\n"
+    content += f"網址: {result.get('url') or '無網址'}\n"
+    if result.get("text"):
+        # 移除 HTML 標籤
+        content += f"內容:\n{_HTML_TAG_RE.sub('', result['text'])}\n"
+    return content
+
+
+def extract_search_results(result: Any, path: Iterable[str] = SEARCH_RESULTS_PATH) -> List[str]:
+    """
+    從 MCP 工具回傳值中取出並格式化所有搜索結果
+
+    Args:
+        result (Any): 工具回傳值
+        path (Iterable[str]): 結果陣列在 JSON 中的位置
+
+    Returns:
+        List[str]: 格式化後的搜索結果
+    """
+    formatted: List[str] = []
+    for text in iter_text_payloads(result):
+        try:
+            formatted.extend(format_result(item) for item in iter_search_results(text, path) if isinstance(item, dict))
+        except ValueError as e:
+            # 非 JSON 的文字內容（例如錯誤訊息）略過
+            logger.debug(f"略過無法解析的工具輸出: {e}")
+    return formatted
@@ -0,0 +1,205 @@
+import os
+import sys
+import asyncio
+import logging
+from typing import Dict, List, Optional, Union
+
+from autogen_ext.tools.mcp import (
+    SseServerParams,
+    StdioServerParams,
+    create_mcp_server_session,
+    mcp_server_tools,
+)
+
+# 讓腳本可以匯入專案根目錄下的共用模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.tracing import inject_mcp_trace_context
+
+logger = logging.getLogger(__name__)
+
+ServerParams = Union[StdioServerParams, SseServerParams]
+
+
+class _CurrentSession:
+    """交給工具 adapter 的 session，呼叫時轉交給服務器目前的連線，重連後不必更換 adapter"""
+
+    def __init__(self, server: "ManagedMcpServer"):
+        self._server = server
+
+    def __getattr__(self, name: str):
+        session = self._server.session
+        if session is None:
+            raise RuntimeError(f"MCP 服務器 {self._server.name} 尚未連線")
+        return getattr(session, name)
+
+
+class ManagedMcpServer:
+    """
+    一個常駐的 MCP 服務器連線
+
+    在自己的背景 task 中建立 session（stdio 會啟動子程序），定期 ping 做健康檢查，
+    失敗時自動重新建立連線。工具清單只在第一次連線時查詢，adapter 透過
+    _CurrentSession 使用目前的 session，重連後照常運作。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        params: ServerParams,
+        health_check_interval: float = 30.0,
+        ping_timeout: float = 10.0,
+        close_timeout: float = 10.0,
+    ):
+        self.name = name
+        self.params = params
+        self.health_check_interval = health_check_interval
+        self.ping_timeout = ping_timeout
+        self.close_timeout = close_timeout
+
+        self.tools: Optional[List] = None
+        self.restarts = 0
+        self._session = None
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._last_error: Optional[BaseException] = None
+
+    @property
+    def session(self):
+        """目前的 MCP session，尚未連線或重連中時為 None"""
+        return self._session
+
+    def start(self) -> None:
+        """啟動背景 task（重複呼叫不會重複啟動）"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=f"mcp-{self.name}")
+
+    async def _run(self) -> None:
+        backoff = 1.0
+        while not self._closing.is_set():
+            try:
+                # session 的進入與離開必須在同一個 task 中
+                async with create_mcp_server_session(self.params) as session:
+                    await session.initialize()
+                    await self._attach(session)
+                    backoff = 1.0
+                    await self._supervise(session)
+            except Exception as e:
+                self._last_error = e
+                logger.error(f"MCP 服務器 {self.name} 連線中斷: {e}")
+            finally:
+                self._session = None
+                self._ready.clear()
+
+            if not self._closing.is_set():
+                self.restarts += 1
+                logger.info(f"{backoff:.0f} 秒後重新啟動 MCP 服務器 {self.name}")
+                try:
+                    await asyncio.wait_for(self._closing.wait(), timeout=backoff)
+                except asyncio.TimeoutError:
+                    pass
+                backoff = min(backoff * 2, 60.0)
+
+    async def _attach(self, session) -> None:
+        """第一次連線時查詢工具清單；重連時既有的 adapter 經由 _CurrentSession 改用新的 session"""
+        # 工具呼叫帶上目前的 traceparent，讓服務器端的 span 接在呼叫端之下
+        inject_mcp_trace_context(session)
+        self._session = session
+        if self.tools is None:
+            self.tools = await mcp_server_tools(self.params, session=_CurrentSession(self))
+            logger.info(f"MCP 服務器 {self.name} 提供 {len(self.tools)} 個工具")
+        else:
+            logger.info(f"MCP 服務器 {self.name} 已重新連線")
+        self._ready.set()
+
+    async def _supervise(self, session) -> None:
+        """定期 ping，失敗時拋出例外以觸發重連；收到關閉訊號時返回"""
+        while not self._closing.is_set():
+            try:
+                await asyncio.wait_for(self._closing.wait(), timeout=self.health_check_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            await asyncio.wait_for(session.send_ping(), timeout=self.ping_timeout)
+
+    async def get_tools(self, timeout: float = 60.0) -> List:
+        """等待連線就緒並返回工具 adapter 列表"""
+        self.start()
+        if not self._ready.is_set():
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                raise RuntimeError(f"MCP 服務器 {self.name} 啟動超時: {self._last_error}") from None
+        return list(self.tools or [])
+
+    async def close(self) -> None:
+        """關閉連線並結束背景 task；服務器在 close_timeout 秒內沒有結束時直接取消"""
+        self._closing.set()
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout=self.close_timeout)
+        except asyncio.TimeoutError:
+            # 卡住的 stdio 子程序可能連取消都不回應，不等待取消完成
+            logger.warning(f"MCP 服務器 {self.name} 未在 {self.close_timeout} 秒內關閉，已取消")
+            task.cancel()
+
+
+class McpSessionManager:
+    """
+    管理多個常駐 MCP 服務器，讓不同的團隊與代理共用同一批 session 與工具
+
+    用法：
+        async with McpSessionManager() as manager:
+            manager.register("fetch", StdioServerParams(command="uvx", args=["mcp-server-fetch"]))
+            tools = await manager.get_tools("fetch")
+    """
+
+    def __init__(self, health_check_interval: float = 30.0):
+        self.health_check_interval = health_check_interval
+        self._servers: Dict[str, ManagedMcpServer] = {}
+
+    def register(self, name: str, params: ServerParams) -> ManagedMcpServer:
+        """登記 MCP 服務器並在背景開始連線（同名已存在時沿用）"""
+        server = self._servers.get(name)
+        if server is None:
+            server = ManagedMcpServer(name, params, self.health_check_interval)
+            self._servers[name] = server
+        server.start()
+        return server
+
+    async def get_tools(self, name: str, timeout: float = 60.0) -> List:
+        """取得指定服務器的工具（第一次呼叫會等待連線與工具查詢完成）"""
+        if name not in self._servers:
+            raise KeyError(f"未登記的 MCP 服務器: {name}")
+        return await self._servers[name].get_tools(timeout)
+
+    def status(self) -> Dict[str, Dict[str, object]]:
+        """返回各服務器的連線狀態與重啟次數"""
+        return {
+            name: {"ready": server._ready.is_set(), "restarts": server.restarts, "tools": len(server.tools or [])}
+            for name, server in self._servers.items()
+        }
+
+    async def close(self) -> None:
+        """關閉所有服務器"""
+        await asyncio.gather(*(server.close() for server in self._servers.values()), return_exceptions=True)
+        self._servers.clear()
+
+    async def __aenter__(self) -> "McpSessionManager":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+_default_manager: Optional[McpSessionManager] = None
+
+
+def get_session_manager() -> McpSessionManager:
+    """取得行程內共用的 session 管理器"""
+    global _default_manager
+    if _default_manager is None:
+        _default_manager = McpSessionManager()
+    return _default_manager
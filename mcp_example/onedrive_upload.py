@@ -0,0 +1,283 @@
+import os
+import json
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+from urllib.parse import quote
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+GRAPH_API_BASE = os.getenv("GRAPH_API_BASE", "https://graph.microsoft.com/v1.0")
+
+# Graph 要求分段大小為 320 KiB 的倍數，單段上限 60 MiB
+CHUNK_ALIGNMENT = 320 * 1024
+ONEDRIVE_CHUNK_SIZE = int(os.getenv("ONEDRIVE_CHUNK_SIZE", str(32 * CHUNK_ALIGNMENT)))  # 10 MiB
+# 上傳目前分段時預先從磁碟讀取的分段數
+ONEDRIVE_READ_AHEAD = int(os.getenv("ONEDRIVE_READ_AHEAD", "2"))
+ONEDRIVE_MAX_RETRIES = int(os.getenv("ONEDRIVE_MAX_RETRIES", "5"))
+ONEDRIVE_TIMEOUT = float(os.getenv("ONEDRIVE_TIMEOUT", "120"))
+# 未完成的上傳工作階段，重新執行時從中斷處續傳
+DEFAULT_SESSION_PATH = os.getenv(
+    "ONEDRIVE_SESSION_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".onedrive_upload_sessions.json")
+)
+
+# 工具只能上傳此目錄（含子目錄）下的檔案，未設定時拒絕所有上傳
+ONEDRIVE_UPLOAD_ROOT = os.getenv("ONEDRIVE_UPLOAD_ROOT", "")
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class OneDriveUploadError(Exception):
+    """OneDrive 上傳失敗"""
+
+
+def _aligned_chunk_size(size: int) -> int:
+    return max(CHUNK_ALIGNMENT, size - size % CHUNK_ALIGNMENT)
+
+
+def _json(response: httpx.Response) -> Dict[str, Any]:
+    try:
+        data = response.json()
+    except ValueError as e:
+        raise OneDriveUploadError(f"無法解析 Graph 回應: {response.status_code} {response.text[:200]}") from e
+    if not isinstance(data, dict):
+        raise OneDriveUploadError(f"Graph 回應格式不符預期: {response.text[:200]}")
+    return data
+
+
+def _resolve_upload_path(path: str, root: str) -> str:
+    """解析符號連結與 ..，確認檔案位於允許上傳的目錄內"""
+    if not root:
+        raise OneDriveUploadError("未設定 ONEDRIVE_UPLOAD_ROOT，拒絕上傳本機檔案")
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise OneDriveUploadError(f"只能上傳 {root} 內的檔案: {path}")
+    return resolved
+
+
+class OneDriveUploader:
+    """
+    以 Microsoft Graph 上傳工作階段分段串流上傳大型檔案
+
+    檔案從磁碟逐段讀取，記憶體中最多只保留 read_ahead + 1 個分段；
+    Graph 要求分段依序送出，因此讀取下一段與上傳目前分段同時進行。
+    中斷時依伺服器回報的 nextExpectedRanges 續傳，工作階段資訊保存在
+    session_path，程式重新啟動後也能接續上傳。
+    """
+
+    def __init__(
+        self,
+        access_token: str,
+        chunk_size: int = ONEDRIVE_CHUNK_SIZE,
+        read_ahead: int = ONEDRIVE_READ_AHEAD,
+        max_retries: int = ONEDRIVE_MAX_RETRIES,
+        session_path: str = DEFAULT_SESSION_PATH,
+    ):
+        self.access_token = access_token
+        self.chunk_size = _aligned_chunk_size(chunk_size)
+        self.read_ahead = max(1, read_ahead)
+        self.max_retries = max_retries
+        self.session_path = session_path
+        self._client = httpx.AsyncClient(timeout=httpx.Timeout(ONEDRIVE_TIMEOUT))
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    async def __aenter__(self) -> "OneDriveUploader":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    # ---- 工作階段保存 ----
+
+    def _load_sessions(self) -> Dict[str, Any]:
+        if not os.path.exists(self.session_path):
+            return {}
+        try:
+            with open(self.session_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"無法讀取上傳工作階段紀錄: {e}")
+            return {}
+
+    def _save_sessions(self, sessions: Dict[str, Any]) -> None:
+        tmp_path = self.session_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(sessions, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.session_path)
+
+    @staticmethod
+    def _session_key(path: str, folder_id: str, name: str) -> str:
+        return f"{os.path.abspath(path)}|{folder_id}|{name}"
+
+    def _remember_session(self, key: str, upload_url: Optional[str], stat: Optional[os.stat_result] = None) -> None:
+        sessions = self._load_sessions()
+        if upload_url is None:
+            sessions.pop(key, None)
+        else:
+            sessions[key] = {"upload_url": upload_url, "size": stat.st_size, "mtime": stat.st_mtime}
+        self._save_sessions(sessions)
+
+    # ---- Graph API ----
+
+    async def _create_session(self, folder_id: str, name: str) -> str:
+        url = f"{GRAPH_API_BASE}/me/drive/items/{folder_id}:/{quote(name)}:/createUploadSession"
+        body = {"item": {"@microsoft.graph.conflictBehavior": "replace", "name": name}}
+        response = await self._client.post(
+            url, json=body, headers={"Authorization": f"Bearer {self.access_token}"}
+        )
+        if response.status_code != 200:
+            raise OneDriveUploadError(f"無法建立上傳工作階段: {response.status_code} {response.text[:200]}")
+        upload_url = _json(response).get("uploadUrl")
+        if not upload_url:
+            raise OneDriveUploadError("Graph 回應缺少 uploadUrl")
+        return upload_url
+
+    async def _next_offset(self, upload_url: str) -> Optional[int]:
+        """查詢工作階段狀態，回傳下一個要上傳的位移；工作階段已失效時回傳 None"""
+        response = await self._client.get(upload_url)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        ranges = _json(response).get("nextExpectedRanges") or ["0-"]
+        try:
+            return int(ranges[0].split("-")[0])
+        except (ValueError, AttributeError) as e:
+            raise OneDriveUploadError(f"無法解析 nextExpectedRanges: {ranges}") from e
+
+    async def _read_chunks(self, path: str, offset: int, size: int) -> AsyncIterator[Tuple[int, bytes]]:
+        """從 offset 起逐段讀取檔案，預先讀取 read_ahead 個分段"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.read_ahead)
+
+        def read_at(f, position: int) -> bytes:
+            f.seek(position)
+            return f.read(self.chunk_size)
+
+        async def producer() -> None:
+            with open(path, "rb") as f:
+                position = offset
+                while position < size:
+                    data = await asyncio.to_thread(read_at, f, position)
+                    if not data:
+                        break
+                    await queue.put((position, data))
+                    position += len(data)
+            await queue.put(None)
+
+        task = asyncio.create_task(producer())
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                yield item
+            await task
+        finally:
+            task.cancel()
+
+    async def _put_chunk(self, upload_url: str, start: int, data: bytes, size: int) -> httpx.Response:
+        # 上傳網址已含授權資訊，不可再帶 Authorization 標頭
+        headers = {
+            "Content-Length": str(len(data)),
+            "Content-Range": f"bytes {start}-{start + len(data) - 1}/{size}",
+        }
+        return await self._client.put(upload_url, content=data, headers=headers)
+
+    async def _upload_from(self, upload_url: str, path: str, offset: int, size: int) -> Dict[str, Any]:
+        """從 offset 開始上傳，成功時回傳檔案項目；中途失敗時拋出 httpx 例外"""
+        async for start, data in self._read_chunks(path, offset, size):
+            response = await self._put_chunk(upload_url, start, data, size)
+            if response.status_code in (200, 201):
+                return _json(response)
+            if response.status_code != 202:
+                response.raise_for_status()
+        raise OneDriveUploadError("檔案已全部送出，但伺服器未回報上傳完成")
+
+    async def upload(self, path: str, folder_id: str, name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        上傳檔案到指定資料夾
+
+        Args:
+            path (str): 本機檔案路徑
+            folder_id (str): 目標資料夾 ID（"root" 為根目錄）
+            name (Optional[str]): 上傳後的檔名，預設為原檔名
+
+        Returns:
+            Dict[str, Any]: Graph 回傳的檔案項目（含 id、webUrl、size）
+        """
+        if not os.path.isfile(path):
+            raise OneDriveUploadError(f"找不到檔案: {path}")
+        name = name or os.path.basename(path)
+        stat = os.stat(path)
+        key = self._session_key(path, folder_id, name)
+
+        # 檔案未變更時沿用先前的工作階段
+        saved = self._load_sessions().get(key)
+        upload_url = None
+        if saved and saved["size"] == stat.st_size and saved["mtime"] == stat.st_mtime:
+            upload_url = saved["upload_url"]
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                offset = await self._next_offset(upload_url) if upload_url else None
+                if offset is None:
+                    upload_url = await self._create_session(folder_id, name)
+                    self._remember_session(key, upload_url, stat)
+                    offset = 0
+                elif offset:
+                    logger.info(f"從 {offset}/{stat.st_size} 位元組續傳 {path}")
+
+                item = await self._upload_from(upload_url, path, offset, stat.st_size)
+                self._remember_session(key, None)
+                return item
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code == 404:
+                    # 工作階段過期，下一輪重新建立
+                    upload_url = None
+                elif e.response.status_code not in RETRY_STATUS:
+                    raise OneDriveUploadError(f"上傳失敗: {e.response.status_code} {e.response.text[:200]}") from e
+                error = e
+            except httpx.RequestError as e:
+                error = e
+
+            if attempt < self.max_retries:
+                delay = min(2 ** attempt, 30)
+                logger.warning(f"上傳 {path} 中斷（{error}），{delay} 秒後續傳")
+                await asyncio.sleep(delay)
+
+        raise OneDriveUploadError(f"重試 {self.max_retries} 次後仍無法上傳 {path}: {error}")
+
+
+async def upload_file_to_onedrive(path: str, folder_id: str = "root", name: Optional[str] = None) -> str:
+    """
+    將本機檔案直接分段上傳到 OneDrive，檔案內容不經過模型
+
+    只接受 ONEDRIVE_UPLOAD_ROOT 內的檔案；相對路徑以該目錄為基準。
+
+    Args:
+        path (str): 本機檔案路徑
+        folder_id (str): 目標資料夾 ID，預設為根目錄
+        name (Optional[str]): 上傳後的檔名，預設為原檔名
+
+    Returns:
+        str: 上傳結果
+    """
+    access_token = os.getenv("ONEDRIVE_ACCESS_TOKEN")
+    if not access_token:
+        return "錯誤：未設定 ONEDRIVE_ACCESS_TOKEN"
+    try:
+        path = _resolve_upload_path(path, ONEDRIVE_UPLOAD_ROOT)
+        async with OneDriveUploader(access_token) as uploader:
+            item = await uploader.upload(path, folder_id, name)
+    except OneDriveUploadError as e:
+        return f"上傳失敗：{e}"
+    return json.dumps(
+        {"successful": True, "id": item.get("id"), "name": item.get("name"),
+         "size": item.get("size"), "webUrl": item.get("webUrl")},
+        ensure_ascii=False
+    )
@@ -1,10 +1,18 @@
 import os
+import sys
+import time
+import asyncio
 import httpx
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Tuple
 from dotenv import load_dotenv
 from mcp.server import FastMCP
 
+# 讓腳本可以匯入專案根目錄下的共用模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.gazetteer import resolve_city
+from common.tracing import trace_mcp_tool
+
 # 設置日誌
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -15,7 +23,37 @@ load_dotenv()
 # 創建一個 MCP 服務器
 mcp = FastMCP("天氣查詢服務")
 
+# WeatherAPI 設定
+WEATHER_API_BASE = "https://api.weatherapi.com/v1"
+WEATHER_CACHE_TTL = int(os.getenv("WEATHER_CACHE_TTL", "600"))
+WEATHER_MAX_CONCURRENCY = int(os.getenv("WEATHER_MAX_CONCURRENCY", "5"))
+# WeatherAPI bulk 請求單次最多 50 個地點
+WEATHER_BULK_LIMIT = 50
+# 表示方案或金鑰不支援 bulk 的狀態碼
+BULK_UNSUPPORTED_STATUS = {400, 401, 403}
+
+# 當前天氣快取：{正規化城市名稱: (寫入時間, current.json 回應)}
+_current_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+# 帳號方案不支援 bulk 時，第一次失敗後就不再嘗試
+_bulk_supported = os.getenv("WEATHER_BULK_ENABLED", "true").lower() == "true"
+
+def _cache_key(city: str) -> str:
+    """將城市名稱正規化為快取鍵"""
+    return " ".join(city.strip().lower().split())
+
+def _get_cached_current(city: str) -> Optional[Dict[str, Any]]:
+    """讀取未過期的當前天氣快取"""
+    entry = _current_cache.get(_cache_key(city))
+    if entry and time.monotonic() - entry[0] < WEATHER_CACHE_TTL:
+        return entry[1]
+    return None
+
+def _set_cached_current(city: str, data: Dict[str, Any]) -> None:
+    """寫入當前天氣快取"""
+    _current_cache[_cache_key(city)] = (time.monotonic(), data)
+
 @mcp.tool()
+@trace_mcp_tool(mcp)
 async def get_weather(city: str) -> str:
     """
     獲取指定城市的天氣信息
@@ -32,8 +70,11 @@ async def get_weather(city: str) -> str:
         if not weather_api_key:
             return "錯誤：未設置 WEATHER_API_KEY 環境變數"
 
+        # 將城市名稱解析為標準查詢鍵與顯示名稱
+        query, city = resolve_city(city)
+
         # 設定 API URL
-        api_url = "https://api.weatherapi.com/v1/current.json"
+        api_url = f"{WEATHER_API_BASE}/current.json"
         
         # 設定請求頭和參數
         headers = {
@@ -42,26 +83,31 @@ async def get_weather(city: str) -> str:
         
         params = {
             "key": weather_api_key,
-            "q": city
+            "q": query
         }
         
-        logger.info(f"正在查詢 {city} 的天氣信息...")
-        
-        # 發送請求
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                api_url, 
-                headers=headers, 
-                params=params, 
-                timeout=10
-            )
-            
-            if response.status_code != 200:
-                error_text = response.text
-                logger.error(f"API 請求錯誤：狀態碼 {response.status_code}, 回應: {error_text}")
-                return f"API 請求錯誤：無法獲取 {city} 的天氣信息"
-            
-            data = response.json()
+        data = _get_cached_current(query)
+        if data is not None:
+            logger.info(f"使用快取的 {city} 天氣信息")
+        else:
+            logger.info(f"正在查詢 {city} 的天氣信息...")
+
+            # 發送請求
+            async with httpx.AsyncClient() as client:
+                response = await client.get(
+                    api_url, 
+                    headers=headers, 
+                    params=params, 
+                    timeout=10
+                )
+                
+                if response.status_code != 200:
+                    error_text = response.text
+                    logger.error(f"API 請求錯誤：狀態碼 {response.status_code}, 回應: {error_text}")
+                    return f"API 請求錯誤：無法獲取 {city} 的天氣信息"
+                
+                data = response.json()
+            _set_cached_current(query, data)
         
         # 解析回應
         weather_text = data['current']['condition']['text']
@@ -97,7 +143,173 @@ async def get_weather(city: str) -> str:
         logger.error(f"發生未知錯誤: {e}")
         return f"發生錯誤：{str(e)}"
 
+async def _fetch_bulk(client: httpx.AsyncClient, weather_api_key: str, cities: List[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    使用 WeatherAPI bulk 請求一次查詢多個城市
+
+    Returns:
+        Optional[Dict[str, Dict[str, Any]]]: {城市: current.json 格式的資料}，方案不支援 bulk 且尚無結果時返回 None
+    """
+    global _bulk_supported
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for start in range(0, len(cities), WEATHER_BULK_LIMIT):
+        chunk = cities[start:start + WEATHER_BULK_LIMIT]
+        body = {
+            "locations": [
+                {"q": city, "custom_id": str(index)} for index, city in enumerate(chunk)
+            ]
+        }
+        try:
+            response = await client.post(
+                f"{WEATHER_API_BASE}/current.json",
+                headers={"accept": "application/json"},
+                params={"key": weather_api_key, "q": "bulk"},
+                json=body,
+                timeout=15
+            )
+        except httpx.RequestError as e:
+            # 暫時性的連線問題，其餘城市交由並行查詢，下次仍嘗試 bulk
+            logger.warning(f"bulk 請求失敗（{e}），改為並行查詢")
+            return results or None
+
+        if response.status_code != 200:
+            logger.warning(f"bulk 請求失敗（狀態碼 {response.status_code}），改為並行查詢")
+            # 只有方案或金鑰不支援 bulk 時才停用，429/5xx 等暫時性錯誤下次仍嘗試
+            if response.status_code in BULK_UNSUPPORTED_STATUS:
+                _bulk_supported = False
+            return results or None
+
+        for item in response.json().get("bulk", []):
+            query = item.get("query", {})
+            custom_id = query.get("custom_id")
+            if custom_id is None or "current" not in query:
+                continue
+            results[chunk[int(custom_id)]] = query
+
+    return results
+
+async def _fetch_concurrently(client: httpx.AsyncClient, weather_api_key: str, cities: List[str]) -> Dict[str, Dict[str, Any]]:
+    """以有上限的並行度逐一查詢城市天氣"""
+    semaphore = asyncio.Semaphore(WEATHER_MAX_CONCURRENCY)
+
+    async def fetch_one(city: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        async with semaphore:
+            try:
+                response = await client.get(
+                    f"{WEATHER_API_BASE}/current.json",
+                    headers={"accept": "application/json"},
+                    params={"key": weather_api_key, "q": city},
+                    timeout=10
+                )
+            except httpx.RequestError as e:
+                logger.error(f"請求 {city} 天氣時發生錯誤: {e}")
+                return city, None
+
+            if response.status_code != 200:
+                logger.error(f"API 請求錯誤：{city} 狀態碼 {response.status_code}, 回應: {response.text}")
+                return city, None
+            return city, response.json()
+
+    pairs = await asyncio.gather(*(fetch_one(city) for city in cities))
+    return {city: data for city, data in pairs if data is not None}
+
 @mcp.tool()
+@trace_mcp_tool(mcp)
+async def get_weather_bulk(cities: List[str]) -> str:
+    """
+    一次獲取多個城市的當前天氣信息
+
+    Args:
+        cities (List[str]): 城市名稱列表
+
+    Returns:
+        str: 表格格式的天氣信息
+    """
+    try:
+        # 檢查 API KEY
+        weather_api_key = os.getenv("WEATHER_API_KEY")
+        if not weather_api_key:
+            return "錯誤：未設置 WEATHER_API_KEY 環境變數"
+
+        # 解析城市名稱並去除重複（保留原始順序）：{查詢鍵: 顯示名稱}
+        unique_cities: Dict[str, str] = {}
+        for city in cities:
+            if not city.strip():
+                continue
+            query, name = resolve_city(city)
+            key = _cache_key(query)
+            if key not in unique_cities:
+                unique_cities[key] = name
+
+        if not unique_cities:
+            return "錯誤：未提供城市名稱"
+
+        # 先從快取取得資料
+        results: Dict[str, Dict[str, Any]] = {}
+        misses: List[str] = []
+        for query in unique_cities:
+            data = _get_cached_current(query)
+            if data is not None:
+                results[query] = data
+            else:
+                misses.append(query)
+
+        logger.info(f"批次查詢 {len(unique_cities)} 個城市的天氣，快取命中 {len(results)} 個")
+
+        if misses:
+            async with httpx.AsyncClient() as client:
+                fetched: Dict[str, Dict[str, Any]] = {}
+                if _bulk_supported and len(misses) > 1:
+                    fetched = await _fetch_bulk(client, weather_api_key, misses) or {}
+
+                # bulk 不可用或部分城市未返回時，改為並行查詢
+                remaining = [query for query in misses if query not in fetched]
+                if remaining:
+                    fetched.update(await _fetch_concurrently(client, weather_api_key, remaining))
+
+            for query, data in fetched.items():
+                _set_cached_current(query, data)
+            results.update(fetched)
+
+        # 格式化為精簡表格
+        lines = [
+            "| 城市 | 天氣狀況 | 溫度 | 體感溫度 | 濕度 | 風速 |",
+            "|---|---|---|---|---|---|"
+        ]
+        failed: List[str] = []
+        for query, city in unique_cities.items():
+            data = results.get(query)
+            if data is None:
+                failed.append(city)
+                continue
+            current = data['current']
+            lines.append(
+                f"| {city} | {current['condition']['text']} | {current['temp_c']}°C | "
+                f"{current['feelslike_c']}°C | {current['humidity']}% | "
+                f"{current['wind_kph']} km/h ({current['wind_dir']}) |"
+            )
+
+        weather_table = "【多城市天氣信息】\n\n" + "\n".join(lines)
+        if failed:
+            weather_table += f"\n\n無法獲取天氣信息的城市：{', '.join(failed)}"
+        weather_table += "\n\n資料來源：WeatherAPI.com"
+
+        logger.info(f"成功獲取 {len(unique_cities) - len(failed)} 個城市的天氣信息")
+        return weather_table
+
+    except httpx.RequestError as e:
+        logger.error(f"請求錯誤: {e}")
+        return f"請求錯誤：無法連接到天氣 API ({str(e)})"
+    except KeyError as e:
+        logger.error(f"數據解析錯誤: {e}")
+        return f"數據解析錯誤：API 返回的數據格式不符合預期 ({str(e)})"
+    except Exception as e:
+        logger.error(f"發生未知錯誤: {e}")
+        return f"發生錯誤：{str(e)}"
+
+@mcp.tool()
+@trace_mcp_tool(mcp)
 async def get_forecast(city: str, days: int = 3) -> str:
     """
     獲取指定城市的天氣預報
@@ -119,8 +331,11 @@ async def get_forecast(city: str, days: int = 3) -> str:
         if days < 1 or days > 7:
             return "錯誤：預報天數必須在 1-7 之間"
 
+        # 將城市名稱解析為標準查詢鍵與顯示名稱
+        query, city = resolve_city(city)
+
         # 設定 API URL
-        api_url = "https://api.weatherapi.com/v1/forecast.json"
+        api_url = f"{WEATHER_API_BASE}/forecast.json"
         
         # 設定請求頭和參數
         headers = {
@@ -129,7 +344,7 @@ async def get_forecast(city: str, days: int = 3) -> str:
         
         params = {
             "key": weather_api_key,
-            "q": city,
+            "q": query,
             "days": days
         }
         
@@ -184,6 +399,7 @@ async def get_forecast(city: str, days: int = 3) -> str:
         return f"發生錯誤：{str(e)}"
 
 @mcp.tool()
+@trace_mcp_tool(mcp)
 def get_service_info() -> str:
     """獲取天氣服務的基本信息"""
     return """
@@ -191,20 +407,30 @@ def get_service_info() -> str:
 
 此服務提供以下功能：
 1. 獲取指定城市的當前天氣信息
-2. 獲取指定城市的天氣預報 (1-7 天)
-3. 自動處理錯誤和異常情況
+2. 一次獲取多個城市的當前天氣信息
+3. 獲取指定城市的天氣預報 (1-7 天)
+4. 自動處理錯誤和異常情況
 
 使用方法：
 - 使用 get_weather 工具獲取當前天氣
+- 使用 get_weather_bulk 工具一次查詢多個城市（例如比較多地天氣時）
 - 使用 get_forecast 工具獲取天氣預報
 - 使用 get_service_info 工具獲取服務信息
 
 參數說明：
 - city: 城市名稱 (例如：Taipei, Tokyo, New York)
+- cities: 城市名稱列表 (例如：["Taipei", "Tokyo", "Seoul"])
 - days: 預報天數 (1-7)
 
 環境配置：
 - WEATHER_API_KEY: WeatherAPI.com 的 API 金鑰
+- WEATHER_CACHE_TTL: 當前天氣快取秒數 (預設 600)
+- WEATHER_MAX_CONCURRENCY: 批次查詢時的最大並行請求數 (預設 5)
+- WEATHER_BULK_ENABLED: 是否使用 WeatherAPI bulk 請求 (預設 true)
+- GAZETTEER_PATH: 城市別名索引檔路徑 (預設為內建的 common/data/cities.tsv)
+
+城市名稱會先經過離線別名索引正規化（例如「台北」、「臺北市」、「Taipei」視為同一城市），
+再以經緯度向 WeatherAPI 查詢。
 
 資料來源：WeatherAPI.com
 """
@@ -1,10 +1,21 @@
 from mcp.server import FastMCP
 import os
+import sys
+import re
+import time
+import asyncio
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from exa_py import Exa
 import json
 from dotenv import load_dotenv
 import logging
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
+
+# 讓腳本可以匯入專案根目錄下的共用模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.tracing import trace_mcp_tool
 
 # 設置日誌
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -16,8 +27,228 @@ load_dotenv()
 # 創建一個 MCP 服務器
 mcp = FastMCP("EXA 搜索服務")
 
+# 並行設定
+EXA_MAX_WORKERS = int(os.getenv("EXA_MAX_WORKERS", "8"))
+EXA_MAX_CONCURRENCY = int(os.getenv("EXA_MAX_CONCURRENCY", "8"))
+EXA_SEARCH_TIMEOUT = float(os.getenv("EXA_SEARCH_TIMEOUT", "30"))
+
+# Exa SDK 為同步呼叫，放到有上限的執行緒池中執行，避免阻塞 MCP 服務器的事件迴圈
+_executor = ThreadPoolExecutor(max_workers=EXA_MAX_WORKERS, thread_name_prefix="exa-search")
+_exa_client: Optional[Exa] = None
+_search_semaphore: Optional[asyncio.Semaphore] = None
+
+# 各搜索類別的快取秒數（新聞變化快，學術資料變化慢）
+EXA_CACHE_TTL = {
+    "news": int(os.getenv("EXA_CACHE_TTL_NEWS", "300")),
+    "academic": int(os.getenv("EXA_CACHE_TTL_ACADEMIC", "86400")),
+}
+EXA_CACHE_TTL_DEFAULT = int(os.getenv("EXA_CACHE_TTL_DEFAULT", "3600"))
+EXA_CACHE_MAX_ENTRIES = int(os.getenv("EXA_CACHE_MAX_ENTRIES", "512"))
+EXA_DOCUMENT_STORE_SIZE = int(os.getenv("EXA_DOCUMENT_STORE_SIZE", "2000"))
+
+# 輸出預算：限制工具輸出的總字數與每筆結果的字數，避免撐大後續 LLM 呼叫的提示詞
+EXA_MAX_OUTPUT_CHARS = int(os.getenv("EXA_MAX_OUTPUT_CHARS", "6000"))
+EXA_MAX_CHARS_PER_RESULT = int(os.getenv("EXA_MAX_CHARS_PER_RESULT", "1500"))
+
+# 預先編譯的清理與切句規則
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+_INLINE_SPACE_RE = re.compile(r'[ \t\u3000\xa0]+')
+_BLANK_LINES_RE = re.compile(r'\n\s*\n+')
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[。！？!?])|(?<=\.)\s+|\n+')
+_TERM_RE = re.compile(r'[\u4e00-\u9fff]+|[A-Za-z0-9]+')
+
+SearchKey = Tuple[str, int, str, str]
+
+# 搜索結果快取：{(正規化查詢, 結果數量, 類別, 搜索類型): (寫入時間, [文件網址, ...])}
+_search_cache: "OrderedDict[SearchKey, Tuple[float, List[str]]]" = OrderedDict()
+# 以網址為鍵的文件庫，同一頁面的內容只保存一次，供不同查詢共用
+_documents: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+# 進行中的搜索，相同查詢同時到達時共用同一次上游請求；
+# 搜索在獨立的 task 中執行，任一呼叫端被取消都不影響其他等待者
+_inflight: Dict[SearchKey, "asyncio.Task[List[str]]"] = {}
+
+def normalize_query(query: str) -> str:
+    """將查詢字串正規化為快取鍵（大小寫與空白不影響結果）"""
+    return " ".join(query.lower().split())
+
+def _get_cached_search(key: SearchKey) -> Optional[List[str]]:
+    """讀取未過期且文件仍在文件庫中的搜索結果"""
+    entry = _search_cache.get(key)
+    if entry is None:
+        return None
+    stored_at, urls = entry
+    ttl = EXA_CACHE_TTL.get(key[2], EXA_CACHE_TTL_DEFAULT)
+    if time.monotonic() - stored_at >= ttl or any(url not in _documents for url in urls):
+        del _search_cache[key]
+        return None
+    _search_cache.move_to_end(key)
+    for url in urls:
+        _documents.move_to_end(url)
+    return urls
+
+def _set_cached_search(key: SearchKey, urls: List[str]) -> None:
+    """寫入搜索結果快取，超過上限時淘汰最久未使用的項目"""
+    _search_cache[key] = (time.monotonic(), urls)
+    _search_cache.move_to_end(key)
+    while len(_search_cache) > EXA_CACHE_MAX_ENTRIES:
+        _search_cache.popitem(last=False)
+
+def clean_text(text: str) -> str:
+    """移除 HTML 標籤並壓縮多餘的空白與空行"""
+    text = _HTML_TAG_RE.sub('', text)
+    text = _INLINE_SPACE_RE.sub(' ', text)
+    return _BLANK_LINES_RE.sub('\n\n', text).strip()
+
+def _query_terms(query: str) -> List[str]:
+    """
+    取出查詢中的關鍵詞
+
+    英數字以單字為單位；中文沒有空白分詞，改用相鄰兩字（bigram）比對
+    """
+    terms = []
+    for token in _TERM_RE.findall(query.lower()):
+        if '\u4e00' <= token[0] <= '\u9fff' and len(token) > 2:
+            terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+        elif len(token) > 1 or '\u4e00' <= token[0] <= '\u9fff':
+            terms.append(token)
+    return list(dict.fromkeys(terms))
+
+def select_snippet(text: str, terms: List[str], max_chars: int) -> str:
+    """
+    從內文中挑選與查詢最相關的句子，總長度不超過 max_chars
+
+    Args:
+        text (str): 已清理的內文
+        terms (List[str]): 查詢關鍵詞
+        max_chars (int): 字數上限
+
+    Returns:
+        str: 摘錄內容，不連續的句子之間以「…」分隔
+    """
+    if len(text) <= max_chars:
+        return text
+    if max_chars <= 0:
+        return ""
+
+    sentences = [sentence.strip() for sentence in _SENTENCE_SPLIT_RE.split(text) if sentence.strip()]
+    lowered = [sentence.lower() for sentence in sentences]
+    scores = [sum(sentence.count(term) for term in terms) for sentence in lowered]
+
+    # 沒有任何關鍵詞命中時，保留開頭的內容
+    if not any(scores):
+        return text[:max_chars].rstrip() + "…"
+
+    # 依分數由高到低挑選句子（同分時偏好前面的句子），再按原文順序輸出
+    chosen = []
+    seen = set()
+    used = 0
+    for index in sorted(range(len(sentences)), key=lambda i: (-scores[i], i)):
+        if scores[index] == 0:
+            break
+        length = len(sentences[index]) + 1
+        if lowered[index] in seen or used + length > max_chars:
+            continue
+        chosen.append(index)
+        seen.add(lowered[index])
+        used += length
+
+    if not chosen:
+        best = max(range(len(sentences)), key=lambda i: (scores[i], -i))
+        return sentences[best][:max_chars].rstrip() + "…"
+
+    chosen.sort()
+    parts = [sentences[chosen[0]]]
+    for previous, index in zip(chosen, chosen[1:]):
+        parts.append((" " if index == previous + 1 else " … ") + sentences[index])
+    return "".join(parts)
+
+def _store_document(result: Any) -> str:
+    """
+    將搜索結果存入文件庫
+
+    Returns:
+        str: 文件的鍵（網址）
+    """
+    url = getattr(result, 'url', None) or getattr(result, 'id', None) or '無網址'
+    document = {
+        "title": getattr(result, 'title', None) or '無標題',
+        "url": getattr(result, 'url', None) or '無網址',
+    }
+    if getattr(result, 'text', None) is not None:
+        document["text"] = clean_text(result.text)
+
+    _documents[url] = document
+    _documents.move_to_end(url)
+    while len(_documents) > EXA_DOCUMENT_STORE_SIZE:
+        _documents.popitem(last=False)
+    return url
+
+def get_exa_client() -> Optional[Exa]:
+    """取得共用的 Exa 客戶端（第一次呼叫時建立）"""
+    global _exa_client
+    if _exa_client is None:
+        exa_api_key = os.getenv("EXA_API_KEY")
+        if not exa_api_key:
+            return None
+        _exa_client = Exa(api_key=exa_api_key)
+    return _exa_client
+
+def get_search_semaphore() -> asyncio.Semaphore:
+    """取得限制同時搜索數量的信號量（需在事件迴圈中建立）"""
+    global _search_semaphore
+    if _search_semaphore is None:
+        _search_semaphore = asyncio.Semaphore(EXA_MAX_CONCURRENCY)
+    return _search_semaphore
+
+async def _search_documents(exa: Exa, query: str, num_results: int, category: str, search_type: str) -> List[str]:
+    """
+    向 EXA 發送搜索請求並將結果存入文件庫
+
+    Returns:
+        List[str]: 搜索結果的文件鍵（網址）列表
+    """
+    # 在執行緒池中執行搜索，並限制同時進行的搜索數量
+    search = functools.partial(
+        exa.search_and_contents,
+        query,
+        text=True,
+        num_results=num_results,
+        category=category,
+        type=search_type
+    )
+    async with get_search_semaphore():
+        loop = asyncio.get_running_loop()
+        search_response = await asyncio.wait_for(
+            loop.run_in_executor(_executor, search),
+            timeout=EXA_SEARCH_TIMEOUT
+        )
+
+    return [_store_document(result) for result in search_response.results]
+
+async def _shared_search(key: SearchKey, exa: Exa, query: str, num_results: int, category: str, search_type: str) -> List[str]:
+    """執行搜索並寫入快取，完成後（含失敗）從進行中的搜索移除"""
+    try:
+        urls = await _search_documents(exa, query, num_results, category, search_type)
+        _set_cached_search(key, urls)
+        return urls
+    finally:
+        _inflight.pop(key, None)
+
+def _retrieve_exception(task: asyncio.Task) -> None:
+    # 所有呼叫端都已取消時，避免出現未取得例外的警告
+    if not task.cancelled():
+        task.exception()
+
 @mcp.tool()
-async def exa_search(query: str, num_results: int = 5, category: str = "web", search_type: str = "keyword") -> str:
+@trace_mcp_tool(mcp)
+async def exa_search(
+    query: str,
+    num_results: int = 5,
+    category: str = "web",
+    search_type: str = "keyword",
+    max_chars: int = EXA_MAX_OUTPUT_CHARS,
+    max_chars_per_result: int = EXA_MAX_CHARS_PER_RESULT
+) -> str:
     """
     使用 EXA Search API 進行網路搜索
     
@@ -26,50 +257,62 @@ async def exa_search(query: str, num_results: int = 5, category: str = "web", se
         num_results (int): 返回結果數量，預設為5
         category (str): 搜索類別，預設為"web"
         search_type (str): 搜索類型，預設為"keyword"
+        max_chars (int): 輸出內容的總字數上限
+        max_chars_per_result (int): 每筆結果內容的字數上限
         
     Returns:
         str: 格式化的搜索結果
     """
     try:
-        # 檢查 API Key
-        exa_api_key = os.getenv("EXA_API_KEY")
-        if not exa_api_key:
-            return "錯誤：未設置 EXA_API_KEY"
-
-        # 初始化 Exa 客戶端
-        exa = Exa(api_key=exa_api_key)
-
-        # 執行搜索
-        search_response = exa.search_and_contents(
-            query,
-            text=True,
-            num_results=num_results,
-            category=category,
-            type=search_type
-        )
+        key: SearchKey = (normalize_query(query), num_results, category, search_type)
 
-        # 取得搜索結果
-        results = search_response.results
+        urls = _get_cached_search(key)
+        if urls is not None:
+            logger.info(f"使用快取的搜索結果: {query}")
+        else:
+            task = _inflight.get(key)
+            if task is not None:
+                logger.info(f"等待進行中的相同搜索: {query}")
+            else:
+                # 取得共用的 Exa 客戶端
+                exa = get_exa_client()
+                if exa is None:
+                    return "錯誤：未設置 EXA_API_KEY"
+                task = asyncio.create_task(_shared_search(key, exa, query, num_results, category, search_type))
+                task.add_done_callback(_retrieve_exception)
+                _inflight[key] = task
+            # shield：呼叫端被取消時只放棄等待，搜索繼續供其他呼叫端使用
+            urls = await asyncio.shield(task)
 
-        # 格式化結果
+        # 格式化結果（同一網址只輸出一次），依輸出預算摘錄與查詢相關的內容
+        documents = [_documents[url] for url in dict.fromkeys(urls) if url in _documents]
+        terms = _query_terms(query)
         formatted_content = []
-        for result in results:
-            content = f"標題: {result.title if hasattr(result, 'title') else '無標題'}\n"
-            content += f"網址: {result.url if hasattr(result, 'url') else '無網址'}\n"
-            if hasattr(result, 'text'):
-                # 移除 HTML 標籤
-                import re
-                clean_text = re.sub(r'<[^>]+>', '', result.text)
-                content += f"內容:\n{clean_text}\n"
+        remaining = max_chars
+        for index, document in enumerate(documents):
+            content = f"標題: {document['title']}\n"
+            content += f"網址: {document['url']}\n"
+            remaining -= len(content)
+            if "text" in document:
+                # 剩餘預算平均分給尚未輸出的結果
+                budget = min(max_chars_per_result, remaining // (len(documents) - index))
+                snippet = select_snippet(document["text"], terms, budget)
+                if snippet:
+                    content += f"內容:\n{snippet}\n"
+                    remaining -= len(snippet)
             formatted_content.append(content)
 
         return "\n---\n".join(formatted_content) if formatted_content else "無搜索結果"
 
+    except asyncio.TimeoutError:
+        logger.error(f"搜索超時（{EXA_SEARCH_TIMEOUT} 秒）: {query}")
+        return "錯誤：搜索超時，請稍後再試"
     except Exception as e:
         logger.error(f"搜索過程中發生錯誤: {str(e)}")
         return f"發生錯誤：{str(e)}"
 
 @mcp.tool()
+@trace_mcp_tool(mcp)
 def get_search_info() -> str:
     """獲取搜索服務的基本信息"""
     return """
@@ -80,6 +323,7 @@ def get_search_info() -> str:
 2. 支持自定義搜索結果數量
 3. 支持自定義搜索類別和類型
 4. 自動格式化搜索結果
+5. 快取相同查詢的搜索結果，並在不同查詢間共用相同網頁的內容
 
 使用方法：
 - 使用 exa_search 工具進行搜索，可指定：
@@ -87,10 +331,21 @@ def get_search_info() -> str:
   * 結果數量 (num_results)
   * 搜索類別 (category)
   * 搜索類型 (search_type)
+  * 輸出總字數上限 (max_chars) 與每筆結果字數上限 (max_chars_per_result)
 - 使用 get_search_info 工具獲取服務信息
 
 環境配置：
 - EXA_API_KEY: EXA Search API 的金鑰
+- EXA_MAX_WORKERS: 執行搜索的執行緒數量 (預設 8)
+- EXA_MAX_CONCURRENCY: 同時進行的搜索數量上限 (預設 8)
+- EXA_SEARCH_TIMEOUT: 單次搜索超時秒數 (預設 30)
+- EXA_CACHE_TTL_NEWS: news 類別的快取秒數 (預設 300)
+- EXA_CACHE_TTL_ACADEMIC: academic 類別的快取秒數 (預設 86400)
+- EXA_CACHE_TTL_DEFAULT: 其他類別的快取秒數 (預設 3600)
+- EXA_CACHE_MAX_ENTRIES: 搜索結果快取的最大筆數 (預設 512)
+- EXA_DOCUMENT_STORE_SIZE: 文件庫保存的最大網頁數 (預設 2000)
+- EXA_MAX_OUTPUT_CHARS: 搜索結果輸出的總字數上限 (預設 6000)
+- EXA_MAX_CHARS_PER_RESULT: 每筆結果內容的字數上限 (預設 1500)
 
 支援的搜索類別：
 - web: 網頁搜索
@@ -1,13 +1,27 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import os
+import sys
 import json
+import math
+import time
+import uuid
+import asyncio
 import logging
-from typing import Dict, Any, List
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from typing import Dict, Any, List, Optional, Tuple
 from dotenv import load_dotenv
 from mcp.server import FastMCP
 import httpx
 
+# 讓腳本可以匯入專案根目錄下的共用模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.image_store import ImageStore, DEFAULT_IMAGE_STORE_DIR, generation_cache_key
+from common.tracing import trace_mcp_tool
+
 # 設置日誌
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -18,6 +32,38 @@ load_dotenv()
 # 創建一個 MCP 服務器
 mcp = FastMCP("圖片生成服務")
 
+# 生成工作設定
+IMAGE_MAX_WORKERS = int(os.getenv("IMAGE_MAX_WORKERS", "2"))
+IMAGE_GENERATE_TIMEOUT = float(os.getenv("IMAGE_GENERATE_TIMEOUT", "120"))
+IMAGE_JOB_TTL = int(os.getenv("IMAGE_JOB_TTL", "3600"))
+IMAGE_DOWNLOAD = os.getenv("IMAGE_DOWNLOAD", "true").lower() == "true"
+# 單次後端請求的最大 batch_size，超過時以 n_iter 重複
+IMAGE_MAX_BATCH_SIZE = int(os.getenv("IMAGE_MAX_BATCH_SIZE", "4"))
+# generate_images 中同一組設定最多生成的張數
+MAX_VARIATIONS = int(os.getenv("IMAGE_MAX_VARIATIONS", "8"))
+DEFAULT_SAMPLER = "DPM++ 2M"
+
+# 縮圖設定：生成後產生的 WebP 縮圖尺寸（最長邊像素），並由靜態檔案服務提供
+IMAGE_THUMBNAIL_SIZES = [int(size) for size in os.getenv("IMAGE_THUMBNAIL_SIZES", "256,512").split(",") if size.strip()]
+IMAGE_STATIC_PORT = int(os.getenv("IMAGE_STATIC_PORT", "8600"))
+# 預設只監聽本機；需要讓其他主機取得圖片時設為 0.0.0.0 並一併設定 IMAGE_PUBLIC_BASE_URL
+IMAGE_STATIC_HOST = os.getenv("IMAGE_STATIC_HOST", "127.0.0.1")
+IMAGE_PUBLIC_BASE_URL = os.getenv("IMAGE_PUBLIC_BASE_URL", f"http://localhost:{IMAGE_STATIC_PORT}").rstrip("/")
+_thumbnail_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("IMAGE_THUMBNAIL_WORKERS", "2")),
+    thread_name_prefix="thumbnail"
+)
+
+# 本地圖片庫與生成結果快取（固定 seed 時相同參數直接返回）
+image_store = ImageStore(os.getenv("IMAGE_STORE_DIR", DEFAULT_IMAGE_STORE_DIR))
+
+# 背景生成工作：{job_id: 工作資訊}
+_jobs: Dict[str, Dict[str, Any]] = {}
+# 進行中的固定 seed 工作：{快取鍵: job_id}，相同請求共用同一個工作
+_jobs_by_key: Dict[str, str] = {}
+_client: Optional[httpx.AsyncClient] = None
+_worker_semaphore: Optional[asyncio.Semaphore] = None
+
 def check_environment():
     """檢查必要的環境變數"""
     required_vars = ["STABLE_DIFFUSION_URL"]
@@ -28,12 +74,353 @@ def check_environment():
         return False
     return True
 
+def _get_client() -> httpx.AsyncClient:
+    """取得共用的 HTTP 客戶端"""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(IMAGE_GENERATE_TIMEOUT, connect=10))
+    return _client
+
+def _get_worker_semaphore() -> asyncio.Semaphore:
+    """取得限制同時生成數量的信號量"""
+    global _worker_semaphore
+    if _worker_semaphore is None:
+        _worker_semaphore = asyncio.Semaphore(IMAGE_MAX_WORKERS)
+    return _worker_semaphore
+
+class ImageGenerationError(Exception):
+    """圖片生成失敗，訊息可直接返回給使用者"""
+
+def _build_generation_params(
+    prompt: str,
+    width: int,
+    height: int,
+    steps: int,
+    seed: int,
+    sampler_name: str = DEFAULT_SAMPLER,
+    batch_size: int = 1,
+    n_iter: int = 1
+) -> Dict[str, Any]:
+    """組出 Stable Diffusion 的請求參數"""
+    return {
+        "batch_size": batch_size,
+        "n_iter": n_iter,
+        "cfg_scale": 7,
+        "face_detector": "face_yolov8n.pt",
+        "hand_detector": "hand_yolov8n.pt",
+        "height": height,
+        "width": width,
+        "negative_prompt": "",
+        "override_settings": {
+            "sd_model_checkpoint": "sd-v1-5-inpainting.ckpt"
+        },
+        "person_detector": "person_yolov8n-seg.pt",
+        "prompt": prompt,
+        "sampler_name": sampler_name,
+        "seed": seed,
+        "steps": steps
+    }
+
+def _public_url(path: str) -> str:
+    """將圖片庫中的檔案路徑轉為靜態檔案服務的網址"""
+    return f"{IMAGE_PUBLIC_BASE_URL}/{os.path.basename(path)}"
+
+async def _postprocess(image_url: str, local_path: Optional[str]) -> Dict[str, Any]:
+    """
+    在執行緒池中為已下載的原圖產生縮圖
+
+    Returns:
+        Dict[str, Any]: {"image_url", "local_path", "thumbnails": {尺寸: 網址}}
+    """
+    result: Dict[str, Any] = {"image_url": image_url, "local_path": local_path, "thumbnails": {}}
+    if not local_path or not IMAGE_THUMBNAIL_SIZES:
+        return result
+    try:
+        loop = asyncio.get_running_loop()
+        thumbnails = await loop.run_in_executor(
+            _thumbnail_executor, image_store.make_thumbnails, local_path, IMAGE_THUMBNAIL_SIZES
+        )
+        result["thumbnails"] = {str(size): _public_url(path) for size, path in thumbnails.items()}
+    except Exception as e:
+        # 縮圖失敗不影響原圖結果
+        logger.error(f"產生縮圖失敗: {e}")
+    return result
+
+async def _generate(prompt: str, width: int, height: int, steps: int, seed: int) -> Dict[str, Any]:
+    """
+    生成圖片並存入本地圖片庫
+
+    Returns:
+        Dict[str, Any]: {"image_url": 原始網址, "local_path": 本地路徑, "thumbnails": {尺寸: 縮圖網址}, "cached": 是否命中快取}
+
+    Raises:
+        ImageGenerationError: API 設定錯誤或回應無效
+    """
+    cache_key = generation_cache_key(prompt, width, height, steps, seed) if seed != -1 else None
+    if cache_key:
+        cached = image_store.lookup(cache_key)
+        if cached:
+            logger.info(f"使用快取的圖片：{cached['image_url']}")
+            return {**cached, "cached": True}
+
+    # 檢查 API URL
+    api_url = os.getenv("STABLE_DIFFUSION_URL")
+    if not api_url:
+        raise ImageGenerationError("錯誤：未設置 STABLE_DIFFUSION_URL")
+
+    headers = {
+        "accept": "application/json",
+        "Content-Type": "application/json"
+    }
+
+    client = _get_client()
+    response = await client.post(
+        f"{api_url}/generate",
+        headers=headers,
+        json=_build_generation_params(prompt, width, height, steps, seed)
+    )
+    
+    if response.status_code != 200:
+        raise ImageGenerationError(f"API 請求錯誤：狀態碼 {response.status_code}")
+
+    # 直接獲取文本回應，因為 API 直接返回 URL 字符串
+    image_url = response.text.strip()
+    if not image_url:
+        raise ImageGenerationError("錯誤：API 返回空回應")
+    
+    # 驗證返回的 URL
+    if not image_url.startswith(('http://', 'https://')):
+        logger.error(f'無效的圖片 URL: {image_url}')
+        raise ImageGenerationError("錯誤：收到無效的圖片 URL")
+
+    logger.info(f"成功獲取圖片 URL：{image_url}")
+
+    # 串流下載原始檔到本地圖片庫（不解碼、不重新編碼）
+    local_path = await image_store.download(client, image_url) if IMAGE_DOWNLOAD else None
+    result = await _postprocess(image_url, local_path)
+    if cache_key:
+        image_store.remember(cache_key, result)
+    return {**result, "cached": False}
+
+def _parse_image_urls(text: str) -> List[str]:
+    """
+    解析生成 API 的回應：單張時為 URL 字串，批次時可能是 JSON 陣列、
+    {"images": [...]} / {"urls": [...]} 物件或以換行分隔的多個 URL
+    """
+    text = text.strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = None
+
+    if isinstance(data, dict):
+        data = data.get("images") or data.get("urls") or []
+    if isinstance(data, str):
+        data = [data]
+    if not isinstance(data, list):
+        data = text.replace(",", " ").split()
+
+    return [url.strip() for url in data if isinstance(url, str) and url.strip().startswith(('http://', 'https://'))]
+
+async def _generate_batch(
+    prompt: str,
+    width: int,
+    height: int,
+    steps: int,
+    sampler_name: str,
+    count: int
+) -> List[Dict[str, Any]]:
+    """
+    以一次後端請求生成同一提示詞的多張圖片（batch_size × n_iter）
+
+    Returns:
+        List[Dict[str, Any]]: 每張圖片的生成結果（含縮圖網址）
+
+    Raises:
+        ImageGenerationError: API 設定錯誤或回應無效
+    """
+    api_url = os.getenv("STABLE_DIFFUSION_URL")
+    if not api_url:
+        raise ImageGenerationError("錯誤：未設置 STABLE_DIFFUSION_URL")
+
+    batch_size = min(count, IMAGE_MAX_BATCH_SIZE)
+    n_iter = math.ceil(count / batch_size)
+    params = _build_generation_params(
+        prompt, width, height, steps, -1,
+        sampler_name=sampler_name, batch_size=batch_size, n_iter=n_iter
+    )
+
+    client = _get_client()
+    async with _get_worker_semaphore():
+        logger.info(f"批次生成 {count} 張圖片（batch_size={batch_size}, n_iter={n_iter}），提示詞：{prompt}")
+        response = await client.post(
+            f"{api_url}/generate",
+            headers={"accept": "application/json", "Content-Type": "application/json"},
+            json=params,
+            timeout=IMAGE_GENERATE_TIMEOUT * n_iter
+        )
+
+    if response.status_code != 200:
+        raise ImageGenerationError(f"API 請求錯誤：狀態碼 {response.status_code}")
+
+    image_urls = _parse_image_urls(response.text)
+    if not image_urls:
+        logger.error(f'無效的批次回應: {response.text[:200]}')
+        raise ImageGenerationError("錯誤：收到無效的圖片 URL")
+
+    if len(image_urls) < count:
+        logger.warning(f"批次生成要求 {count} 張，後端只返回 {len(image_urls)} 張，提示詞：{prompt}")
+    image_urls = image_urls[:count]
+
+    async def download_and_postprocess(image_url: str) -> Dict[str, Any]:
+        local_path = await image_store.download(client, image_url) if IMAGE_DOWNLOAD else None
+        return await _postprocess(image_url, local_path)
+
+    return list(await asyncio.gather(*(download_and_postprocess(url) for url in image_urls)))
+
+def _format_image_links(result: Dict[str, Any], alt: str = "Generated Image") -> str:
+    """將單張圖片格式化為 Markdown：先放縮圖（點擊開啟原圖），再列出各尺寸連結"""
+    image_url = result["image_url"]
+    thumbnails = result.get("thumbnails") or {}
+    if not thumbnails:
+        return f"![{alt}]({image_url})\n\n[點擊查看原圖]({image_url})"
+
+    sizes = sorted(thumbnails, key=int)
+    links = " | ".join(f"[{size}px]({thumbnails[size]})" for size in sizes)
+    return f"[![{alt}]({thumbnails[sizes[0]]})]({image_url})\n\n縮圖：{links} | [原圖]({image_url})"
+
+def _format_image_markdown(result: Dict[str, Any]) -> str:
+    """將生成結果格式化為 Markdown"""
+    return f"""
+### 生成的圖片
+
+{_format_image_links(result)}
+"""
+
+def _format_error(e: Exception) -> str:
+    """將生成過程的例外轉為錯誤訊息"""
+    if isinstance(e, ImageGenerationError):
+        return str(e)
+    if isinstance(e, httpx.TimeoutException):
+        logger.error(f'請求超時: {e}')
+        return "錯誤：請求超時，請稍後再試"
+    if isinstance(e, httpx.RequestError):
+        logger.error(f'API 請求錯誤: {e}')
+        return f"API 請求錯誤：{str(e)}"
+    logger.error(f'發生未知錯誤: {e}')
+    return f"發生錯誤：{str(e)}"
+
+def _prune_jobs() -> None:
+    """清除超過保存時間的已完成工作"""
+    now = time.time()
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job["status"] in ("done", "failed") and now - job["finished_at"] > IMAGE_JOB_TTL
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
+
+async def _run_job(job_id: str) -> None:
+    """在背景執行生成工作"""
+    job = _jobs[job_id]
+    try:
+        async with _get_worker_semaphore():
+            job["status"] = "running"
+            job["started_at"] = time.time()
+            job["result"] = await _generate(**job["params"])
+        job["status"] = "done"
+    except Exception as e:
+        job["status"] = "failed"
+        job["error"] = _format_error(e)
+    finally:
+        job["finished_at"] = time.time()
+        if job.get("cache_key"):
+            _jobs_by_key.pop(job["cache_key"], None)
+
+@mcp.tool()
+@trace_mcp_tool(mcp)
+async def submit_image_job(
+    prompt: str,
+    width: int = 512,
+    height: int = 512,
+    steps: int = 30,
+    seed: int = -1
+) -> str:
+    """
+    提交圖片生成工作並立即返回工作 ID，不必等待生成完成
+    
+    Args:
+        prompt (str): 圖片生成的提示詞
+        width (int): 圖片寬度，預設 512
+        height (int): 圖片高度，預設 512
+        steps (int): 生成步驟數，預設 30
+        seed (int): 隨機種子，預設 -1（隨機）；固定 seed 時相同參數會直接返回快取結果
+        
+    Returns:
+        str: 工作 ID 與查詢方式
+    """
+    _prune_jobs()
+    params = {"prompt": prompt, "width": width, "height": height, "steps": steps, "seed": seed}
+
+    cache_key = generation_cache_key(prompt, width, height, steps, seed) if seed != -1 else None
+    if cache_key and cache_key in _jobs_by_key:
+        job_id = _jobs_by_key[cache_key]
+        logger.info(f"相同的生成工作已在進行中：{job_id}")
+    else:
+        job_id = uuid.uuid4().hex[:12]
+        _jobs[job_id] = {
+            "status": "pending",
+            "params": params,
+            "cache_key": cache_key,
+            "created_at": time.time(),
+        }
+        if cache_key:
+            _jobs_by_key[cache_key] = job_id
+        _jobs[job_id]["task"] = asyncio.create_task(_run_job(job_id))
+        logger.info(f"已提交圖片生成工作 {job_id}，提示詞：{prompt}")
+
+    return f"已提交圖片生成工作，job_id：{job_id}。請使用 get_image_job 工具查詢結果。"
+
+@mcp.tool()
+@trace_mcp_tool(mcp)
+async def get_image_job(job_id: str, wait_seconds: int = 0) -> str:
+    """
+    查詢圖片生成工作的狀態與結果
+    
+    Args:
+        job_id (str): submit_image_job 返回的工作 ID
+        wait_seconds (int): 工作未完成時最多等待的秒數，預設 0（立即返回）
+        
+    Returns:
+        str: 完成時返回 Markdown 格式的圖片連結，否則返回工作狀態
+    """
+    job = _jobs.get(job_id)
+    if job is None:
+        return f"錯誤：找不到工作 {job_id}"
+
+    if job["status"] in ("pending", "running") and wait_seconds > 0:
+        try:
+            await asyncio.wait_for(asyncio.shield(job["task"]), timeout=wait_seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    if job["status"] == "done":
+        return _format_image_markdown(job["result"])
+    if job["status"] == "failed":
+        return job["error"]
+
+    elapsed = int(time.time() - job["created_at"])
+    status = "排隊中" if job["status"] == "pending" else "生成中"
+    return f"工作 {job_id} {status}（已等待 {elapsed} 秒），請稍後再查詢。"
+
 @mcp.tool()
+@trace_mcp_tool(mcp)
 async def generate_image(
     prompt: str,
     width: int = 512,
     height: int = 512,
-    steps: int = 30
+    steps: int = 30,
+    seed: int = -1
 ) -> str:
     """
     生成圖片的工具
@@ -43,87 +430,93 @@ async def generate_image(
         width (int): 圖片寬度，預設 512
         height (int): 圖片高度，預設 512
         steps (int): 生成步驟數，預設 30
+        seed (int): 隨機種子，預設 -1（隨機）
         
     Returns:
         str: Markdown 格式的圖片連結
     """
     logger.info(f"開始生成圖片，提示詞：{prompt}")
-    logger.info(f"參數設置 - 寬度：{width}, 高度：{height}, 步驟數：{steps}")
+    logger.info(f"參數設置 - 寬度：{width}, 高度：{height}, 步驟數：{steps}, 種子：{seed}")
     
     try:
-        # 檢查 API URL
-        api_url = os.getenv("STABLE_DIFFUSION_URL")
-        if not api_url:
-            return "錯誤：未設置 STABLE_DIFFUSION_URL"
-
-        # 設定請求參數
-        generation_params = {
-            "batch_size": 1,
-            "cfg_scale": 7,
-            "face_detector": "face_yolov8n.pt",
-            "hand_detector": "hand_yolov8n.pt",
-            "height": height,
-            "width": width,
-            "negative_prompt": "",
-            "override_settings": {
-                "sd_model_checkpoint": "sd-v1-5-inpainting.ckpt"
-            },
-            "person_detector": "person_yolov8n-seg.pt",
-            "prompt": prompt,
-            "sampler_name": "DPM++ 2M",
-            "seed": -1,
-            "steps": steps
-        }
-
-        headers = {
-            "accept": "application/json",
-            "Content-Type": "application/json"
-        }
+        async with _get_worker_semaphore():
+            result = await _generate(prompt, width, height, steps, seed)
+        return _format_image_markdown(result)
+    except Exception as e:
+        return _format_error(e)
 
-        # 使用 httpx 發送非同步請求
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{api_url}/generate",
-                headers=headers,
-                json=generation_params,
-                timeout=60  # 添加超時設定
+@mcp.tool()
+@trace_mcp_tool(mcp)
+async def generate_images(
+    images: List[Dict[str, Any]],
+    width: int = 512,
+    height: int = 512,
+    steps: int = 30,
+    sampler_name: str = DEFAULT_SAMPLER
+) -> str:
+    """
+    一次生成多張圖片，相同設定的請求會合併成一次批次生成
+    
+    Args:
+        images (List[Dict[str, Any]]): 要生成的圖片列表，每項包含：
+            prompt (str，必填)、variations (int，張數，預設 1，同組最多 MAX_VARIATIONS 張)，
+            以及可覆寫預設值的 width、height、steps、sampler_name
+        width (int): 預設圖片寬度，預設 512
+        height (int): 預設圖片高度，預設 512
+        steps (int): 預設生成步驟數，預設 30
+        sampler_name (str): 預設取樣器，預設 "DPM++ 2M"
+        
+    Returns:
+        str: Markdown 格式的所有圖片連結
+    """
+    # 依 (提示詞, 寬, 高, 步驟數, 取樣器) 分組並合併張數；
+    # 生成 API 每次只接受一個提示詞，同組的所有張數以 batch_size/n_iter 一次生成
+    groups: Dict[Tuple[str, int, int, int, str], int] = {}
+    for item in images:
+        prompt = str(item.get("prompt", "")).strip()
+        if not prompt:
+            continue
+        try:
+            key = (
+                prompt,
+                int(item.get("width", width)),
+                int(item.get("height", height)),
+                int(item.get("steps", steps)),
+                str(item.get("sampler_name", sampler_name)),
             )
-            
-            if response.status_code != 200:
-                return f"API 請求錯誤：狀態碼 {response.status_code}"
-
-            # 直接獲取文本回應，因為 API 直接返回 URL 字符串
-            image_url = response.text.strip()
-            if not image_url:
-                return "錯誤：API 返回空回應"
-            
-            # 驗證返回的 URL
-            if not image_url.startswith(('http://', 'https://')):
-                logger.error(f'無效的圖片 URL: {image_url}')
-                return "錯誤：收到無效的圖片 URL"
-
-            logger.info(f"成功獲取圖片 URL：{image_url}")
-
-            # 返回 Markdown 格式的圖片
-            return f"""
-### 生成的圖片
+            variations = int(item.get("variations", 1))
+        except (TypeError, ValueError):
+            return f"錯誤：「{prompt}」的 variations、width、height 或 steps 必須是整數"
+        if variations < 1:
+            return f"錯誤：「{prompt}」的 variations 必須大於 0"
+        groups[key] = min(groups.get(key, 0) + variations, MAX_VARIATIONS)
 
-![Generated Image]({image_url})
+    if not groups:
+        return "錯誤：未提供圖片提示詞"
 
-[點擊查看原圖]({image_url})
-"""
+    logger.info(f"批次生成 {sum(groups.values())} 張圖片，共 {len(groups)} 組")
 
-    except httpx.TimeoutException as e:
-        logger.error(f'請求超時: {e}')
-        return "錯誤：請求超時，請稍後再試"
-    except httpx.RequestError as e:
-        logger.error(f'API 請求錯誤: {e}')
-        return f"API 請求錯誤：{str(e)}"
-    except Exception as e:
-        logger.error(f'發生未知錯誤: {e}')
-        return f"發生錯誤：{str(e)}"
+    # 不同組之間並行執行（由 worker 信號量限制同時請求數）
+    outcomes = await asyncio.gather(
+        *(_generate_batch(*key, count) for key, count in groups.items()),
+        return_exceptions=True
+    )
+
+    sections = ["### 生成的圖片"]
+    for ((prompt, group_width, group_height, _, _), count), outcome in zip(groups.items(), outcomes):
+        sections.append(f"\n**{prompt}**（{group_width}x{group_height}）\n")
+        if isinstance(outcome, Exception):
+            sections.append(_format_error(outcome))
+            continue
+        for index, result in enumerate(outcome, 1):
+            sections.append(_format_image_links(result, alt=f"Generated Image {index}"))
+        if len(outcome) < count:
+            sections.append(f"注意：要求 {count} 張，只生成了 {len(outcome)} 張（缺少 {count - len(outcome)} 張）")
+
+    return "\n".join(sections)
 
 @mcp.tool()
+@trace_mcp_tool(mcp)
 def get_service_info() -> str:
     """獲取圖片生成服務的基本信息"""
     api_url = os.getenv("STABLE_DIFFUSION_URL", "未設置")
@@ -134,10 +527,15 @@ def get_service_info() -> str:
 1. 基於文字提示生成圖片
 2. 支持自定義圖片尺寸
 3. 支持調整生成步驟數
-4. 自動處理錯誤和異常情況
+4. 支持背景生成工作，提交後可稍後查詢結果
+5. 固定 seed 時相同參數直接返回快取的圖片
+6. 自動產生 WebP 縮圖，回應中優先提供縮圖連結
+7. 自動處理錯誤和異常情況
 
 使用方法：
-- 使用 generate_image 工具生成圖片
+- 使用 generate_image 工具生成圖片（等待生成完成）
+- 使用 generate_images 工具一次生成多張圖片（相同設定會合併為批次生成）
+- 使用 submit_image_job 提交生成工作，再以 get_image_job 查詢結果
 - 使用 get_service_info 工具獲取服務信息
 
 參數說明：
@@ -145,15 +543,46 @@ def get_service_info() -> str:
 - width: 圖片寬度（預設 512）
 - height: 圖片高度（預設 512）
 - steps: 生成步驟數（預設 30）
+- seed: 隨機種子（預設 -1，隨機）
+- wait_seconds: get_image_job 最多等待的秒數（預設 0）
 
 環境配置：
 - STABLE_DIFFUSION_URL: {api_url}
+- IMAGE_STORE_DIR: {image_store.root}
+- IMAGE_MAX_WORKERS: 同時進行的生成數量（預設 2）
+- IMAGE_MAX_BATCH_SIZE: 單次批次生成的最大張數（預設 4）
+- IMAGE_MAX_VARIATIONS: generate_images 同組設定最多生成的張數（預設 8）
+- IMAGE_THUMBNAIL_SIZES: 縮圖尺寸（預設 256,512）
+- IMAGE_STATIC_HOST: 靜態圖片服務監聽的位址（預設 127.0.0.1）
+- IMAGE_PUBLIC_BASE_URL: 縮圖與原圖的對外網址（預設 {IMAGE_PUBLIC_BASE_URL}）
 
 服務狀態：{'正常運行中' if check_environment() else '配置不完整'}
 """
 
+class ImageRequestHandler(SimpleHTTPRequestHandler):
+    """只提供圖片檔案，不列出目錄也不提供索引檔"""
+
+    def send_head(self):
+        if not self.path.split("?")[0].lower().endswith((".png", ".jpg", ".webp", ".gif")):
+            self.send_error(404)
+            return None
+        return super().send_head()
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+def start_static_server() -> ThreadingHTTPServer:
+    """在背景執行緒啟動靜態檔案服務，提供圖片庫中的原圖與縮圖"""
+    handler = functools.partial(ImageRequestHandler, directory=image_store.root)
+    server = ThreadingHTTPServer((IMAGE_STATIC_HOST, IMAGE_STATIC_PORT), handler)
+    threading.Thread(target=server.serve_forever, name="image-static", daemon=True).start()
+    logger.info(f"圖片靜態服務已啟動：{IMAGE_STATIC_HOST}:{IMAGE_STATIC_PORT}（對外網址 {IMAGE_PUBLIC_BASE_URL}）")
+    return server
+
 if __name__ == "__main__":
     if not check_environment():
         logger.error("環境變數設置不完整，程式終止")
         exit(1)
+    if IMAGE_DOWNLOAD and IMAGE_STATIC_PORT > 0:
+        start_static_server()
     mcp.run() 
\ No newline at end of file
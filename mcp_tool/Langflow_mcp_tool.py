@@ -1,10 +1,22 @@
 from mcp.server import FastMCP
+from mcp.server.fastmcp import Context
 import os
+import sys
+import time
+import asyncio
 import httpx
 import json
 from dotenv import load_dotenv
 import logging
-from typing import Dict, Any, List, Tuple
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple, Awaitable, Callable, Deque
+
+# 讓腳本可以匯入專案根目錄下的共用模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.intent_router import IntentRouter, Route
+from common.circuit_breaker import CircuitBreaker, CircuitOpenError
+from common.langflow import ChatHistoryStore, extract_bot_response, parse_stream_event
+from common.tracing import trace_mcp_tool
 
 # 設置日誌
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -16,32 +28,236 @@ load_dotenv()
 # 創建一個 MCP 服務器
 mcp = FastMCP("Langflow 聊天服務")
 
+# 路由表只在啟動時載入並編譯一次
+LANGFLOW_ROUTES_PATH = os.getenv(
+    "LANGFLOW_ROUTES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "langflow_routes.json")
+)
+router = IntentRouter.from_config(LANGFLOW_ROUTES_PATH)
+
+# 連線與斷路器設定
+LANGFLOW_CONNECT_TIMEOUT = float(os.getenv("LANGFLOW_CONNECT_TIMEOUT", "5"))
+LANGFLOW_READ_TIMEOUT = float(os.getenv("LANGFLOW_READ_TIMEOUT", "60"))
+LANGFLOW_MAX_CONNECTIONS = int(os.getenv("LANGFLOW_MAX_CONNECTIONS", "20"))
+LANGFLOW_FAILURE_THRESHOLD = int(os.getenv("LANGFLOW_FAILURE_THRESHOLD", "5"))
+LANGFLOW_RESET_TIMEOUT = float(os.getenv("LANGFLOW_RESET_TIMEOUT", "30"))
+LANGFLOW_SLOW_CALL_THRESHOLD = float(os.getenv("LANGFLOW_SLOW_CALL_THRESHOLD", "30"))
+# 主要流程超過此秒數仍未回應時，對同一流程的備援副本送出對沖請求（0 表示只在失敗時改送）；
+# 未設定時使用該流程近期回應時間的 p95，樣本不足時只在失敗時改送
+LANGFLOW_HEDGE_DELAY = os.getenv("LANGFLOW_HEDGE_DELAY")
+LANGFLOW_HEDGE_MIN_SAMPLES = int(os.getenv("LANGFLOW_HEDGE_MIN_SAMPLES", "20"))
+
+# 每個 session 只送出最近的對話視窗與較早對話的摘要
+history_store = ChatHistoryStore(
+    max_sessions=int(os.getenv("LANGFLOW_HISTORY_SESSIONS", "1000")),
+    max_turns=int(os.getenv("LANGFLOW_HISTORY_TURNS", "6")),
+    max_message_chars=int(os.getenv("LANGFLOW_HISTORY_MESSAGE_CHARS", "500"))
+)
+
+# 每個流程網址各自持有連線池與斷路器
+_clients: Dict[str, httpx.AsyncClient] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+# 每個流程網址最近成功請求的耗時，用來計算對沖延遲
+_latencies: Dict[str, Deque[float]] = {}
+
+
+class LangflowStatusError(Exception):
+    """Langflow API 返回非 200 狀態碼"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"狀態碼 {status_code}")
+        self.status_code = status_code
+
+
+def _get_client(api_url: str) -> httpx.AsyncClient:
+    """取得該流程網址的共用連線池"""
+    client = _clients.get(api_url)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(LANGFLOW_READ_TIMEOUT, connect=LANGFLOW_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=LANGFLOW_MAX_CONNECTIONS,
+                max_keepalive_connections=LANGFLOW_MAX_CONNECTIONS
+            )
+        )
+        _clients[api_url] = client
+    return client
+
+
+def _get_breaker(api_url: str) -> CircuitBreaker:
+    """取得該流程網址的斷路器"""
+    breaker = _breakers.get(api_url)
+    if breaker is None:
+        breaker = CircuitBreaker(
+            api_url,
+            failure_threshold=LANGFLOW_FAILURE_THRESHOLD,
+            reset_timeout=LANGFLOW_RESET_TIMEOUT,
+            slow_call_threshold=LANGFLOW_SLOW_CALL_THRESHOLD
+        )
+        _breakers[api_url] = breaker
+    return breaker
+
+
+def _hedge_delay(api_url: str) -> Optional[float]:
+    """對沖前等待主要流程的秒數；None 表示只在失敗時改送"""
+    if LANGFLOW_HEDGE_DELAY is not None:
+        return float(LANGFLOW_HEDGE_DELAY) or None
+    samples = _latencies.get(api_url)
+    if not samples or len(samples) < LANGFLOW_HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+async def _post_flow(api_url: str, headers: Dict[str, str], request_body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    向單一 Langflow 流程發送請求
+
+    Raises:
+        CircuitOpenError: 該流程的斷路器開啟中
+        LangflowStatusError: API 返回非 200 狀態碼
+        httpx.RequestError: 連線失敗或超時
+    """
+    breaker = _get_breaker(api_url)
+    breaker.check()
+
+    start = time.monotonic()
+    try:
+        response = await _get_client(api_url).post(api_url, headers=headers, json=request_body)
+    except asyncio.CancelledError:
+        # 對沖中落後而被取消不代表流程故障，只釋放半開狀態的試探名額
+        breaker.release()
+        raise
+    except httpx.RequestError:
+        breaker.record_failure()
+        raise
+
+    elapsed = time.monotonic() - start
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success(elapsed)
+
+    if response.status_code == 200:
+        _latencies.setdefault(api_url, deque(maxlen=200)).append(elapsed)
+    else:
+        raise LangflowStatusError(response.status_code)
+    return response.json()
+
+
+async def _stream_flow(
+    api_url: str,
+    headers: Dict[str, str],
+    request_body: Dict[str, Any],
+    on_token: Callable[[str], Awaitable[None]]
+) -> str:
+    """
+    使用 Langflow 串流端點發送請求，每收到一段文字就呼叫 on_token
+
+    Returns:
+        str: 完整的回應文字
+    """
+    breaker = _get_breaker(api_url)
+    breaker.check()
+
+    start = time.monotonic()
+    chunks: List[str] = []
+    final_result: Dict[str, Any] = {}
+    succeeded: Optional[bool] = None
+    try:
+        async with _get_client(api_url).stream(
+            "POST", api_url, params={"stream": "true"}, headers=headers, json=request_body
+        ) as response:
+            if response.status_code != 200:
+                # 4xx 表示流程仍正常回應，只有 5xx 算失敗
+                succeeded = response.status_code < 500
+                raise LangflowStatusError(response.status_code)
+
+            async for line in response.aiter_lines():
+                event = parse_stream_event(line)
+                if event is None:
+                    continue
+                name, data = event
+                if name == "token" and data.get("chunk"):
+                    chunks.append(data["chunk"])
+                    await on_token(data["chunk"])
+                elif name == "end":
+                    final_result = data.get("result") or {}
+                elif name == "error":
+                    succeeded = False
+                    raise LangflowStatusError(500)
+        succeeded = True
+    except httpx.RequestError:
+        succeeded = False
+        raise
+    finally:
+        # 每個出口都記錄結果；被取消或轉送失敗而中途放棄時只釋放半開狀態的試探名額
+        if succeeded is None:
+            breaker.release()
+        elif succeeded:
+            breaker.record_success(time.monotonic() - start)
+        else:
+            breaker.record_failure()
+
+    # 流程沒有逐字輸出時，從結束事件的完整結果中取出回應
+    return "".join(chunks) or extract_bot_response(final_result) or ""
+
+
+async def _post_with_hedge(route: Route, headers: Dict[str, str], request_body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    向路由的主要流程發送請求；可重複執行的查詢在主要流程失敗或超過其 p95 回應時間時
+    改送同一流程的備援副本，取先成功的回應
+    """
+    secondary_url = route.secondary_url if route.idempotent else None
+    if not secondary_url or secondary_url == route.url:
+        return await _post_flow(route.url, headers, request_body)
+
+    tasks = [asyncio.create_task(_post_flow(route.url, headers, request_body))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=_hedge_delay(route.url))
+        if done and tasks[0].exception() is None:
+            return tasks[0].result()
+
+        logger.info(f"{route.name} 主要流程{'失敗' if done else '回應過慢'}，改送備援流程")
+        tasks.append(asyncio.create_task(_post_flow(secondary_url, headers, request_body)))
+
+        last_error: BaseException = Exception("無法獲取有效回應")
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+        raise last_error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
 
 @mcp.tool()
-async def get_langflow_response(message: str) -> str:
+@trace_mcp_tool(mcp)
+async def get_langflow_response(message: str, ctx: Context, session_id: Optional[str] = None, stream: bool = False) -> str:
     """
     根據訊息內容選擇適當的 Langflow API 發送請求並獲取回應
     
     Args:
         message (str): 用戶輸入的消息
+        session_id (str): 對話 ID，同一個 ID 的請求會帶上先前的對話歷史；未提供時不帶也不保存歷史
+        stream (bool): 是否使用串流模式，邊生成邊以進度通知轉送內容
         
     Returns:
         str: Langflow 的回應
     """
     try:
-        # 直接在函數中判斷 API URL
         api_token = os.getenv("LANGFLOW_AUTH_TOKEN")
         api_key = os.getenv("LANGFLOW_API_KEY")
         
-        # 判斷使用哪個 API URL
-        if any(keyword in message for keyword in ["韓國", "男團", "女團", "偶像", "Kpop"]):
-            api_url = os.getenv("LANGFLOW_API_URL_KOREA")
-        elif any(keyword in message for keyword in ["MBTI", "人格", "性格", "測驗", "測試"]):
-            api_url = os.getenv("LANGFLOW_API_URL_MBTI")
-        elif any(keyword in message for keyword in ["輪播圖", "快速提問", "知識庫管理", "LangFlow串接"]):
-            api_url = os.getenv("LANGFLOW_API_URL_ORDER")
-        else:
-            api_url = os.getenv("LANGFLOW_API_URL_GENERAL")
+        # 依路由表判斷使用哪個 Langflow 流程
+        route = router.route(message)
+        api_url = route.url
+        logger.info(f"訊息路由至 {route.name}")
 
         if not api_url:
             return "錯誤：未設置對應的 API URL"
@@ -54,41 +270,43 @@ async def get_langflow_response(message: str) -> str:
         
         request_body = {
             "question": message,
-            "chat_history": [],
+            "chat_history": history_store.window(session_id) if session_id else [],
             "input_value": message,
             "output_type": "chat",
             "input_type": "chat"
         }
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(api_url, headers=headers, json=request_body)
-                if response.status_code != 200:
-                    return f"API 請求錯誤：狀態碼 {response.status_code}"
-                data = response.json()
-            
-            # 提取回應內容
-            bot_response = (
-                data.get('result', {}).get('output') or
-                data.get('result', {}).get('response') or
-                data.get('outputs', [{}])[0].get('output') or
-                (data.get('outputs', [{}])[0].get('outputs', [{}])[0].get('artifacts', {}).get('message')) or
-                data.get('outputs', [{}])[0].get('messages', [{}])[0].get('message', '') or
-                None
-            )
+            if stream:
+                received = 0
+
+                async def forward_token(chunk: str) -> None:
+                    nonlocal received
+                    received += len(chunk)
+                    await ctx.report_progress(received, None)
+                    await ctx.info(chunk)
+
+                bot_response = await _stream_flow(api_url, headers, request_body, forward_token)
+            else:
+                data = await _post_with_hedge(route, headers, request_body)
+                bot_response = extract_bot_response(data)
 
             if bot_response:
-                if isinstance(bot_response, dict):
-                    bot_response = (
-                        bot_response.get('text') or
-                        bot_response.get('content') or
-                        bot_response.get('message') or
-                        str(bot_response)
-                    )
+                if session_id:
+                    history_store.append(session_id, "user", message)
+                    history_store.append(session_id, "assistant", bot_response)
                 return bot_response
             
             return "無法獲取有效回應"
                 
+        except LangflowStatusError as e:
+            return f"API 請求錯誤：狀態碼 {e.status_code}"
+        except CircuitOpenError:
+            logger.warning(f"{route.name} 流程斷路器開啟中，直接返回")
+            return f"錯誤：{route.name} 流程暫時無法使用，請稍後再試"
+        except httpx.TimeoutException as e:
+            logger.error(f"API {api_url} 請求超時：{str(e)}")
+            return "錯誤：請求超時，請稍後再試"
         except httpx.RequestError as e:
             logger.error(f"API {api_url} 請求失敗：{str(e)}")
             return f"API 請求失敗：{str(e)}"
@@ -98,6 +316,13 @@ async def get_langflow_response(message: str) -> str:
         return f"發生錯誤：{str(e)}"
 
 @mcp.tool()
+@trace_mcp_tool(mcp)
+def get_route_stats() -> str:
+    """獲取各 Langflow 路由被選中的次數"""
+    return json.dumps(router.stats(), ensure_ascii=False)
+
+@mcp.tool()
+@trace_mcp_tool(mcp)
 def get_chat_info() -> str:
     """獲取聊天服務的基本信息"""
     return """
@@ -111,10 +336,23 @@ def get_chat_info() -> str:
 使用方法：
 - 直接發送消息即可開始對話
 - 使用 get_langflow_response 工具發送具體請求
+  * 提供 session_id 時，相同的 session_id 會延續對話歷史
+  * stream=True 時以進度通知逐段轉送回應
 - 使用 get_chat_info 工具獲取服務信息
+- 使用 get_route_stats 工具查看各路由的使用次數
 
 環境配置：
-- LANGFLOW_API_URL: Langflow API 的地址
+- LANGFLOW_API_URL_KOREA / _MBTI / _ORDER / _GENERAL: 各 Langflow 流程的地址
+- LANGFLOW_API_URL_GENERAL_SECONDARY: 一般流程的備援地址 (選填)
+- LANGFLOW_ROUTES_PATH: 路由表設定檔 (預設為 mcp_tool/langflow_routes.json)
+- LANGFLOW_CONNECT_TIMEOUT / LANGFLOW_READ_TIMEOUT: 連線與讀取超時秒數 (預設 5 / 60)
+- LANGFLOW_FAILURE_THRESHOLD: 斷路器開啟前允許的連續失敗次數 (預設 5)
+- LANGFLOW_RESET_TIMEOUT: 斷路器開啟後多久重新嘗試 (預設 30 秒)
+- LANGFLOW_SLOW_CALL_THRESHOLD: 超過此秒數的回應視為失敗 (預設 30)
+- LANGFLOW_HEDGE_DELAY: 主要流程超過此秒數未回應時改送備援副本 (預設依該流程近期回應時間的 p95)
+- LANGFLOW_HISTORY_TURNS: 每次請求帶上的最近訊息數 (預設 6)
+- LANGFLOW_HISTORY_MESSAGE_CHARS: 歷史訊息的截斷字數 (預設 500)
+- LANGFLOW_HISTORY_SESSIONS: 保留歷史的 session 數量上限 (預設 1000)
 - LANGFLOW_AUTH_TOKEN: 認證令牌
 - LANGFLOW_API_KEY: API 金鑰
 """
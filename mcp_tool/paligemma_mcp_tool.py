@@ -1,5 +1,7 @@
 from mcp.server import FastMCP
 import io
+import os
+import sys
 import base64
 import torch
 from PIL import Image
@@ -11,6 +13,10 @@ from transformers import (
 import logging
 from typing import Optional
 
+# 讓腳本可以匯入專案根目錄下的共用模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.tracing import trace_mcp_tool
+
 # 設置日誌
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -125,6 +131,7 @@ def process_image(
         return f"處理過程中出現錯誤: {str(e)}"
 
 @mcp.tool()
+@trace_mcp_tool(mcp)
 def process_base64_image(
     base64_image: str, 
     task_type: str,
@@ -157,6 +164,7 @@ def process_base64_image(
 
 # 新增工具函數，來驗證 Base64 字串是否有效
 @mcp.tool()
+@trace_mcp_tool(mcp)
 def validate_base64_image(base64_image: str) -> str:
     """
     驗證 Base64 編碼的圖像是否有效
@@ -193,6 +201,7 @@ def validate_base64_image(base64_image: str) -> str:
 
 # 新增工具函數，檢查 GPU 狀態
 @mcp.tool()
+@trace_mcp_tool(mcp)
 def check_gpu_status() -> str:
     """
     檢查 GPU 狀態和記憶體使用情況
@@ -221,6 +230,7 @@ def check_gpu_status() -> str:
     return "\n".join(gpu_info)
 
 @mcp.tool()
+@trace_mcp_tool(mcp)
 def get_service_info() -> str:
     """獲取圖像處理服務的基本信息"""
     return f"""
@@ -243,6 +253,7 @@ def get_service_info() -> str:
 """
 
 @mcp.tool()
+@trace_mcp_tool(mcp)
 def get_supported_tasks() -> str:
     """獲取支持的任務類型說明"""
     return """
@@ -267,6 +278,7 @@ def get_supported_tasks() -> str:
 
 # 新增批次處理功能
 @mcp.tool()
+@trace_mcp_tool(mcp)
 def process_multiple_images(
     base64_images: list[str],
     task_type: str,